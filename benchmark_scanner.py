@@ -0,0 +1,283 @@
+import argparse
+import difflib
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+import receipt_scanner
+from generate_receipt import generate_receipt_image
+
+# Receipt size classes: (name, min items, max items, share of the corpus)
+SIZE_CLASSES = [
+    ("cafe", 2, 6, 0.4),
+    ("restaurant", 8, 25, 0.35),
+    ("grocery", 40, 200, 0.25),
+]
+
+ITEM_NAMES = [
+    "Latte", "Espresso", "Cappuccino", "Croissant", "Muffin", "Bagel", "Orange Juice", "Green Tea",
+    "Bananas", "Apples", "Whole Milk", "Butter", "Cheddar", "Eggs", "Bread", "Rice", "Pasta",
+    "Tomatoes", "Onions", "Potatoes", "Carrots", "Chicken Breast", "Ground Beef", "Salmon",
+    "Yogurt", "Cereal", "Coffee Beans", "Sugar", "Flour", "Olive Oil", "Ketchup", "Mustard",
+    "Chocolate", "Cookies", "Crisps", "Sparkling Water", "Lemonade", "Shampoo", "Toothpaste",
+    "Dish Soap", "Paper Towels", "Burger", "Fries", "Caesar Salad", "Soup of the Day", "Pizza",
+    "Cheesecake", "Ice Cream", "Avocado", "Spinach", "Lettuce", "Cucumber", "Peppers", "Garlic",
+]
+SHOP_NAMES = ["CORNER CAFE", "SUPER MART", "GREEN GROCER", "CITY DINER", "FRESH MARKET"]
+CURRENCIES = ["EUR", "USD", "GBP"]
+
+
+def make_receipt(rng, size_class):
+    """Structured receipt data plus its ground truth"""
+    name, lo, hi, _ = size_class
+    items = []
+    for _ in range(rng.randint(lo, hi)):
+        items.append({
+            "item": rng.choice(ITEM_NAMES),
+            "quantity": rng.choice([1, 1, 1, 2, 3]),
+            "cost": round(rng.uniform(0.5, 40.0), 2),
+        })
+    total = round(sum(i["cost"] * i["quantity"] for i in items), 2)
+    currency = rng.choice(CURRENCIES)
+    data = {
+        "shop_name": rng.choice(SHOP_NAMES),
+        "shop_address": [f"{rng.randint(1, 200)} Main Street"],
+        "items": items,
+        "total": {"total": total},
+        # The line before "Thank you" lands in the totals section, which is
+        # where the scanner looks for the currency
+        "footer": [f"Currency {currency}", "Thank you"],
+    }
+    truth = {"size_class": name, "items": items, "total": total, "currency": currency}
+    return data, truth
+
+
+def distort(image_path, out_path, rng):
+    """Photograph-like damage: camera scale, table background, rotation, blur, noise, JPEG"""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    # The renderer draws at 400px wide; phone photos of a receipt are several
+    # times that
+    scale = rng.uniform(2.0, 3.0)
+    img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    h, w = img.shape
+    # Frame by width: padding by the height of a long grocery receipt would
+    # allocate gigabytes
+    pad = w // 4
+    background = rng.randint(40, 120)
+    img = cv2.copyMakeBorder(img, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=background)
+
+    angle = rng.uniform(-6, 6)
+    center = (img.shape[1] / 2, img.shape[0] / 2)
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    img = cv2.warpAffine(img, matrix, (img.shape[1], img.shape[0]), borderValue=background)
+
+    sigma = rng.uniform(0, 1.2)
+    if sigma > 0.3:
+        img = cv2.GaussianBlur(img, (0, 0), sigma)
+    noise = np.random.default_rng(rng.randint(0, 2 ** 31)).standard_normal(img.shape, dtype=np.float32)
+    noise *= rng.uniform(0, 12)
+    noise += img
+    img = np.clip(noise, 0, 255).astype(np.uint8)
+    cv2.imwrite(out_path, img, [cv2.IMWRITE_JPEG_QUALITY, rng.randint(70, 95)])
+    return {"scale": round(scale, 2), "angle": round(angle, 2), "blur_sigma": round(sigma, 2)}
+
+
+def build_corpus(directory, count, seed):
+    """Render a seeded corpus; returns [(image path, ground truth)]"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    weights = [c[3] for c in SIZE_CLASSES]
+    corpus = []
+    for i in range(count):
+        size_class = rng.choices(SIZE_CLASSES, weights=weights)[0]
+        data, truth = make_receipt(rng, size_class)
+        clean_path = os.path.join(directory, f"receipt-{i:04d}.png")
+        photo_path = os.path.join(directory, f"receipt-{i:04d}.jpg")
+        generate_receipt_image(data, clean_path)
+        truth["distortion"] = distort(clean_path, photo_path, rng)
+        os.unlink(clean_path)
+        with open(os.path.join(directory, f"receipt-{i:04d}.json"), "w", encoding="utf-8") as f:
+            json.dump(truth, f)
+        corpus.append((photo_path, truth))
+    return corpus
+
+
+def score_receipt(result, truth):
+    """Item matches and total/currency correctness for one receipt"""
+    predicted = list(result.get("items", []))
+    matched = 0
+    for expected in truth["items"]:
+        for i, item in enumerate(predicted):
+            same_name = difflib.SequenceMatcher(None, item["item"].lower(), expected["item"].lower()).ratio() >= 0.8
+            # The renderer prints both the unit price and the line total
+            prices = (expected["cost"], expected["cost"] * expected["quantity"])
+            if same_name and any(abs(item["cost"] - price) <= 0.01 for price in prices):
+                matched += 1
+                del predicted[i]
+                break
+    total = (result.get("total") or {}).get("total")
+    return {
+        "expected_items": len(truth["items"]),
+        "predicted_items": len(result.get("items", [])),
+        "matched_items": matched,
+        "total_correct": total is not None and abs(total - truth["total"]) <= 0.01,
+        "currency_correct": (result.get("total") or {}).get("currency") == truth["currency"],
+    }
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99),
+            "mean": round(sum(values) / len(values), 3), "count": len(values)}
+
+
+def accuracy(scores):
+    expected = sum(s["expected_items"] for s in scores)
+    predicted = sum(s["predicted_items"] for s in scores)
+    matched = sum(s["matched_items"] for s in scores)
+    precision = matched / predicted if predicted else 0.0
+    recall = matched / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    n = len(scores)
+    return {
+        "item_precision": round(precision, 4),
+        "item_recall": round(recall, 4),
+        "item_f1": round(f1, 4),
+        "total_accuracy": round(sum(s["total_correct"] for s in scores) / n, 4) if n else 0.0,
+        "currency_accuracy": round(sum(s["currency_correct"] for s in scores) / n, 4) if n else 0.0,
+    }
+
+
+def run_benchmark(corpus, scan=None):
+    """Scan every corpus image in-process and summarize"""
+    scan = scan or receipt_scanner.scan_receipt
+    stage_times: Dict[str, List[float]] = {}
+    scores = []
+    by_class: Dict[str, list] = {}
+    stages_accepted: Dict[str, int] = {}
+    errors = 0
+
+    started = time.perf_counter()
+    for path, truth in corpus:
+        info: Dict = {}
+        try:
+            result = scan(path, use_cache=False, info=info)
+        except Exception as e:
+            errors += 1
+            print(f"{path}: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        for stage, ms in info.get("timings", {}).items():
+            stage_times.setdefault(stage, []).append(ms)
+        score = score_receipt(result, truth)
+        scores.append(score)
+        by_class.setdefault(truth["size_class"], []).append(score)
+        stage = (result.get("ocr") or {}).get("stage")
+        stages_accepted[str(stage)] = stages_accepted.get(str(stage), 0) + 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scanner_version": receipt_scanner.SCANNER_VERSION,
+        "receipts": len(corpus),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(corpus) / elapsed, 3) if elapsed else None,
+        "latency_ms": {stage: percentiles(v) for stage, v in sorted(stage_times.items())},
+        "peak_rss_mb": receipt_scanner.peak_rss_mb(),
+        "accuracy": accuracy(scores),
+        "accuracy_by_size": {name: accuracy(s) for name, s in sorted(by_class.items())},
+        "accepted_by_stage": stages_accepted,
+    }
+
+
+def compare(old, new):
+    """One line per headline metric: old -> new"""
+    rows = [("throughput_rps", old.get("throughput_rps"), new.get("throughput_rps"))]
+    for key in ("p50", "p90", "p99"):
+        rows.append((f"total {key} ms", old["latency_ms"].get("total", {}).get(key),
+                     new["latency_ms"].get("total", {}).get(key)))
+    for key, value in new["accuracy"].items():
+        rows.append((key, old["accuracy"].get(key), value))
+    for key in ("self", "children"):
+        rows.append((f"peak_rss_mb {key}", (old.get("peak_rss_mb") or {}).get(key),
+                     (new.get("peak_rss_mb") or {}).get(key)))
+    return "\n".join(f"{name:24} {a!s:>10} -> {b!s:>10}" for name, a, b in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the receipt scanner on a synthetic corpus")
+    parser.add_argument("--count", type=int, default=30, help="Number of receipts in the corpus")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed")
+    parser.add_argument("--corpus-dir", default="bench_corpus",
+                        help="Where the rendered corpus is written (reused if present)")
+    parser.add_argument("--out", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="Print changes against an earlier results file")
+    parser.add_argument("--row-ocr", action="store_true",
+                        help="Benchmark per-row single-line OCR instead of whole-page OCR")
+    parser.add_argument("--low-memory", action="store_true", help="Benchmark the scanner's low-memory mode")
+    parser.add_argument("--memory-budget", type=float, default=0.0, metavar="MB",
+                        help="Per-scan memory budget (refused scans count as errors)")
+    parser.add_argument("--ocr-backend", choices=["auto", "pytesseract", "tesserocr"], default="auto",
+                        help="OCR engine to benchmark")
+    parser.add_argument("--compare-backends", action="store_true",
+                        help="Run the corpus once per OCR backend and print pytesseract -> tesserocr changes")
+    args = parser.parse_args()
+
+    receipt_scanner.ROW_OCR = args.row_ocr
+    receipt_scanner.LOW_MEMORY = args.low_memory
+    receipt_scanner.MEMORY_BUDGET_MB = args.memory_budget
+    # Learned shop profiles would let later runs skip the stage under test,
+    # and benchmark scans don't belong in the receipt history
+    receipt_scanner.SHOP_PROFILES_ENABLED = False
+    receipt_scanner.HISTORY_ENABLED = False
+
+    corpus_dir = os.path.join(args.corpus_dir, f"seed{args.seed}-n{args.count}")
+    if os.path.exists(os.path.join(corpus_dir, f"receipt-{args.count - 1:04d}.json")):
+        corpus = []
+        for i in range(args.count):
+            with open(os.path.join(corpus_dir, f"receipt-{i:04d}.json"), encoding="utf-8") as f:
+                corpus.append((os.path.join(corpus_dir, f"receipt-{i:04d}.jpg"), json.load(f)))
+    else:
+        corpus = build_corpus(corpus_dir, args.count, args.seed)
+
+    def run(backend):
+        receipt_scanner.OCR_BACKEND = backend
+        receipt_scanner._ocr_backend = None
+        results = run_benchmark(corpus)
+        results["seed"] = args.seed
+        results["row_ocr"] = args.row_ocr
+        results["low_memory"] = args.low_memory
+        results["memory_budget_mb"] = args.memory_budget
+        results["ocr_backend"] = receipt_scanner.get_ocr_backend().name
+        return results
+
+    if args.compare_backends:
+        results = {backend: run(backend) for backend in ("pytesseract", "tesserocr")}
+        print(compare(results["pytesseract"], results["tesserocr"]), file=sys.stderr)
+    else:
+        results = run(args.ocr_backend)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare and not args.compare_backends:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(json.load(f), results), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
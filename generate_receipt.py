@@ -1,104 +1,279 @@
+import argparse
+import base64
+import io
 import json
 import sys
 import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image, ImageDraw, ImageFont
 import textwrap
 
-def generate_receipt_image(receipt_data, output_path):
+# (font, bold_font, title_font), loaded once per process by get_fonts()
+_FONTS = None
+
+def get_fonts():
+    """Regular, bold and title fonts, cached for the life of the process"""
+    global _FONTS
+    if _FONTS is None:
+        try:
+            # Try to use a better font if available, otherwise use default
+            _FONTS = (ImageFont.truetype("arial.ttf", 16),
+                      ImageFont.truetype("arialbd.ttf", 18),
+                      ImageFont.truetype("arialbd.ttf", 20))
+        except OSError:
+            # Fallback to default font
+            default = ImageFont.load_default()
+            _FONTS = (default, default, default)
+    return _FONTS
+
+# Canvas layout
+WIDTH = 400
+MARGIN = 20
+LINE_HEIGHT = 25
+# Receipts taller than this are drawn and PNG-encoded one tile at a time
+TILE_HEIGHT = 4096
+
+def wrap_text(text, font, max_width):
+    """Split text into lines no wider than max_width pixels"""
+    if font.getlength(text) <= max_width:
+        return [text]
+    # Start from the number of average characters that fit and narrow down
+    # until every wrapped line does
+    chars = max(1, int(max_width / max(font.getlength("x"), 1)))
+    while True:
+        lines = textwrap.wrap(text, width=chars, break_long_words=True) or [text]
+        if chars == 1 or all(font.getlength(line) <= max_width for line in lines):
+            return lines
+        chars -= 1
+
+def layout_receipt(receipt_data):
     """
-    Generate a receipt image from receipt data
+    Layout pass: position every line of the receipt without drawing.
+
+    Returns ([(x, y, text, font), ...], exact canvas height).
     """
-    # Set up image dimensions and colors
-    width = 400
-    margin = 20
-    line_height = 25
-    current_y = margin
-    
-    # Create a new image with white background
-    image = Image.new('RGB', (width, 600), 'white')
-    draw = ImageDraw.Draw(image)
-    
-    try:
-        # Try to use a better font if available, otherwise use default
-        font = ImageFont.truetype("arial.ttf", 16)
-        bold_font = ImageFont.truetype("arialbd.ttf", 18)
-        title_font = ImageFont.truetype("arialbd.ttf", 20)
-    except:
-        # Fallback to default font
-        font = ImageFont.load_default()
-        bold_font = ImageFont.load_default()
-        title_font = ImageFont.load_default()
-    
-    # Draw title
-    draw.text((width//2 - 50, current_y), "RECEIPT", fill='black', font=title_font)
-    current_y += line_height + 10
-    
-    # Draw shop name
+    font, bold_font, title_font = get_fonts()
+    text_width = WIDTH - 2 * MARGIN
+    lines = []
+    current_y = MARGIN
+
+    # Title
+    lines.append((WIDTH//2 - 50, current_y, "RECEIPT", title_font))
+    current_y += LINE_HEIGHT + 10
+
+    # Shop name
     if 'shop_name' in receipt_data:
-        draw.text((margin, current_y), receipt_data['shop_name'], fill='black', font=bold_font)
-        current_y += line_height
-    
-    # Draw shop address
+        lines.append((MARGIN, current_y, receipt_data['shop_name'], bold_font))
+        current_y += LINE_HEIGHT
+
+    # Shop address
     if 'shop_address' in receipt_data and isinstance(receipt_data['shop_address'], list):
         for line in receipt_data['shop_address']:
-            draw.text((margin, current_y), line, fill='black', font=font)
-            current_y += line_height
-    
+            lines.append((MARGIN, current_y, line, font))
+            current_y += LINE_HEIGHT
+
     # Add some spacing
     current_y += 10
-    
-    # Draw items header
-    draw.text((margin, current_y), "Items:", fill='black', font=bold_font)
-    current_y += line_height
-    
-    # Draw items
+
+    # Items header
+    lines.append((MARGIN, current_y, "Items:", bold_font))
+    current_y += LINE_HEIGHT
+
+    # Items
     if 'items' in receipt_data and isinstance(receipt_data['items'], list):
-        total = 0
         for item in receipt_data['items']:
             item_total = item['cost'] * item['quantity']
-            total += item_total
-            
-            # Item name
-            draw.text((margin, current_y), item['item'], fill='black', font=font)
-            current_y += line_height
-            
+
+            # Item name, wrapped to the receipt width
+            for name_line in wrap_text(str(item['item']), font, text_width):
+                lines.append((MARGIN, current_y, name_line, font))
+                current_y += LINE_HEIGHT
+
             # Item details
             details = f"  Qty: {item['quantity']} x {item['cost']:.2f} = {item_total:.2f}"
-            draw.text((margin, current_y), details, fill='black', font=font)
-            current_y += line_height + 5
-        
+            lines.append((MARGIN, current_y, details, font))
+            current_y += LINE_HEIGHT + 5
+
         # Add spacing before total
         current_y += 10
-        
-        # Draw total
+
+        # Total
         if 'total' in receipt_data and isinstance(receipt_data['total'], dict):
-            draw.text((margin, current_y), f"Total: {receipt_data['total']['total']:.2f}", 
-                     fill='black', font=bold_font)
-            current_y += line_height + 10
-    
-    # Draw footer
+            lines.append((MARGIN, current_y, f"Total: {receipt_data['total']['total']:.2f}", bold_font))
+            current_y += LINE_HEIGHT + 10
+
+    # Footer
     if 'footer' in receipt_data and isinstance(receipt_data['footer'], list):
         for line in receipt_data['footer']:
-            draw.text((margin, current_y), line, fill='black', font=font)
-            current_y += line_height
-    
-    # Crop the image to fit the content
-    cropped = image.crop((0, 0, width, min(current_y + margin, 600)))
-    
+            lines.append((MARGIN, current_y, line, font))
+            current_y += LINE_HEIGHT
+
+    return lines, current_y + MARGIN
+
+def draw_lines(lines, top, height):
+    """Draw pass: allocate one canvas for rows [top, top + height) and draw the lines that touch it"""
+    # Grayscale: receipts are black on white, and it is a third of the bytes
+    # to PNG-encode
+    image = Image.new('L', (WIDTH, height), 'white')
+    draw = ImageDraw.Draw(image)
+    for x, y, text, font in lines:
+        # A line starting just above the tile can still reach into it; PIL
+        # clips whatever falls outside
+        if top - 2 * LINE_HEIGHT < y < top + height:
+            draw.text((x, y - top), text, fill='black', font=font)
+    return image
+
+def _png_chunk(out, kind, data):
+    out.write(struct.pack(">I", len(data)) + kind + data)
+    out.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+def write_png_tiles(lines, height, out, tile_height=TILE_HEIGHT):
+    """Stream an 8-bit grayscale PNG tile by tile; only one tile is ever in memory"""
+    out.write(b"\x89PNG\r\n\x1a\n")
+    _png_chunk(out, b"IHDR", struct.pack(">IIBBBBB", WIDTH, height, 8, 0, 0, 0, 0))
+    compressor = zlib.compressobj(6)
+    for top in range(0, height, tile_height):
+        rows = draw_lines(lines, top, min(tile_height, height - top)).tobytes()
+        # Each scanline is prefixed with filter type 0 (none)
+        raw = b"".join(b"\x00" + rows[i:i + WIDTH] for i in range(0, len(rows), WIDTH))
+        data = compressor.compress(raw)
+        if data:
+            _png_chunk(out, b"IDAT", data)
+    _png_chunk(out, b"IDAT", compressor.flush())
+    _png_chunk(out, b"IEND", b"")
+
+def generate_receipt_image(receipt_data, output_path=None, image_format="PNG"):
+    """
+    Generate a receipt image from receipt data.
+
+    Saves to output_path and returns it, or returns the encoded image bytes
+    when no path is given. The canvas is allocated once at the receipt's
+    exact height; PNG receipts taller than TILE_HEIGHT are streamed in tiles.
+    """
+    lines, height = layout_receipt(receipt_data)
+
+    if height > TILE_HEIGHT and image_format.upper() == "PNG":
+        if output_path is None:
+            buffer = io.BytesIO()
+            write_png_tiles(lines, height, buffer)
+            return buffer.getvalue()
+        with open(output_path, "wb") as f:
+            write_png_tiles(lines, height, f)
+        return output_path
+
+    image = draw_lines(lines, 0, height)
+
+    if output_path is None:
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format)
+        return buffer.getvalue()
+
     # Save the image
-    cropped.save(output_path)
+    image.save(output_path)
     return output_path
 
+def render_job(line, out_dir=None):
+    """Render one JSON-lines job: {"id": ..., "receipt": {...}, "output": "path.png"}.
+
+    Without "output" the image goes to <out_dir>/<id>.png, or comes back
+    base64-encoded in the response if there is no out_dir either.
+    """
+    job_id = None
+    try:
+        job = json.loads(line)
+        job_id = job.get("id")
+        output_path = job.get("output")
+        if not output_path and out_dir:
+            output_path = os.path.join(out_dir, f"{job_id}.png")
+        result = generate_receipt_image(job["receipt"], output_path)
+        if output_path:
+            return {"id": job_id, "status": "success", "path": result}
+        return {"id": job_id, "status": "success", "image": base64.b64encode(result).decode("ascii")}
+    except Exception as e:
+        return {"id": job_id, "status": "error", "message": str(e)}
+
+def iter_jobs(source):
+    """Non-empty lines from a JSON-lines file, or stdin for "-" """
+    if source == "-":
+        for line in sys.stdin:
+            if line.strip():
+                yield line
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+def render_batch(source, workers=1, out_dir=None, out=None):
+    out = out or sys.stdout
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    counts = {"rendered": 0, "errors": 0}
+
+    def emit(response):
+        counts["rendered"] += 1
+        if response["status"] != "success":
+            counts["errors"] += 1
+        out.write(json.dumps(response, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    if workers <= 1:
+        for line in iter_jobs(source):
+            emit(render_job(line, out_dir))
+            out.flush()
+        return counts
+
+    # Bound the jobs in flight so a huge input file isn't read into memory
+    max_in_flight = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for line in iter_jobs(source):
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    emit(future.result())
+                out.flush()
+            pending.add(executor.submit(render_job, line, out_dir))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                emit(future.result())
+            out.flush()
+    return counts
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Render receipt images from receipt JSON")
+    parser.add_argument("receipt_json", nargs="?",
+                        help="Receipt JSON, or - to read it from stdin")
+    parser.add_argument("output_path", nargs="?", help="Where to write the PNG")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Render JSON-lines jobs from FILE (or - for stdin), one response line each")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Batch mode: number of rendering processes")
+    parser.add_argument("--out-dir", help="Batch mode: write <id>.png here for jobs without an output path")
+    return parser.parse_args(argv)
+
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python generate_receipt.py <receipt_json> <output_path>")
+    args = parse_args(sys.argv[1:])
+
+    if args.batch:
+        counts = render_batch(args.batch, args.workers, args.out_dir)
+        print(f"Rendered {counts['rendered']} receipts ({counts['errors']} errors)", file=sys.stderr)
+        return
+
+    if not args.receipt_json or not args.output_path:
+        print("Usage: python generate_receipt.py <receipt_json|-> <output_path>")
         sys.exit(1)
-    
+
     try:
-        # Parse receipt data from command line argument
-        receipt_data = json.loads(sys.argv[1])
-        output_path = sys.argv[2]
-        
+        # Parse receipt data from the argument, or stdin for large receipts
+        if args.receipt_json == "-":
+            receipt_data = json.load(sys.stdin)
+        else:
+            receipt_data = json.loads(args.receipt_json)
+        output_path = args.output_path
+
         # Generate receipt image
         result_path = generate_receipt_image(receipt_data, output_path)
         print(json.dumps({
@@ -106,7 +281,7 @@ def main():
             "message": "Receipt generated successfully",
             "path": result_path
         }))
-        
+
     except Exception as e:
         print(json.dumps({
             "status": "error",
@@ -115,4 +290,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import difflib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Index file layout (little-endian, every array 8-byte aligned):
+#   magic, then n_names, n_grams, n_postings, names_bytes as uint64
+#   name_offsets  uint64[n_names + 1]  byte ranges into the names blob
+#   gram_counts   uint16[n_names]      distinct trigrams per name
+#   gram_hashes   uint32[n_grams]      sorted trigram hashes
+#   gram_starts   uint64[n_grams + 1]  posting ranges per trigram
+#   postings      uint32[n_postings]   name ids, by trigram count within a trigram
+#   posting_sizes uint16[n_postings]   trigram count of each posting's name
+#   names blob    UTF-8
+MAGIC = b"RCATIDX2"
+HEADER = struct.Struct("<8s4Q")
+
+# Candidates (by shared trigrams) re-scored with difflib per lookup
+CANDIDATES = 8
+# Only names with between 1/LENGTH_RATIO and LENGTH_RATIO times the query's
+# trigram count are considered; anything further off cannot score well
+LENGTH_RATIO = 2.0
+# Trigrams in more than this share of the catalog (and at least
+# MIN_COMMON_POSTINGS names) are skipped when counting, except for the
+# MIN_LISTS rarest trigrams of the query
+COMMON_FRACTION = 0.02
+MIN_COMMON_POSTINGS = 1000
+MIN_LISTS = 3
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(name):
+    """Lowercase alphanumeric tokens; single letters are usually OCR debris"""
+    return " ".join(t for t in TOKEN_RE.findall(name.lower()) if len(t) > 1 or t.isdigit())
+
+
+def trigram_hashes(normalized):
+    padded = f"  {normalized} "
+    return {zlib.crc32(padded[i:i + 3].encode("utf-8")) for i in range(len(padded) - 2)}
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def build_index(names, path):
+    """Write the trigram index for names to path (atomically)"""
+    seen = set()
+    unique = []
+    for name in names:
+        name = name.strip()
+        if name and name not in seen:
+            seen.add(name)
+            unique.append(name)
+
+    gram_lists = [trigram_hashes(normalize(name)) for name in unique]
+    gram_counts = np.array([len(g) for g in gram_lists], dtype=np.uint16)
+    pair_hashes = np.fromiter((h for grams in gram_lists for h in grams), dtype=np.uint32,
+                              count=int(gram_counts.sum(dtype=np.int64)))
+    pair_ids = np.repeat(np.arange(len(unique), dtype=np.uint32), gram_counts.astype(np.int64))
+    pair_sizes = gram_counts[pair_ids]
+    order = np.lexsort((pair_ids, pair_sizes, pair_hashes))
+    pair_hashes, postings, posting_sizes = pair_hashes[order], pair_ids[order], pair_sizes[order]
+    gram_hashes, starts = np.unique(pair_hashes, return_index=True)
+    gram_starts = np.append(starts, len(postings)).astype(np.uint64)
+
+    encoded = [name.encode("utf-8") for name in unique]
+    name_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(b) for b in encoded], out=name_offsets[1:])
+    blob = b"".join(encoded)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(unique), len(gram_hashes), len(postings), len(blob)))
+        for array in (name_offsets, gram_counts, gram_hashes.astype(np.uint32), gram_starts,
+                      postings.astype(np.uint32), posting_sizes):
+            f.write(array.tobytes())
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return len(unique)
+
+
+class ItemCatalog:
+    """Read-only, memory-mapped trigram index over product names.
+
+    Every process maps the same file, so the OS page cache holds one copy no
+    matter how many scanner workers use it.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_names, n_grams, n_postings, names_bytes = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not an item catalog index: {index_path}")
+        offset = HEADER.size
+
+        def array(dtype, count):
+            nonlocal offset
+            values = np.frombuffer(self._mm, dtype=dtype, count=count, offset=offset)
+            offset = _align(offset + values.nbytes)
+            return values
+
+        self._name_offsets = array(np.uint64, n_names + 1)
+        self._gram_counts = array(np.uint16, n_names)
+        self._gram_hashes = array(np.uint32, n_grams)
+        self._gram_starts = array(np.uint64, n_grams + 1)
+        self._postings = array(np.uint32, n_postings)
+        self._posting_sizes = array(np.uint16, n_postings)
+        self._names_at = offset
+        self.size = n_names
+
+    def name(self, name_id):
+        start = self._names_at + int(self._name_offsets[name_id])
+        end = self._names_at + int(self._name_offsets[name_id + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def _posting(self, gram_index, min_size, max_size):
+        """Ids of names containing the trigram with min_size..max_size trigrams"""
+        start, end = int(self._gram_starts[gram_index]), int(self._gram_starts[gram_index + 1])
+        sizes = self._posting_sizes[start:end]
+        lo, hi = np.searchsorted(sizes, [min_size, max_size + 1])
+        return self._postings[start + lo:start + hi]
+
+    def lookup(self, text) -> Tuple[Optional[str], float]:
+        """Closest catalog name and a 0-1 confidence (difflib ratio), or (None, 0.0)"""
+        query = normalize(text)
+        if not query or not self.size:
+            return None, 0.0
+        hashes = np.fromiter(trigram_hashes(query), dtype=np.uint32)
+        idx = np.searchsorted(self._gram_hashes, hashes)
+        found = idx < len(self._gram_hashes)
+        found[found] = self._gram_hashes[idx[found]] == hashes[found]
+        # Trigrams shared by a large share of the catalog ("ch", "ese") say
+        # little about which product this is but dominate the counting cost,
+        # so count the rarer ones only, and always at least the MIN_LISTS
+        # rarest so names made only of common trigrams still match
+        min_size, max_size = len(hashes) / LENGTH_RATIO, len(hashes) * LENGTH_RATIO
+        lists = sorted((l for l in (self._posting(i, min_size, max_size) for i in idx[found]) if len(l)),
+                       key=len)
+        common = max(MIN_COMMON_POSTINGS, int(self.size * COMMON_FRACTION))
+        lists = [l for k, l in enumerate(lists) if k < MIN_LISTS or len(l) <= common]
+        if not lists:
+            return None, 0.0
+
+        # Posting lists hold each name once, so a name's count is the number
+        # of counted trigrams it shares with the query
+        candidates, shared = np.unique(np.concatenate(lists), return_counts=True)
+        # Dice coefficient over the counted trigrams ranks the candidates
+        dice = 2.0 * shared / (len(hashes) + self._gram_counts[candidates].astype(np.float32))
+        order = np.argsort(-dice, kind="stable")[:CANDIDATES]
+
+        best, best_score = None, 0.0
+        matcher = difflib.SequenceMatcher(None, b=query)
+        for name_id in candidates[order]:
+            name = self.name(int(name_id))
+            matcher.set_seq1(normalize(name))
+            # quick_ratio() is an upper bound on ratio() and much cheaper
+            if matcher.quick_ratio() <= best_score:
+                continue
+            score = matcher.ratio()
+            if score > best_score:
+                best, best_score = name, score
+        return best, round(best_score, 3)
+
+
+def index_path_for(catalog_path):
+    return catalog_path + ".idx"
+
+
+def open_catalog(catalog_path):
+    """Map the catalog's index, (re)building it first if missing or older than the catalog"""
+    index_path = index_path_for(catalog_path)
+    try:
+        stale = os.path.getmtime(index_path) < os.path.getmtime(catalog_path)
+    except OSError:
+        stale = True
+    if not stale:
+        try:
+            return ItemCatalog(index_path)
+        except ValueError:
+            # Written by an older index format
+            pass
+    with open(catalog_path, "r", encoding="utf-8") as f:
+        build_index(f, index_path)
+    return ItemCatalog(index_path)
+
+
+def correct_items(items, catalog, min_confidence):
+    """Replace item names with their catalog match where it is confident enough.
+
+    Each item gets a "catalog_confidence"; replaced names keep the OCR text
+    in "raw_item".
+    """
+    for item in items:
+        match, confidence = catalog.lookup(item["item"])
+        item["catalog_confidence"] = confidence
+        if match is not None and confidence >= min_confidence and match != item["item"]:
+            item["raw_item"] = item["item"]
+            item["item"] = match
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a product catalog index")
+    parser.add_argument("catalog", help="Text file with one product name per line")
+    parser.add_argument("names", nargs="*", help="Names to look up (default: just build the index)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    catalog = open_catalog(args.catalog)
+    print(f"{catalog.size} products, index ready in {(time.perf_counter() - start) * 1000:.1f} ms",
+          file=sys.stderr)
+    results: List[dict] = []
+    for name in args.names:
+        match, confidence = catalog.lookup(name)
+        results.append({"query": name, "match": match, "confidence": confidence})
+    if results:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,484 @@
 import cv2
+import numpy as np
 import pytesseract
 import re
 import sys
 import json
 import os
+import argparse
+import base64
+import difflib
+import glob
+import hashlib
+import socket
+import socketserver
+import threading
+import time
+import struct
+import sqlite3
+import tempfile
+import http.server
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Dict, List, Optional, Union
+from item_catalog import correct_items, open_catalog
+from receipt_store import ReceiptStore, unpack_words
+from scan_cache import ResultCache, cache_key
+from scan_metrics import ScanMetrics, run_profiled, timed
+from scan_scheduler import QueueFull, ScanScheduler
+from shop_profiles import ShopProfiles, header_fingerprint, shop_key
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 # Configure Tesseract OCR path for Windows
 if os.name == 'nt':  # Windows
     pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-def preprocess_image(path):
-    # Check if file exists
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"Image file not found: {path}")
-    
-    img = cv2.imread(path)
+# Bump whenever preprocessing or parsing changes what a scan returns; it is
+# part of the result cache key
+SCANNER_VERSION = "1.4"
+
+# We already run several tesseract processes side by side, so keep each one
+# single-threaded instead of letting OpenMP oversubscribe the cores
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# OCR configurations tried on every receipt
+OCR_CONFIGS = [
+    "--oem 3 --psm 6",  # Default
+    "--oem 1 --psm 6",  # LSTM only
+    "--oem 3 --psm 4",  # Assume single column
+    "--oem 3 --psm 3",  # Fully automatic page segmentation
+]
+
+# Quality-gated cascade: (stage name, binarization, OCR configs run together),
+# cheapest first. Later stages only run when the earlier result does not
+# reconcile (see check_result).
+OCR_CASCADE = [
+    ("fast", "adaptive", ["--oem 3 --psm 6"]),
+    ("configs", "adaptive", ["--oem 1 --psm 6", "--oem 3 --psm 4", "--oem 3 --psm 3"]),
+    ("otsu", "otsu", ["--oem 3 --psm 6", "--oem 3 --psm 4"]),
+]
+CASCADE_ENABLED = os.environ.get("SCANNER_CASCADE", "1") != "0"
+
+# Row OCR: segment the binarized receipt into text rows and OCR each row as a
+# single line, rows side by side. When enabled (SCANNER_ROW_OCR=1) it replaces
+# the cascade's "fast" stage; benchmark_scanner.py --row-ocr compares the two.
+ROW_OCR = os.environ.get("SCANNER_ROW_OCR", "0") == "1"
+ROW_OCR_CONFIG = "--oem 3 --psm 7"
+# Rows taller than this many times the median row hold several text lines
+# that segmentation could not separate; they are OCRed as a block instead
+ROW_MERGED_FACTOR = 1.8
+ROW_BLOCK_CONFIG = "--oem 3 --psm 6"
+# Adaptive thresholding turns photo noise into speckle on every scanline, so
+# rows are found on a cleaned copy: specks up to ROW_SPECK_SIZE px are opened
+# away and blobs shorter than ROW_MIN_GLYPH_HEIGHT dropped. A scanline holds
+# text if it has more ink than the gaps between lines (the profile's 20th
+# percentile), which covers the noise the cleaning leaves behind.
+ROW_SPECK_SIZE = 3
+ROW_MIN_GLYPH_HEIGHT = 8
+
+# Multi-page receipts (PDFs, several photos of one receipt): pages are decoded
+# or rendered one at a time as page workers free up, SCANNER_PAGE_WORKERS at
+# once, and parsed as one receipt. PDF pages are rendered at SCANNER_PDF_DPI.
+PAGE_WORKERS = int(os.environ.get("SCANNER_PAGE_WORKERS", "2"))
+PDF_DPI = int(os.environ.get("SCANNER_PDF_DPI", "200"))
+# Checks that end a page's OCR cascade: a page of a long receipt rarely shows
+# the currency or totals on its own, so items are all it can be judged on
+PAGE_CHECKS = ("items",)
+
+# How OCR output is turned into items: "geometry" groups image_to_data word
+# boxes into rows and columns, "text" runs the regexes over flattened lines,
+# "auto" tries both on every OCR pass and keeps whichever checks out better
+PARSE_MODE = os.environ.get("SCANNER_PARSE_MODE", "auto")
+
+# Item sum vs subtotal/total tolerance: relative, with an absolute floor
+RECONCILE_TOLERANCE = 0.02
+RECONCILE_MIN_DIFF = 0.05
+
+# OCR engine: "pytesseract" runs the tesseract CLI for every call (a process
+# start, model load and temp file each time); "tesserocr" keeps Tesseract
+# in-process, loads each model once per worker and reads NumPy buffers
+# directly. "auto" uses tesserocr when it is installed and finds the language
+# data (TESSDATA_PREFIX, else its built-in path), pytesseract otherwise.
+OCR_BACKEND = os.environ.get("SCANNER_OCR_BACKEND", "auto")
+OCR_LANG = "eng"
+TESSDATA_DIR = os.environ.get("TESSDATA_PREFIX")
+
+# How many OCR configs run at the same time
+OCR_WORKERS = int(os.environ.get("SCANNER_OCR_WORKERS", min(len(OCR_CONFIGS), os.cpu_count() or 1)))
+
+# Result cache: SCANNER_CACHE_DIR="" keeps it memory-only, SCANNER_CACHE=0 disables it
+CACHE_ENABLED = os.environ.get("SCANNER_CACHE", "1") != "0"
+CACHE_DIR = os.environ.get("SCANNER_CACHE_DIR",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), ".scan_cache"))
+CACHE_MAX_MB = int(os.environ.get("SCANNER_CACHE_MB", "64"))
+
+# Serve mode job queue: at most SCANNER_QUEUE_SIZE scans wait for a worker
+# (more are rejected), and a scan running longer than SCANNER_JOB_TIMEOUT
+# seconds is killed (0 = no limit)
+QUEUE_SIZE = int(os.environ.get("SCANNER_QUEUE_SIZE", "64"))
+JOB_TIMEOUT = float(os.environ.get("SCANNER_JOB_TIMEOUT", "120"))
+
+# Opt-in profiling for serve/batch mode: receipts slower than
+# SCANNER_PROFILE_SLOW_MS get cProfile/tracemalloc dumps in SCANNER_PROFILE_DIR.
+# Every scan runs under the profilers, OCR threads included, so leave it off
+# unless you are chasing slow receipts (see scan_metrics.run_profiled).
+PROFILE_DIR = os.environ.get("SCANNER_PROFILE_DIR")
+PROFILE_SLOW_MS = float(os.environ.get("SCANNER_PROFILE_SLOW_MS", "5000"))
+
+# Aggregate counters/histograms for this process (the parent in serve and
+# batch mode, fed from worker responses)
+METRICS = ScanMetrics()
+
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ResultCache(CACHE_DIR or None, max_disk_bytes=CACHE_MAX_MB * 1024 * 1024)
+    return _cache
+
+# Scan history (SQLite, see receipt_store.py): SCANNER_HISTORY=0 disables it
+HISTORY_ENABLED = os.environ.get("SCANNER_HISTORY", "1") != "0"
+HISTORY_DB = os.environ.get("SCANNER_HISTORY_DB",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "receipts.db"))
+
+_history = None
+
+def get_history():
+    global _history
+    if _history is None:
+        _history = ReceiptStore(HISTORY_DB)
+    return _history
+
+# Per-shop layout profiles (see shop_profiles.py): receipts whose header
+# matches a known shop go straight to that shop's winning OCR settings.
+# SCANNER_SHOP_PROFILES=0 disables them.
+SHOP_PROFILES_ENABLED = os.environ.get("SCANNER_SHOP_PROFILES", "1") != "0"
+SHOP_PROFILES_FILE = os.environ.get("SCANNER_SHOP_PROFILES_FILE",
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".shop_profiles.json"))
+# A profile's shop name must match the fast-path OCR at least this closely
+SHOP_NAME_MATCH = 0.8
+# Margin added around a profile's learned text box, as a fraction of the receipt
+PROFILE_CROP_PAD = 0.05
+
+_shop_profiles = None
+
+def get_shop_profiles():
+    global _shop_profiles
+    if _shop_profiles is None:
+        _shop_profiles = ShopProfiles(SHOP_PROFILES_FILE or None)
+    return _shop_profiles
+
+# Product catalog (see item_catalog.py): a text file with one product name per
+# line. When set, parsed item names are corrected to their closest catalog
+# name; its index file is built once and memory-mapped by every worker.
+CATALOG_PATH = os.environ.get("SCANNER_CATALOG", "")
+# Only replace a name when the match is at least this close (0-1)
+CATALOG_MIN_CONFIDENCE = float(os.environ.get("SCANNER_CATALOG_MIN_CONFIDENCE", "0.75"))
+
+_catalog = None
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = open_catalog(CATALOG_PATH)
+    return _catalog
+
+def catalog_version():
+    """Identifies the catalog contents for the result cache key"""
+    if not CATALOG_PATH:
+        return None
+    try:
+        return [os.path.abspath(CATALOG_PATH), os.path.getmtime(CATALOG_PATH), CATALOG_MIN_CONFIDENCE]
+    except OSError:
+        return [os.path.abspath(CATALOG_PATH), None, CATALOG_MIN_CONFIDENCE]
+
+def record_history(result, image_bytes, raw_ocr=None):
+    """Add a fresh scan to the history store, keyed on the image content.
+
+    raw_ocr is the OCR output the result was parsed from (see info["raw_ocr"]),
+    stored with it so --reparse can redo the parsing without the image.
+    """
+    try:
+        get_history().add(result, "sha256:" + hashlib.sha256(image_bytes).hexdigest(), ocr=raw_ocr)
+    except sqlite3.Error as e:
+        # History is a side record; never fail the scan over it
+        print(f"Receipt history not updated: {e}", file=sys.stderr)
+
+# Preprocessing: photos are decoded at 1/2, 1/4 or 1/8 scale straight from the
+# file as long as the shorter side stays at or above DECODE_MIN_SIDE, then the
+# receipt is cropped out and resampled so text is about TARGET_TEXT_HEIGHT px.
+# The shorter side is what holds a line of text: going by the longest side
+# would shrink a long grocery receipt until its text is a few pixels tall.
+DECODE_MIN_SIDE = int(os.environ.get("SCANNER_DECODE_MIN_SIDE", "1500"))
+TARGET_TEXT_HEIGHT = int(os.environ.get("SCANNER_TEXT_HEIGHT", "28"))
+DETECT_SIDE = 600  # Working size for receipt contour detection
+
+# Low-memory mode (SCANNER_LOW_MEMORY=1): each binarized variant is written to
+# a temp file for OCR as soon as it is made and only the file is kept, so a
+# scan holds one full-resolution image besides the OCR input files
+LOW_MEMORY = os.environ.get("SCANNER_LOW_MEMORY", "0") == "1"
+# Peak memory budget per scan in MB, Tesseract processes included (0 = none).
+# A scan estimated to go over it runs fewer OCR passes at once, then decodes
+# and OCRs at a lower resolution, and is refused if that is still not enough.
+MEMORY_BUDGET_MB = float(os.environ.get("SCANNER_MEMORY_BUDGET_MB", "0"))
+# Cost model behind the estimate: a Tesseract process's own footprint plus its
+# working memory per input pixel, and the scanner's bytes per decoded pixel
+# (decoded photo, cropped receipt, glyph labels) and per OCR pixel (grayscale
+# and binarized copies)
+OCR_PROCESS_MB = 90
+OCR_BYTES_PER_PIXEL = 12
+DECODE_BYTES_PER_PIXEL = 7
+OCR_IMAGE_COPIES = 4
+LOW_MEMORY_IMAGE_COPIES = 2
+# Never shrink the normalized receipt below this scale to fit the budget
+MIN_BUDGET_SCALE = 0.5
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """A scan would need more memory than SCANNER_MEMORY_BUDGET_MB allows"""
+
+
+def estimate_memory_mb(decoded_pixels, ocr_pixels, ocr_workers):
+    """Estimated peak memory of one scan in MB (see the cost model above)"""
+    copies = LOW_MEMORY_IMAGE_COPIES if LOW_MEMORY else OCR_IMAGE_COPIES
+    decode = decoded_pixels * DECODE_BYTES_PER_PIXEL
+    ocr = ocr_pixels * copies + ocr_workers * (OCR_PROCESS_MB * 2**20 + ocr_pixels * OCR_BYTES_PER_PIXEL)
+    return max(decode, ocr) / 2**20
+
+def budget_decode_factor(size, budget_mb):
+    """Smallest decode factor >= decode_factor(size) that keeps decoding within the budget.
+
+    Only the decode itself counts here: normalize_resolution resamples to the
+    text height anyway, so OCR memory is fitted afterwards (fit_memory_budget).
+    """
+    factor = decode_factor(size)
+    while factor < 8 and estimate_memory_mb((size[0] // factor) * (size[1] // factor), 0, 0) > budget_mb:
+        factor *= 2
+    return factor
+
+def fit_memory_budget(gray, decoded_pixels, budget_mb, info):
+    """Pick how many OCR passes run at once, shrinking gray if even one does not fit.
+
+    Returns gray (possibly resized); raises MemoryBudgetExceeded when the
+    receipt would have to shrink below MIN_BUDGET_SCALE.
+    """
+    pixels = gray.shape[0] * gray.shape[1]
+    workers = OCR_WORKERS
+    while workers > 1 and estimate_memory_mb(decoded_pixels, pixels, workers) > budget_mb:
+        workers -= 1
+    estimate = estimate_memory_mb(decoded_pixels, pixels, workers)
+    if estimate > budget_mb:
+        copies = LOW_MEMORY_IMAGE_COPIES if LOW_MEMORY else OCR_IMAGE_COPIES
+        fit_pixels = (budget_mb - OCR_PROCESS_MB) * 2**20 / (copies + OCR_BYTES_PER_PIXEL)
+        scale = float(np.sqrt(fit_pixels / pixels)) if fit_pixels > 0 else 0.0
+        if scale < MIN_BUDGET_SCALE or estimate_memory_mb(decoded_pixels, 0, 1) > budget_mb:
+            raise MemoryBudgetExceeded(f"Scan needs about {estimate:.0f} MB, over the "
+                                       f"{budget_mb:g} MB memory budget")
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        info["budget_scale"] = round(scale, 3)
+        estimate = estimate_memory_mb(decoded_pixels, gray.shape[0] * gray.shape[1], workers)
+    info["ocr_workers"] = workers
+    info["memory_estimate_mb"] = round(estimate, 1)
+    return gray
+
+def peak_rss_mb():
+    """Peak resident memory so far of this process and of its largest (OCR) child process"""
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return {"self": round(own, 1), "children": round(children, 1)}
+
+_REDUCED_GRAYSCALE = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+def image_size(data):
+    """Read (width, height) from a PNG or JPEG header without decoding"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker == 0xFF:  # Fill byte
+                i += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # Markers without a length
+                i += 2
+                continue
+            # Start-of-frame markers carry the dimensions
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                h, w = struct.unpack(">HH", data[i + 5:i + 9])
+                return w, h
+            i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+def decode_factor(size):
+    """Largest reduced-decode factor that keeps the shorter side at or above DECODE_MIN_SIDE"""
+    factor = 1
+    if size:
+        while factor < 8 and min(size) // (factor * 2) >= DECODE_MIN_SIDE:
+            factor *= 2
+    return factor
+
+def load_gray(data, factor=None):
+    """Decode encoded image bytes to grayscale, reduced where the size allows"""
+    if factor is None:
+        factor = decode_factor(image_size(data))
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED_GRAYSCALE[factor])
     if img is None:
-        raise ValueError(f"Could not read image: {path}")
-        
-    # Try different preprocessing techniques for better OCR
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
-    
+        raise ValueError("Could not decode image bytes")
+    return img
+
+def _order_corners(pts):
+    # top-left, top-right, bottom-right, bottom-left
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]],
+                    dtype=np.float32)
+
+def find_receipt(gray):
+    """Return the receipt cropped and deskewed out of a photo, or None"""
+    h, w = gray.shape
+    scale = min(1.0, DETECT_SIDE / max(h, w))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    small = cv2.GaussianBlur(small, (5, 5), 0)
+
+    # Receipt paper is the large bright blob; close over the printed text
+    _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15)))
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+
+    # Paper filling the whole frame is already cropped; a small blob is noise
+    area_ratio = cv2.contourArea(contour) / float(small.shape[0] * small.shape[1])
+    if area_ratio < 0.15 or area_ratio > 0.95:
+        return None
+
+    approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+    if len(approx) == 4:
+        corners = approx.reshape(4, 2).astype(np.float32)
+    else:
+        corners = cv2.boxPoints(cv2.minAreaRect(contour)).astype(np.float32)
+    corners = _order_corners(corners / scale)
+
+    tl, tr, br, bl = corners
+    out_w = int(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl)))
+    out_h = int(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr)))
+    if out_w < 50 or out_h < 50:
+        return None
+    target = np.array([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(gray, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+def estimate_text_height(gray):
+    """Median height of glyph-sized connected components, or None"""
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Skip specks, rules and borders
+    glyphs = (heights >= 6) & (heights <= gray.shape[0] // 10) & (widths <= heights * 3)
+    if glyphs.sum() < 20:
+        return None
+    return float(np.median(heights[glyphs]))
+
+def normalize_resolution(gray):
+    """Resample so text is about TARGET_TEXT_HEIGHT pixels tall"""
+    text_height = estimate_text_height(gray)
+    if not text_height:
+        return gray, 1.0
+    scale = min(max(TARGET_TEXT_HEIGHT / text_height, 0.2), 3.0)
+    if abs(scale - 1.0) < 0.1:
+        return gray, 1.0
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation), scale
+
+def prepare_gray(source, info=None, budget_mb=None):
+    """Decode, crop to the receipt and normalize resolution; returns grayscale.
+
+    source is a path, encoded image bytes or an already decoded grayscale
+    image (a rendered PDF page). If info is a dict it gets the source and
+    decoded dimensions and whether a receipt contour was found. Under a
+    memory budget (budget_mb, default MEMORY_BUDGET_MB) it also gets the
+    estimate and the OCR concurrency the scan should use ("ocr_workers").
+    """
+    if info is None:
+        info = {}
+    if budget_mb is None:
+        budget_mb = MEMORY_BUDGET_MB
+    if isinstance(source, np.ndarray):
+        gray, size = source, None
+    else:
+        with timed(info, "read"):
+            data = read_image_bytes(source)
+        with timed(info, "decode"):
+            size = image_size(data)
+            factor = None
+            if budget_mb and size:
+                factor = budget_decode_factor(size, budget_mb)
+            gray = load_gray(data, factor)
+        # Only the decoded pixels are needed from here on
+        del data
+    if size:
+        info["source_size"] = list(size)
+    info["decoded_size"] = [gray.shape[1], gray.shape[0]]
+    info["decoded_pixels"] = int(gray.shape[0] * gray.shape[1])
+
+    with timed(info, "detect"):
+        receipt = find_receipt(gray)
+    info["receipt_found"] = receipt is not None
+    if receipt is not None:
+        gray = receipt
+        del receipt
+    with timed(info, "normalize"):
+        gray, info["scale"] = normalize_resolution(gray)
+    if budget_mb:
+        gray = fit_memory_budget(gray, info["decoded_pixels"], budget_mb, info)
+    return gray
+
+def binarize(gray, method="adaptive"):
+    # Apply Gaussian blur to reduce noise; both thresholds below then work in
+    # place on the blurred buffer instead of allocating another image
+    buf = cv2.GaussianBlur(gray, (3, 3), 0)
+    if method == "otsu":
+        # Global threshold copes better with faint thermal print on clean paper
+        cv2.threshold(buf, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=buf)
+        return buf
     # Apply adaptive thresholding for better text separation
-    thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-    
-    # Try additional preprocessing for better OCR
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))
-    morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-    
-    return morph
+    return cv2.adaptiveThreshold(buf, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2, dst=buf)
+
+def preprocess_image(source, info=None):
+    """Decode, crop to the receipt, normalize resolution and binarize.
+
+    source is a path or encoded image bytes. If info is a dict it gets the
+    source/OCR dimensions and how many pixels are handed to OCR.
+    """
+    if info is None:
+        info = {}
+    gray = prepare_gray(source, info)
+    with timed(info, "binarize:adaptive"):
+        thresh = binarize(gray)
+    del gray
+    info["ocr_size"] = [thresh.shape[1], thresh.shape[0]]
+    info["ocr_pixels"] = int(thresh.shape[0] * thresh.shape[1])
+    return thresh
 
 def detect_currency(text):
     # Use ASCII currency codes instead of symbols to avoid encoding issues
@@ -43,27 +489,400 @@ def detect_currency(text):
     if "INR" in text or "RS" in text or "₹" in text: return "INR"
     return None  # Return None instead of defaulting to INR
 
-def extract_text(img):
-    # Try multiple OCR configurations for better accuracy
-    configs = [
-        "--oem 3 --psm 6",  # Default
-        "--oem 1 --psm 6",  # LSTM only
-        "--oem 3 --psm 4",  # Assume single column
-        "--oem 3 --psm 3",  # Fully automatic page segmentation
-    ]
-    
-    best_text = ""
-    
-    for config in configs:
+# Imported after OMP_THREAD_LIMIT is set, so in-process Tesseract honors it too
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OEM_RE = re.compile(r"--oem\s+(\d+)")
+PSM_RE = re.compile(r"--psm\s+(\d+)")
+CONFIG_VARIABLE_RE = re.compile(r"-c\s+(\w+)=(\S+)")
+TSV_COLUMNS = ["level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text"]
+
+def parse_ocr_config(config):
+    """(oem, psm, ((variable, value), ...)) from a tesseract command-line config"""
+    oem = OEM_RE.search(config)
+    psm = PSM_RE.search(config)
+    return (int(oem.group(1)) if oem else 3, int(psm.group(1)) if psm else 3,
+            tuple(CONFIG_VARIABLE_RE.findall(config)))
+
+def tsv_to_data(tsv):
+    """Tesseract TSV output as the column dict pytesseract's image_to_data returns"""
+    data: Dict[str, list] = {column: [] for column in TSV_COLUMNS}
+    for line in tsv.splitlines():
+        fields = line.split("\t")
+        if len(fields) < 11 or not fields[0].isdigit():
+            continue  # Header or blank line
+        fields += [""] * (len(TSV_COLUMNS) - len(fields))
+        for column, value in zip(TSV_COLUMNS, fields):
+            data[column].append(value if column == "text" else float(value) if column == "conf" else int(value))
+    return data
+
+class PytesseractBackend:
+    """The tesseract CLI through pytesseract: one process, model load and temp file per call"""
+
+    name = "pytesseract"
+    # Arrays are re-encoded for every call, so run_ocr_configs hands it a file
+    wants_file = True
+
+    def data(self, img, config, timeout=0):
+        return pytesseract.image_to_data(img, config=config, output_type=pytesseract.Output.DICT,
+                                         timeout=timeout)
+
+    def text(self, img, config):
+        return pytesseract.image_to_string(img, config=config)
+
+class TesserocrBackend:
+    """Tesseract in-process through tesserocr.
+
+    Engines are initialized per (OEM, config variables) on first use and
+    then reused from an idle pool, so a worker loads each model once per OCR
+    thread instead of once per call. Images go in as NumPy buffers.
+    """
+
+    name = "tesserocr"
+    wants_file = False
+
+    def __init__(self, path=None, lang=OCR_LANG):
+        self.path = os.path.join(path, "") if path else tesserocr.get_languages()[0]
+        self.lang = lang
+        self._idle: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def _run(self, img, config, timeout, output):
+        oem, psm, variables = parse_ocr_config(config)
+        key = (oem, variables)
+        with self._lock:
+            idle = self._idle.get(key)
+            api = idle.pop() if idle else None
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(path=self.path, lang=self.lang, oem=oem)
+            for name, value in variables:
+                api.SetVariable(name, value)
         try:
-            # Get text with confidence
-            text = pytesseract.image_to_string(img, config=config)
-            if len(text) > len(best_text):  # Simple heuristic for better text
-                best_text = text
-        except:
+            api.SetPageSegMode(psm)
+            if isinstance(img, str):
+                api.SetImageFile(img)
+            else:
+                # Tesseract reads the buffer during Recognize, so keep it referenced until then
+                img = np.ascontiguousarray(img)
+                bytes_per_pixel = 1 if img.ndim == 2 else img.shape[2]
+                api.SetImageBytes(img.tobytes(), img.shape[1], img.shape[0], bytes_per_pixel,
+                                  img.shape[1] * bytes_per_pixel)
+            if not api.Recognize(int(timeout * 1000)):
+                raise RuntimeError("Tesseract process timeout")
+            return output(api)
+        finally:
+            with self._lock:
+                self._idle.setdefault(key, []).append(api)
+
+    def data(self, img, config, timeout=0):
+        return tsv_to_data(self._run(img, config, timeout, lambda api: api.GetTSVText(0)))
+
+    def text(self, img, config):
+        return self._run(img, config, 0, lambda api: api.GetUTF8Text())
+
+def tesserocr_available():
+    """Whether tesserocr is installed and finds the OCR_LANG model"""
+    if tesserocr is None:
+        return False
+    try:
+        _, languages = tesserocr.get_languages(os.path.join(TESSDATA_DIR, "")) if TESSDATA_DIR \
+            else tesserocr.get_languages()
+    except RuntimeError:
+        return False
+    return OCR_LANG in languages
+
+def make_ocr_backend(name):
+    if name == "auto":
+        name = "tesserocr" if tesserocr_available() else "pytesseract"
+    if name == "pytesseract":
+        return PytesseractBackend()
+    if name == "tesserocr":
+        if tesserocr is None:
+            raise RuntimeError("The tesserocr OCR backend needs the tesserocr package")
+        return TesserocrBackend(TESSDATA_DIR)
+    raise ValueError(f"Unknown OCR backend: {name}")
+
+_ocr_backend = None
+
+def get_ocr_backend():
+    global _ocr_backend
+    if _ocr_backend is None:
+        _ocr_backend = make_ocr_backend(OCR_BACKEND)
+    return _ocr_backend
+
+def ocr_words(img, config, timeout=0):
+    """One OCR pass with word boxes; returns (word boxes, mean word confidence)"""
+    data = get_ocr_backend().data(img, config, timeout=timeout)
+    words = []
+    for i, text in enumerate(data["text"]):
+        text = text.strip()
+        if not text:
             continue
-    
-    return best_text if best_text else pytesseract.image_to_string(img, config="--oem 3 --psm 6")
+        words.append({
+            "text": text,
+            "conf": float(data["conf"][i]),
+            "left": int(data["left"][i]),
+            "top": int(data["top"][i]),
+            "width": int(data["width"][i]),
+            "height": int(data["height"][i]),
+            "line": (data["block_num"][i], data["par_num"][i], data["line_num"][i]),
+        })
+    confidences = [w["conf"] for w in words if w["conf"] >= 0]
+    score = sum(confidences) / len(confidences) if confidences else 0.0
+    return words, score
+
+def words_to_text(words):
+    # Tesseract's own line grouping, one line per (block, paragraph, line)
+    lines: Dict[tuple, List[str]] = {}
+    for w in words:
+        lines.setdefault(w["line"], []).append(w["text"])
+    return "\n".join(" ".join(texts) for texts in lines.values())
+
+def segment_rows(img):
+    """(top, bottom, left, right) boxes of the text rows in a binarized image, top to bottom"""
+    ink = (img < 128).astype(np.uint8)
+    cv2.morphologyEx(ink, cv2.MORPH_OPEN,
+                     cv2.getStructuringElement(cv2.MORPH_RECT, (ROW_SPECK_SIZE, ROW_SPECK_SIZE)), dst=ink)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    glyphs = stats[:, cv2.CC_STAT_HEIGHT] >= ROW_MIN_GLYPH_HEIGHT
+    glyphs[0] = False  # Background
+    ink = glyphs[labels]
+    del labels
+    h, w = ink.shape
+    profile = ink.sum(axis=1)
+    gaps = np.percentile(profile, 20)
+    has_ink = profile > gaps + max(1, w // 200)
+    # Row spans: runs of inked scanlines, bridging gaps no taller than the
+    # specks opened away (a thin stroke can go with them)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], has_ink.astype(np.int8), [0]))))
+    spans = []
+    for top, bottom in zip(edges[::2], edges[1::2]):
+        if spans and top - spans[-1][1] <= ROW_SPECK_SIZE:
+            spans[-1][1] = bottom
+        else:
+            spans.append([top, bottom])
+    spans = [(top, bottom) for top, bottom in spans if bottom - top >= 4]
+    if not spans:
+        return []
+
+    pad = max(2, int(np.median([bottom - top for top, bottom in spans])) // 4)
+    rows = []
+    for top, bottom in spans:
+        columns = np.flatnonzero(ink[top:bottom].any(axis=0))
+        rows.append((max(0, int(top) - pad), min(h, int(bottom) + pad),
+                     max(0, int(columns[0]) - pad), min(w, int(columns[-1]) + 1 + pad)))
+    return rows
+
+def _ocr_row(img, box, index, config, timeout):
+    top, bottom, left, right = box
+    # Tesseract reads single lines more reliably with some white around them
+    crop = cv2.copyMakeBorder(img[top:bottom, left:right], 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=255)
+    words, _ = ocr_words(crop, config, timeout=timeout)
+    for w in words:
+        w["left"] += left - 10
+        w["top"] += top - 10
+        w["line"] = (index,) + w["line"][1:]
+    return words
+
+def ocr_rows(img, config=ROW_OCR_CONFIG, timeout=0, workers=None):
+    """OCR a binarized image (or image file) row by row; returns (word boxes, mean word confidence) like ocr_words"""
+    if isinstance(img, str):
+        img = cv2.imread(img, cv2.IMREAD_GRAYSCALE)
+    rows = segment_rows(img)
+    if not rows:
+        return [], 0.0
+    median_height = float(np.median([bottom - top for top, bottom, _, _ in rows]))
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def row_timeout():
+        return 0 if deadline is None else max(deadline - time.monotonic(), 0.001)
+
+    workers = max(1, min(workers or OCR_WORKERS, len(rows)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_ocr_row, img, box, index,
+                                   ROW_BLOCK_CONFIG if box[1] - box[0] > ROW_MERGED_FACTOR * median_height
+                                   else config, row_timeout())
+                   for index, box in enumerate(rows)]
+        # Rows come back in reading order, ready for split_sections
+        words = [w for future in futures for w in future.result()]
+    confidences = [w["conf"] for w in words if w["conf"] >= 0]
+    score = sum(confidences) / len(confidences) if confidences else 0.0
+    return words, score
+
+def is_row_config(config):
+    return "--psm 7" in config
+
+def _timed_ocr_words(img, config, timeout, info, label, row_workers=None):
+    with timed(info, f"{label} {config}"):
+        if is_row_config(config):
+            return ocr_rows(img, config, timeout=timeout, workers=row_workers)
+        return ocr_words(img, config, timeout=timeout)
+
+def write_ocr_input(img):
+    """Encode img once to a temp PNG that any number of OCR passes can read; the caller deletes it"""
+    fd, path = tempfile.mkstemp(prefix="scan-", suffix=".png")
+    os.close(fd)
+    # Binarized receipts compress well even at the fastest level
+    if not cv2.imwrite(path, img, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+        os.unlink(path)
+        raise OSError(f"Could not write OCR input {path}")
+    return path
+
+def run_ocr_configs(img, configs, deadline=None, workers=None, info=None, label="ocr"):
+    """Run OCR configs side by side; return [(config, text, confidence, words)].
+
+    img is an image or an image file written by write_ocr_input; for a
+    backend that reads files, an image is encoded once for all configs
+    rather than once per call.
+    deadline is a time.monotonic() value; once it passes we return whatever
+    finished so far and kill the tesseract calls still running. Each call's
+    time goes into info["timings"] as "<label> <config>".
+    If no config returned words and the last one failed with nothing cut
+    off by the deadline (no tesseract binary, a broken backend), that
+    failure is raised rather than reported as an empty page.
+    """
+    # The OCR process limit (capped by fit_memory_budget) covers row OCR too:
+    # each config thread running rows gets an equal share of it
+    max_workers = workers or (info or {}).get("ocr_workers") or OCR_WORKERS
+    workers = max(1, min(max_workers, len(configs)))
+    row_workers = max(1, max_workers // workers)
+    input_path = None
+    if (get_ocr_backend().wants_file and not isinstance(img, str)
+            and not all(is_row_config(config) for config in configs)):
+        with timed(info, "encode"):
+            input_path = img = write_ocr_input(img)
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def timeout():
+        # The backends treat 0 as "no timeout"
+        left = remaining()
+        return 0 if left is None else max(left, 0.001)
+
+    results = []
+    error = None
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(_timed_ocr_words, img, config, timeout(), info, label, row_workers): config
+                   for config in configs}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                break  # Deadline reached
+            for future in done:
+                try:
+                    words, score = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if words:
+                    results.append((futures[future], words_to_text(words), score, words))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if input_path is not None:
+            # Calls still running past the deadline time out on their own
+            # and their results are dropped, so the file can go now
+            os.unlink(input_path)
+    # A call killed at the deadline fails too; that is a timeout, not a broken OCR
+    cut_off = pending or (deadline is not None and time.monotonic() >= deadline)
+    if not results and error is not None and not cut_off:
+        raise error
+    return results
+
+def extract_text(img, deadline=None, workers=None, info=None):
+    # Run all OCR configurations at once and keep the most confident result
+    results = run_ocr_configs(img, OCR_CONFIGS, deadline=deadline, workers=workers, info=info)
+    if results:
+        _, text, _, _ = max(results, key=lambda r: (r[2], len(r[1])))
+        return text
+    if deadline is not None:
+        return ""
+    return get_ocr_backend().text(img, OCR_CONFIGS[0])
+
+# ---------------------------------------------------------------------------
+# Parsing patterns, compiled once at import time
+# ---------------------------------------------------------------------------
+
+# Section switches in split_sections
+TOTALS_LINE_RE = re.compile(r"total|tax|vat|svc|service|amount due|balance due")
+FOOTER_LINE_RE = re.compile(r"thank|have a nice day|visit again|save environment|return policy|come again")
+ITEMS_START_RE = re.compile(r"\d+[.,]?\d{1,2}|€|\$|£|rs|inr|eur|usd|gbp")
+
+# Lines containing any of these are never items
+SKIP_KEYWORDS = ["receipt", "date", "cashier", "subtotal", "tax", "vat",
+                 "total", "cash", "change", "service", "thank", "shop", "supermarket",
+                 "tel", "phone", "invoice", "bill", "paid", "taxable", "vatise", "cane", "paid with",
+                 "tendered", "order", "time", "come again", "dining"]
+# One alternation so each line is scanned once instead of once per keyword
+SKIP_KEYWORDS_RE = re.compile("|".join(re.escape(kw) for kw in SKIP_KEYWORDS))
+
+# Descriptions matching any of these are not items. Trailing \d+ / \d* are
+# dropped where they cannot change whether a search matches, which avoids
+# backtracking over long digit runs.
+INVALID_DESCRIPTION_RE = re.compile("|".join([
+    r"cashier.*\d",  # Cashier with numbers
+    r"order.*\d",    # Order with numbers
+    r"date.*\d",     # Date with numbers
+    r"time.*\d",     # Time with numbers
+    r"\d-\d",        # Phone numbers
+    r"receipt",      # Receipt keyword
+    r"tel",          # Tel keyword
+    r"phone",        # Phone keyword
+    r"invoice",      # Invoice keyword
+    r"bill",         # Bill keyword
+    r"paid",         # Paid keyword
+    r"tendered",     # Tendered keyword
+    r"change",       # Change keyword
+]))
+DATE_RE = re.compile(r"\d+/\d+/?\d*$")  # Date pattern like 312/12/2023
+TIME_RE = re.compile(r"\d+:\d+$")       # Time pattern
+SINGLE_LETTER_RE = re.compile(r"[a-z]$")
+PHONE_RE = re.compile(r"\d-\d")
+
+# Item line patterns, most specific first. Each entry is
+# (pattern, qty group, description group, price group); a qty group of None
+# means the line has no quantity and we assume 1.
+ITEM_PATTERNS = [
+    (re.compile(r"(\d+)\s*x\s*(.+?)\s+([€$£]?\s*[\d,.]+)$", re.IGNORECASE), 1, 2, 3),  # Qty x Item price (explicit x)
+    (re.compile(r"(.+?)\s+(\d+)\s*x\s*([€$£]?\s*[\d,.]+)$", re.IGNORECASE), 2, 1, 3),  # Item Qty x price (explicit x)
+    (re.compile(r"(\d+)\s+(.+?)\s+([€$£]?\s*[\d,.]+)$", re.IGNORECASE), 1, 2, 3),      # Qty item price
+    (re.compile(r"(.+?)\s+([€$£]?\s*[\d,.]+)$", re.IGNORECASE), None, 1, 2),           # Item price
+    (re.compile(r"(.+?)\s+(\d+[.,]\d{2})$", re.IGNORECASE), None, 1, 2),               # Item price without symbol
+]
+TRAILING_PRICE_RE = re.compile(r"([€$£]?\s*[\d,.]+)$")
+LEADING_QTY_RE = re.compile(r"^\d+\s*x?\s*")
+CURRENCY_SYMBOL_RE = re.compile(r"[€$£]")
+TOTAL_VALUE_RE = re.compile(r"(\d+[.,]?\d{1,2})")
+
+# Whole-token patterns for geometry parsing; fullmatch on single words, so
+# there is nothing to backtrack over
+PRICE_TOKEN_RE = re.compile(r"[€$£]?\d[\d,.]*")
+QTY_TOKEN_RE = re.compile(r"(\d{1,3})[xX]?")
+CURRENCY_TOKENS = {"€", "$", "£"}
+
+# Common OCR errors in digits: O→0, S→5, I→1, Z→2, B→8, G→6, Q→0
+OCR_DIGIT_FIXES = str.maketrans("OSIZBGQ", "0512860")
+
+def normalize_decimal(value):
+    """Turn '1.234,50' / '1,234.50' / '12,50' into a float()-able string"""
+    if ',' in value and '.' in value:
+        # Both present, use the last one as decimal separator
+        if value.rfind(',') > value.rfind('.'):
+            return value.replace('.', '').replace(',', '.')
+        return value.replace(',', '')
+    if ',' in value:
+        return value.replace(',', '.')
+    return value
+
+def clean_price(price_str):
+    price_str = price_str.translate(OCR_DIGIT_FIXES)
+    return CURRENCY_SYMBOL_RE.sub('', price_str).strip()
 
 def split_sections(lines):
     header, items, totals, footer = [], [], [], []
@@ -76,11 +895,11 @@ def split_sections(lines):
 
         # Detect section switches with improved logic
         l_lower = l_strip.lower()
-        if re.search(r"(total|tax|vat|svc|service|amount due|balance due)", l_lower):
+        if TOTALS_LINE_RE.search(l_lower):
             section = "totals"
-        elif re.search(r"(thank|have a nice day|visit again|save environment|return policy|come again)", l_lower):
+        elif FOOTER_LINE_RE.search(l_lower):
             section = "footer"
-        elif section == "header" and re.search(r"(\d+[.,]?\d{1,2}|€|\$|£|rs|inr|eur|usd|gbp)", l_lower):
+        elif section == "header" and ITEMS_START_RE.search(l_lower):
             section = "items"
 
         # Append line to section
@@ -98,212 +917,96 @@ def split_sections(lines):
 def is_valid_item_description(desc):
     """Check if a description is likely to be a valid item"""
     # Skip if it looks like a date, time, or other non-item text
-    if re.match(r"^\d+/\d+/?\d*$", desc):  # Date pattern like 312/12/2023
-        return False
-    if re.match(r"^\d+:\d+$", desc):  # Time pattern
+    if DATE_RE.match(desc) or TIME_RE.match(desc):
         return False
     if len(desc) < 2:  # Too short
         return False
-    if re.match(r"^[a-z]$", desc):  # Single letter
+    if SINGLE_LETTER_RE.match(desc):  # Single letter
         return False
     # Skip common non-item words and patterns
-    skip_patterns = [
-        r"cashier.*\d+",  # Cashier with numbers
-        r"order.*\d+",    # Order with numbers
-        r"date.*\d+",     # Date with numbers
-        r"time.*\d+",     # Time with numbers
-        r"\d+-\d+-?\d*",  # Phone numbers
-        r"receipt",       # Receipt keyword
-        r"tel",           # Tel keyword
-        r"phone",         # Phone keyword
-        r"invoice",       # Invoice keyword
-        r"bill",          # Bill keyword
-        r"paid",          # Paid keyword
-        r"tendered",      # Tendered keyword
-        r"change",        # Change keyword
-    ]
-    
-    desc_lower = desc.lower()
-    for pattern in skip_patterns:
-        if re.search(pattern, desc_lower):
-            return False
-            
-    return True
+    return not INVALID_DESCRIPTION_RE.search(desc.lower())
+
+# Item prices outside this range are quantities, codes or misreads
+MIN_ITEM_PRICE = 0.01
+MAX_ITEM_PRICE = 10000
 
-def parse_items(items, receipt_currency):
+def make_item(desc, qty, price_str, currency, check_range=True):
+    """Validate one candidate item; returns the item dict or None.
+
+    With check_range=False the price range is left to validate_batch.
+    """
+    # Validate item description
+    if not is_valid_item_description(desc):
+        return None
+    try:
+        price = float(normalize_decimal(price_str))
+    except ValueError:
+        # Skip lines that can't be parsed as prices
+        return None
+    # Skip very small prices that might be quantities or invalid
+    if check_range and (price < MIN_ITEM_PRICE or price > MAX_ITEM_PRICE):  # Reasonable price range
+        return None
+    return {
+        "item": desc,
+        "quantity": qty,
+        "cost": price,
+        "currency": currency
+    }
+
+def clean_item_line(l):
+    """Strip OCR artifacts; returns None for lines that can never be items"""
+    l = l.replace('|', '').strip()
+    if not l or SKIP_KEYWORDS_RE.search(l.lower()):
+        return None
+    l = l.replace(':', '').strip()
+    # Skip lines that look like phone numbers or other non-item patterns
+    if PHONE_RE.search(l):
+        return None
+    return l
+
+def parse_items(items, receipt_currency, check_range=True):
     parsed = []
-    skip_keywords = ["receipt", "date", "cashier", "subtotal", "tax", "vat",
-                     "total", "cash", "change", "service", "thank", "shop", "supermarket",
-                     "tel", "phone", "invoice", "bill", "paid", "taxable", "vatise", "cash", "cane", "paid with",
-                     "tendered", "order", "time", "come again", "dining"]
+    # Use receipt currency or default to USD for restaurant receipts
+    final_currency = receipt_currency if receipt_currency else "USD"
 
-    # Filter out skip keywords and clean items
-    filtered_items = []
     for l in items:
-        l_clean = l.replace('|', '').strip()
-        l_lower = l_clean.lower()
-        if not any(kw in l_lower for kw in skip_keywords) and l_clean:
-            filtered_items.append(l_clean)
-    
-    # Process items with more flexible pattern matching
-    for l in filtered_items:
-        # Clean up OCR artifacts in the line
-        l = l.replace(':', '').strip()
-        
-        # Skip lines that look like phone numbers or other non-item patterns
-        if re.match(r".*\d+-\d+-?\d*.*", l):
+        l = clean_item_line(l)
+        if l is None:
             continue
             
         # Look for item patterns with more flexibility for OCR errors
-        # More specific patterns first to avoid incorrect matches
-        patterns = [
-            r"(\d+)\s*x\s*(.+?)\s+([€$£]?\s*[\d,.]+)$",  # Qty x Item price with currency symbol (explicit x)
-            r"(.+?)\s+(\d+)\s*x\s*([€$£]?\s*[\d,.]+)$",  # Item Qty x price with currency symbol (explicit x)
-            r"(\d+)\s+(.+?)\s+([€$£]?\s*[\d,.]+)$",      # Qty item price with currency symbol
-            r"(.+?)\s+([€$£]?\s*[\d,.]+)$",              # Item price with currency symbol
-            r"(.+?)\s+(\d+[.,]\d{2})$",                  # Item price without currency symbol
-        ]
-        
-        matched = False
-        for pattern in patterns:
-            m = re.search(pattern, l, re.IGNORECASE)
-            if m:
-                if pattern == patterns[0]:  # Qty x Item price with currency symbol (explicit x)
-                    qty_str = m.group(1)
-                    desc = m.group(2).strip()
-                    price_str = m.group(3)
-                elif pattern == patterns[1]:  # Item Qty x price with currency symbol (explicit x)
-                    desc = m.group(1).strip()
-                    qty_str = m.group(2)
-                    price_str = m.group(3)
-                elif pattern == patterns[2]:  # Qty item price with currency symbol
-                    qty_str = m.group(1)
-                    desc = m.group(2).strip()
-                    price_str = m.group(3)
-                elif pattern == patterns[3]:  # Item price with currency symbol
-                    desc = m.group(1).strip()
-                    qty_str = "1"
-                    price_str = m.group(2)
-                elif pattern == patterns[4]:  # Item price without currency symbol
-                    desc = m.group(1).strip()
-                    qty_str = "1"
-                    price_str = m.group(2)
-                else:
-                    continue
-                
-                # Fix common OCR errors in quantity (conservative approach)
-                # Common OCR errors: O→0, S→5, I→1, Z→2, B→8, G→6
-                qty_str = qty_str.replace('O', '0').replace('S', '5').replace('I', '1').replace('Z', '2')
-                qty_str = qty_str.replace('B', '8').replace('G', '6').replace('Q', '0')
-                try:
-                    qty = int(qty_str)
-                except:
-                    qty = 1  # Default to 1 if we can't parse the quantity
-                
-                # Clean up OCR errors in price and description
-                price_str = price_str.replace('O', '0').replace('S', '5').replace('I', '1').replace('Z', '2')
-                price_str = price_str.replace('B', '8').replace('G', '6').replace('Q', '0')
-                price_str = re.sub(r'[€$£]', '', price_str).strip()
-                desc = re.sub(r'^\d+\s*x?\s*', '', desc).strip()  # Remove leading numbers that might be quantities
-                
-                # Validate item description
-                if not is_valid_item_description(desc):
-                    continue
-                
-                # Extract numeric value
-                try:
-                    # Handle both comma and period as decimal separator
-                    if ',' in price_str and '.' in price_str:
-                        # Both present, use the last one as decimal separator
-                        if price_str.rfind(',') > price_str.rfind('.'):
-                            price_str = price_str.replace('.', '').replace(',', '.')
-                        else:
-                            price_str = price_str.replace(',', '')
-                    elif ',' in price_str:
-                        price_str = price_str.replace(',', '.')
-                    
-                    price = float(price_str)
-                    
-                    # Skip very small prices that might be quantities or invalid
-                    if price < 0.01 or price > 10000:  # Reasonable price range
-                        continue
-                        
-                    # Use receipt currency or default to a common currency
-                    final_currency = receipt_currency if receipt_currency else "USD"  # Default to USD for restaurant receipts
-                    
-                    # Only add if we have a meaningful description
-                    if len(desc) > 1:
-                        parsed.append({
-                            "item": desc,
-                            "quantity": qty,
-                            "cost": price,
-                            "currency": final_currency
-                        })
-                        matched = True
-                        break
-                except ValueError:
-                    # Skip lines that can't be parsed as prices
-                    continue
+        item = None
+        for pattern, qty_group, desc_group, price_group in ITEM_PATTERNS:
+            m = pattern.search(l)
+            if not m:
+                continue
+
+            # Fix common OCR errors in quantity (conservative approach)
+            try:
+                qty = int(m.group(qty_group).translate(OCR_DIGIT_FIXES)) if qty_group else 1
+            except ValueError:
+                qty = 1  # Default to 1 if we can't parse the quantity
+            
+            # Clean up OCR errors in price and description
+            desc = LEADING_QTY_RE.sub('', m.group(desc_group).strip()).strip()  # Remove leading quantities
+            item = make_item(desc, qty, clean_price(m.group(price_group)), final_currency, check_range)
+            if item:
+                break
         
         # If no pattern matched, try a more general approach
-        if not matched:
+        if not item:
             # Look for any number that might be a price at the end of the line
-            price_match = re.search(r"([€$£]?\s*[\d,.]+)$", l)
+            price_match = TRAILING_PRICE_RE.search(l)
             if price_match:
-                price_str = price_match.group(1)
-                # Clean up OCR errors in price
-                price_str = price_str.replace('O', '0').replace('S', '5').replace('I', '1').replace('Z', '2')
-                price_str = price_str.replace('B', '8').replace('G', '6').replace('Q', '0')
-                price_str = re.sub(r'[€$£]', '', price_str).strip()
-                
-                try:
-                    # Handle both comma and period as decimal separator
-                    if ',' in price_str and '.' in price_str:
-                        # Both present, use the last one as decimal separator
-                        if price_str.rfind(',') > price_str.rfind('.'):
-                            price_str = price_str.replace('.', '').replace(',', '.')
-                        else:
-                            price_str = price_str.replace(',', '')
-                    elif ',' in price_str:
-                        price_str = price_str.replace(',', '.')
-                    
-                    price = float(price_str)
-                    
-                    # Skip very small prices or unreasonable prices
-                    if price < 0.01 or price > 10000:
-                        continue
-                    
-                    # Extract item description (everything before the price)
-                    desc = l[:price_match.start()].strip()
-                    # Remove any remaining numbers that might be quantities
-                    desc = re.sub(r"^\d+\s*x?\s*", "", desc).strip()
-                    
-                    # Validate item description
-                    if not is_valid_item_description(desc):
-                        continue
-                    
-                    if desc and len(desc) > 1:  # Only add if we have a meaningful description
-                        # Use receipt currency or default to USD for restaurant receipts
-                        final_currency = receipt_currency if receipt_currency else "USD"
-                        
-                        parsed.append({
-                            "item": desc,
-                            "quantity": 1,
-                            "cost": price,
-                            "currency": final_currency
-                        })
-                except ValueError:
-                    # Skip lines that can't be parsed as prices
-                    continue
+                # Extract item description (everything before the price)
+                desc = LEADING_QTY_RE.sub('', l[:price_match.start()].strip()).strip()
+                item = make_item(desc, 1, clean_price(price_match.group(1)), final_currency, check_range)
+
+        if item:
+            parsed.append(item)
 
     # Post-process to remove invalid items
-    valid_items = []
-    for item in parsed:
-        # Additional validation to remove problematic items
-        if is_valid_item_description(item["item"]) and "/" not in item["item"] and "-" not in item["item"]:
-            valid_items.append(item)
-    
-    return valid_items
+    return [item for item in parsed if "/" not in item["item"] and "-" not in item["item"]]
 
 def parse_totals(totals):
     result: Dict[str, Optional[Union[float, str]]] = {
@@ -330,108 +1033,1310 @@ def parse_totals(totals):
     
     # Second pass: extract values with OCR error correction
     for l in totals:
-        # Extract numeric value with OCR error correction
-        # Replace common OCR errors
-        clean_line = l.replace('O', '0').replace('S', '5').replace('I', '1').replace('Z', '2')
-        clean_line = clean_line.replace('B', '8').replace('G', '6').replace('Q', '0')
-        clean_line = re.sub(r'[€$£]', '', clean_line)  # Remove currency symbols
-        value_match = re.search(r'(\d+[.,]?\d{1,2})', clean_line)
+        value_match = TOTAL_VALUE_RE.search(clean_price(l))
         if not value_match:
             continue
             
         try:
-            val_str = value_match.group(1)
-            # Handle both comma and period as decimal separator
-            if ',' in val_str and '.' in val_str:
-                # Both present, use the last one as decimal separator
-                if val_str.rfind(',') > val_str.rfind('.'):
-                    val_str = val_str.replace('.', '').replace(',', '.')
-                else:
-                    val_str = val_str.replace(',', '')
-            elif ',' in val_str:
-                val_str = val_str.replace(',', '.')
-            
-            val = float(val_str)
-        except:
+            val = float(normalize_decimal(value_match.group(1)))
+        except ValueError:
             continue
             
         l_lower = l.lower()
         if "subtotal" in l_lower or "taxable" in l_lower:
             result["subtotal"] = val
-            if not result["currency"] and receipt_currency:
-                result["currency"] = receipt_currency
-        elif "tax" in l_lower or "vat" in l_lower or "vatise" in l_lower:
+        elif "tax" in l_lower or "vat" in l_lower:
             result["tax"] = val
-            if not result["currency"] and receipt_currency:
-                result["currency"] = receipt_currency
         elif "svc" in l_lower or "service" in l_lower:
             result["service_charge"] = val
-            if not result["currency"] and receipt_currency:
-                result["currency"] = receipt_currency
         elif "total" in l_lower:
             result["total"] = val
-            if not result["currency"] and receipt_currency:
-                result["currency"] = receipt_currency
     
     return result
 
 def clean_header(header):
     # Remove junk lines (like "yo?", "a")
-    cleaned = [h for h in header if len(h) > 2 and not re.match(r"^[a-z]$", h.lower())]
-    return cleaned
+    return [h for h in header if len(h) > 2]
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python receipt_scanner.py <image>")
-        sys.exit(1)
+def finish_result(header, items_parsed, totals_parsed, footer):
+    header = clean_header(header)
+
+    shop_name = header[0] if header else ""
+    shop_address = header[1:] if len(header) > 1 else []
+
+    receipt_currency = totals_parsed.get("currency")
+    
+    # If we still don't have a currency, try to detect from items or use default
+    if not receipt_currency and items_parsed:
+        # Use the currency from the first item
+        receipt_currency = items_parsed[0]["currency"]
+        totals_parsed["currency"] = receipt_currency
+    elif not receipt_currency:
+        # Default to USD for restaurant receipts
+        receipt_currency = "USD"
+        totals_parsed["currency"] = receipt_currency
+        # Update items to use the consistent currency
+        for item in items_parsed:
+            item["currency"] = receipt_currency
+
+    return {
+        "shop_name": shop_name,
+        "shop_address": shop_address,
+        "items": items_parsed,
+        "total": totals_parsed,
+        "footer": footer
+    }
+
+def parse_text(text, check_range=True):
+    """Sections of OCR text with items and totals parsed: (header, items, totals, footer)"""
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    header, items, totals, footer = split_sections(lines)
+
+    # Parse totals first to determine receipt currency
+    totals_parsed = parse_totals(totals)
+    
+    # Parse items with the determined receipt currency
+    items_parsed = parse_items(items, totals_parsed.get("currency"), check_range)
+    return header, items_parsed, totals_parsed, footer
 
+def build_result(text):
+    return finish_result(*parse_text(text))
+
+# ---------------------------------------------------------------------------
+# Geometry parsing
+#
+# Works on the word boxes from a single image_to_data pass: words are grouped
+# into rows by baseline and split into qty / description / price by position,
+# so the line structure does not depend on Tesseract's page segmentation.
+# ---------------------------------------------------------------------------
+
+def group_rows(words):
+    """Group word boxes into text rows by baseline, each sorted left to right"""
+    rows = []
+    for w in sorted(words, key=lambda w: w["top"] + w["height"]):
+        baseline = w["top"] + w["height"]
+        # Descenders push a word's bottom down by up to half its height
+        if rows and baseline - rows[-1]["baseline"] <= rows[-1]["tolerance"]:
+            rows[-1]["words"].append(w)
+        else:
+            rows.append({"baseline": baseline, "tolerance": max(2, w["height"] // 2), "words": [w]})
+    return [sorted(r["words"], key=lambda w: w["left"]) for r in rows]
+
+def _price_token(text):
+    if any(c.isdigit() for c in text):
+        text = text.translate(OCR_DIGIT_FIXES)
+    return text if PRICE_TOKEN_RE.fullmatch(text) else None
+
+def price_column(rows):
+    """Right edge of the price column and how far off a price may sit"""
+    edges, heights = [], []
+    for row in rows:
+        if _price_token(row[-1]["text"]):
+            edges.append(row[-1]["left"] + row[-1]["width"])
+            heights.append(row[-1]["height"])
+    if len(edges) < 2:
+        return None, 0
+    edges.sort()
+    heights.sort()
+    return edges[len(edges) // 2], 4 * heights[len(heights) // 2]
+
+def split_item_row(row, price_right=None, slack=0):
+    """Split a row into (qty, description, price string), or None"""
+    tokens = [(w["text"].replace('|', '').replace(':', ''), w) for w in row]
+    tokens = [(t, w) for t, w in tokens if t]
+    if len(tokens) < 2:
+        return None
+
+    # Price: the last word, sitting in the price column
+    price, price_word = _price_token(tokens[-1][0]), tokens[-1][1]
+    if price is None:
+        return None
+    if price_right is not None and price_word["left"] + price_word["width"] < price_right - slack:
+        return None
+    rest = tokens[:-1]
+    if rest and rest[-1][0] in CURRENCY_TOKENS:
+        rest.pop()
+
+    # Quantity: a number in its own column between description and price,
+    # a small number leading the row ("2 x Muffin", "2x Muffin") or right
+    # before the price ("Muffin 2 x")
+    qty = None
+    if len(rest) > 1:
+        m = QTY_TOKEN_RE.fullmatch(rest[-1][0])
+        prev, word = rest[-2][1], rest[-1][1]
+        if m and word["left"] - (prev["left"] + prev["width"]) > 2 * word["height"]:
+            qty = int(m.group(1))
+            rest = rest[:-1]
+    if qty is None and len(rest) > 1:
+        m = QTY_TOKEN_RE.fullmatch(rest[0][0])
+        if m:
+            qty = int(m.group(1))
+            rest = rest[1:]
+            if len(rest) > 1 and rest[0][0].lower() == "x":
+                rest = rest[1:]
+        elif len(rest) > 2 and rest[-1][0].lower() == "x" and QTY_TOKEN_RE.fullmatch(rest[-2][0]):
+            qty = int(QTY_TOKEN_RE.fullmatch(rest[-2][0]).group(1))
+            rest = rest[:-2]
+
+    return qty or 1, " ".join(t for t, _ in rest), clean_price(price)
+
+def parse_item_rows(rows, receipt_currency, check_range=True):
+    parsed = []
+    final_currency = receipt_currency if receipt_currency else "USD"
+    price_right, slack = price_column(rows)
+    for row in rows:
+        if clean_item_line(" ".join(w["text"] for w in row)) is None:
+            continue
+        split = split_item_row(row, price_right, slack)
+        if split is None:
+            continue
+        qty, desc, price_str = split
+        item = make_item(LEADING_QTY_RE.sub('', desc).strip(), qty, price_str, final_currency, check_range)
+        if item:
+            parsed.append(item)
+    return [item for item in parsed if "/" not in item["item"] and "-" not in item["item"]]
+
+def parse_words(words, check_range=True):
+    """Geometry counterpart of parse_text: ((header, items, totals, footer), row text)"""
+    rows = group_rows(words)
+    lines = [" ".join(w["text"] for w in row) for row in rows]
+    header, items, totals, footer = split_sections(lines)
+
+    # The items section is the contiguous run of rows right after the header
+    item_rows = rows[len(header):len(header) + len(items)]
+    totals_parsed = parse_totals(totals)
+    items_parsed = parse_item_rows(item_rows, totals_parsed.get("currency"), check_range)
+    return (header, items_parsed, totals_parsed, footer), "\n".join(lines)
+
+def build_result_from_words(words):
+    sections, text = parse_words(words)
+    return finish_result(*sections), text
+
+def check_result(result, text):
+    """Consistency checks used to stop the OCR cascade early"""
+    items = result["items"]
+    totals = result["total"]
+    item_sum = sum(item["cost"] * item["quantity"] for item in items)
+    cost_sum = sum(item["cost"] for item in items)
+
+    # Line prices may be unit prices or line totals, and the total may or may
+    # not include tax/service, so accept any of the usual combinations
+    targets = [totals["subtotal"], totals["total"]]
+    if totals["total"] is not None and (totals["tax"] or totals["service_charge"]):
+        targets.append(totals["total"] - (totals["tax"] or 0) - (totals["service_charge"] or 0))
+
+    def close(a, b):
+        return abs(a - b) <= max(RECONCILE_MIN_DIFF, RECONCILE_TOLERANCE * abs(b))
+
+    return {
+        "items": bool(items),
+        "currency": detect_currency(text) is not None,
+        "totals": any(t is not None and (close(item_sum, t) or close(cost_sum, t)) for t in targets),
+    }
+
+def validate_batch(parses):
+    """check_result for many parses at once, one NumPy column per field.
+
+    parses is a list of (items, totals, found, fallback): items and totals
+    as parse_items/parse_item_rows and parse_totals return them with
+    check_range=False, whether detect_currency finds a currency in the
+    parsed text, and a verified currency for receipts whose totals name
+    none (or None). Drops items outside MIN_ITEM_PRICE..MAX_ITEM_PRICE and
+    sets the resolved currency (the totals', else fallback, else USD) on
+    totals and items in place.
+    Returns the checks as {"items", "currency", "totals"} boolean arrays.
+    """
+    n = len(parses)
+    counts = np.fromiter((len(items) for items, _, _, _ in parses), dtype=np.int64, count=n)
+    owner = np.repeat(np.arange(n), counts)
+    cost = np.fromiter((item["cost"] for items, _, _, _ in parses for item in items),
+                       dtype=np.float64, count=len(owner))
+    quantity = np.fromiter((item["quantity"] for items, _, _, _ in parses for item in items),
+                           dtype=np.float64, count=len(owner))
+    keep = (cost >= MIN_ITEM_PRICE) & (cost <= MAX_ITEM_PRICE)
+    kept = np.bincount(owner[keep], minlength=n)
+    item_sum = np.bincount(owner[keep], weights=(cost * quantity)[keep], minlength=n)
+    cost_sum = np.bincount(owner[keep], weights=cost[keep], minlength=n)
+
+    def column(field):
+        return np.array([np.nan if totals[field] is None else totals[field] for _, totals, _, _ in parses],
+                        dtype=np.float64)
+
+    def close(a, b):
+        # NaN (a missing total) never compares close
+        return np.abs(a - b) <= np.maximum(RECONCILE_MIN_DIFF, RECONCILE_TOLERANCE * np.abs(b))
+
+    subtotal, total = column("subtotal"), column("total")
+    tax, service = np.nan_to_num(column("tax")), np.nan_to_num(column("service_charge"))
+    net = np.where((tax != 0) | (service != 0), total - tax - service, np.nan)
+    reconciles = np.zeros(n, dtype=bool)
+    for target in (subtotal, total, net):
+        reconciles |= close(item_sum, target) | close(cost_sum, target)
+
+    found = np.fromiter((found for _, _, found, _ in parses), dtype=bool, count=n)
+    fallback = np.fromiter((fallback is not None for _, _, _, fallback in parses), dtype=bool, count=n)
+    currencies = [totals["currency"] or fallback or "USD" for _, totals, _, fallback in parses]
+
+    starts = np.cumsum(counts) - counts
+    for i, (items, totals, _, _) in enumerate(parses):
+        mask = keep[starts[i]:starts[i] + counts[i]]
+        items[:] = [item for item, k in zip(items, mask) if k]
+        totals["currency"] = currencies[i]
+        for item in items:
+            item["currency"] = currencies[i]
+    return {"items": kept > 0, "currency": found | fallback, "totals": reconciles}
+
+def cascade_stages():
+    """OCR_CASCADE, with row OCR in place of the fast stage when ROW_OCR is on"""
+    if not ROW_OCR:
+        return OCR_CASCADE
+    return [("rows", "adaptive", [ROW_OCR_CONFIG])] + OCR_CASCADE[1:]
+
+def cascade_best(gray, deadline=None, info=None, on_partial=None, stages=None, required=None):
+    """Run OCR stages (default: cascade_stages()) until the best parse passes the required checks.
+
+    required names the check_result checks that end the cascade (default:
+    all of them). Returns (rank, result, ocr, words) for the best parse, or
+    None if no OCR pass returned any words (OCR failures are raised).
+    on_partial(result, stage) is
+    called after every stage that improved on the best parse so far.
+    """
+    if info is None:
+        info = {}
+    # Binarized images, or in low-memory mode the temp files holding them
+    variants = {}
+    best = None
+    stages_run = []
     try:
-        img = preprocess_image(sys.argv[1])
-        text = extract_text(img)
+        for name, method, configs in stages or cascade_stages():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if method not in variants:
+                with timed(info, f"binarize:{method}"):
+                    variant = binarize(gray, method)
+                    if LOW_MEMORY and not all(is_row_config(config) for config in configs):
+                        variant = write_ocr_input(variant)
+                    variants[method] = variant
+                    del variant
+            stages_run.append(name)
+            try:
+                ocr_results = run_ocr_configs(variants[method], configs, deadline=deadline, info=info,
+                                              label=f"ocr:{method}")
+            except Exception:
+                # Keep what the earlier stages read; with nothing yet, the scan fails
+                if best is None:
+                    raise
+                break
+            for config, text, confidence, words in ocr_results:
+                with timed(info, "parse"):
+                    candidates = []
+                    if PARSE_MODE in ("auto", "geometry"):
+                        candidates.append(("geometry",) + build_result_from_words(words))
+                    if PARSE_MODE in ("auto", "text"):
+                        candidates.append(("text", build_result(text), text))
+                for parser, result, parsed_text in candidates:
+                    checks = check_result(result, parsed_text)
+                    # Prefer results passing more checks, then the more confident one
+                    rank = (sum(checks.values()), confidence)
+                    if best is None or rank > best[0]:
+                        best = (rank, result, {"stage": name, "config": config, "parser": parser,
+                                               "checks": checks, "confidence": round(confidence, 1)}, words)
+            if on_partial is not None and best is not None and best[2]["stage"] == name:
+                on_partial(best[1], name)
+            if best is not None and all(best[2]["checks"][check] for check in (required or best[2]["checks"])):
+                break
+    finally:
+        for variant in variants.values():
+            if isinstance(variant, str):
+                os.unlink(variant)
 
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
-        header, items, totals, footer = split_sections(lines)
+    info["ocr_size"] = [gray.shape[1], gray.shape[0]]
+    info["ocr_pixels"] = int(gray.shape[0] * gray.shape[1])
+    info["stages_run"] = stages_run
+    return best
 
-        header = clean_header(header)
+def scan_cascade(gray, deadline=None, info=None, on_partial=None):
+    """OCR the cheapest way first and escalate only while the parse fails checks.
 
-        shop_name = header[0] if header else ""
-        shop_address = header[1:] if len(header) > 1 else []
+    on_partial(result, stage) is called after every stage that improved on
+    the best parse so far, so callers can show it before the scan finishes.
+    """
+    if info is None:
+        info = {}
+    best = cascade_best(gray, deadline=deadline, info=info, on_partial=on_partial)
+    if best is None:
+        result = build_result("")
+        ocr = {"stage": None, "config": None, "parser": None, "checks": {}, "confidence": 0.0}
+    else:
+        _, result, ocr, words = best
+        info["text_box"] = text_box(words, gray.shape)
+        info["raw_ocr"] = {"parser": ocr["parser"], "text": words_to_text(words), "words": words}
+    ocr["reconciled"] = bool(ocr["checks"]) and all(ocr["checks"].values())
+    result["ocr"] = ocr
+    return result
 
-        # Parse totals first to determine receipt currency
-        totals_parsed = parse_totals(totals)
-        receipt_currency = totals_parsed.get("currency")
-        
-        # Parse items with the determined receipt currency
-        items_parsed = parse_items(items, receipt_currency)
-        
-        # If we still don't have a currency, try to detect from items or use default
-        if not receipt_currency and items_parsed:
-            # Use the currency from the first item
-            receipt_currency = items_parsed[0]["currency"]
-            totals_parsed["currency"] = receipt_currency
-        elif not receipt_currency:
-            # Default to USD for restaurant receipts
-            receipt_currency = "USD"
-            totals_parsed["currency"] = receipt_currency
-            # Update items to use the consistent currency
-            for item in items_parsed:
-                item["currency"] = receipt_currency
-
-        result = {
-            "shop_name": shop_name,
-            "shop_address": shop_address,
-            "items": items_parsed,
-            "total": totals_parsed,
-            "footer": footer
-        }
+def text_box(words, shape):
+    """Bounding box of the OCR words as fractions of the image (x0, y0, x1, y1)"""
+    if not words:
+        return None
+    h, w = shape[:2]
+    return [round(min(wd["left"] for wd in words) / w, 4),
+            round(min(wd["top"] for wd in words) / h, 4),
+            round(max(wd["left"] + wd["width"] for wd in words) / w, 4),
+            round(max(wd["top"] + wd["height"] for wd in words) / h, 4)]
+
+def scan_shop_profile(gray, profile, deadline=None, info=None):
+    """Fast path for a known shop: one OCR pass with its winning settings.
+
+    Returns None unless the result reconciles and reads as that shop.
+    """
+    if info is None:
+        info = {}
+    h, w = gray.shape
+    x0, y0, _, y1 = profile["text_box"]
+    # Keep everything right of the learned left edge: line widths vary with
+    # the item names and prices, so the right edge does not carry over
+    crop = gray[int(max(0.0, y0 - PROFILE_CROP_PAD) * h):int(min(1.0, y1 + PROFILE_CROP_PAD) * h),
+                int(max(0.0, x0 - PROFILE_CROP_PAD) * w):]
+    if min(crop.shape) < 50:
+        crop = gray
+
+    method = profile["binarization"]
+    with timed(info, f"binarize:{method}"):
+        img = binarize(crop, method)
+    info["ocr_size"] = [img.shape[1], img.shape[0]]
+    info["ocr_pixels"] = int(img.shape[0] * img.shape[1])
+    info["stages_run"] = ["profile"]
+    ocr_results = run_ocr_configs(img, [profile["config"]], deadline=deadline, info=info,
+                                  label=f"ocr:{method}")
+    if not ocr_results:
+        return None
+    config, text, confidence, words = ocr_results[0]
+
+    with timed(info, "parse"):
+        if profile["parser"] == "geometry":
+            result, parsed_text = build_result_from_words(words)
+        else:
+            result, parsed_text = build_result(text), text
+    checks = check_result(result, parsed_text)
+    if not checks["currency"] and profile.get("currency"):
+        # The shop's receipts don't print a currency every time; use the learned one
+        result["total"]["currency"] = profile["currency"]
+        for item in result["items"]:
+            item["currency"] = profile["currency"]
+        checks["currency"] = True
+
+    same_shop = difflib.SequenceMatcher(None, shop_key(result["shop_name"]), profile["shop"]).ratio()
+    if same_shop < SHOP_NAME_MATCH or not all(checks.values()):
+        return None
+    result["ocr"] = {"stage": "profile", "config": config, "parser": profile["parser"], "checks": checks,
+                     "confidence": round(confidence, 1), "reconciled": True}
+    info["raw_ocr"] = {"parser": profile["parser"], "text": text, "words": words}
+    return result
+
+def scan_with_shop_profiles(gray, deadline=None, info=None, on_partial=None):
+    """Try the matching shop profile's fast path, else run the cascade and learn from it"""
+    if info is None:
+        info = {}
+    if not SHOP_PROFILES_ENABLED:
+        info["shop_profile"] = "off"
+        return scan_cascade(gray, deadline=deadline, info=info, on_partial=on_partial)
+
+    profiles = get_shop_profiles()
+    with timed(info, "shop_profile"):
+        fingerprint = header_fingerprint(gray)
+        profile = profiles.match(fingerprint)
+    if profile is not None:
+        result = scan_shop_profile(gray, profile, deadline=deadline, info=info)
+        if result is not None:
+            profiles.record("hits")
+            info["shop_profile"] = "hit"
+            return result
+        profiles.record("fallbacks")
+        info["shop_profile"] = "fallback"
+    else:
+        profiles.record("misses")
+        info["shop_profile"] = "miss"
+
+    result = scan_cascade(gray, deadline=deadline, info=info, on_partial=on_partial)
+    ocr = result["ocr"]
+    shop = shop_key(result["shop_name"])
+    if ocr["reconciled"] and shop and info.get("text_box"):
+        methods = {name: method for name, method, _ in cascade_stages()}
+        profiles.learn(fingerprint, {
+            "shop": shop,
+            "shop_name": result["shop_name"],
+            "binarization": methods[ocr["stage"]],
+            "config": ocr["config"],
+            "parser": ocr["parser"],
+            "text_box": info["text_box"],
+            "currency": result["total"]["currency"],
+        })
+    return result
+
+def read_image_bytes(source):
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Image file not found: {source}")
+    with open(source, "rb") as f:
+        return f.read()
+
+# PDF input is optional; without PyMuPDF only images can be scanned
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf  # PyMuPDF before 1.24
+    except ImportError:
+        pymupdf = None
+
+def is_pdf(data):
+    return data[:5] == b"%PDF-"
+
+def iter_pdf_pages(data):
+    """Render a PDF's pages to grayscale images, one page at a time"""
+    if pymupdf is None:
+        raise RuntimeError("PDF input needs PyMuPDF (pip install pymupdf)")
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        for page in doc:
+            pix = page.get_pixmap(dpi=PDF_DPI, colorspace=pymupdf.csGRAY, alpha=False)
+            yield np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width].copy()
+            del pix
+
+def iter_pages(sources):
+    """The pages of one receipt, lazily: PDF pages rendered to grayscale, other sources as encoded bytes"""
+    for source in sources:
+        data = read_image_bytes(source)
+        if is_pdf(data):
+            yield from iter_pdf_pages(data)
+        else:
+            yield data
+        del data
+
+def page_digest(page):
+    if isinstance(page, np.ndarray):
+        h = hashlib.sha256(str(page.shape).encode("ascii"))
+        h.update(np.ascontiguousarray(page).data)
+        return h.hexdigest()
+    return hashlib.sha256(page).hexdigest()
+
+def scan_page(page, deadline=None, info=None, budget_mb=None):
+    """OCR one page of a multi-page receipt; returns (words, text, height, ocr) of its best pass"""
+    if info is None:
+        info = {}
+    gray = prepare_gray(page, info, budget_mb)
+    del page
+    if CASCADE_ENABLED:
+        best = cascade_best(gray, deadline=deadline, info=info, required=PAGE_CHECKS)
+    else:
+        best = cascade_best(gray, deadline=deadline, info=info, stages=[("configs", "adaptive", OCR_CONFIGS)])
+    if best is None:
+        return [], "", gray.shape[0], None
+    _, _, ocr, words = best
+    info["ocr"] = dict(ocr)
+    return words, words_to_text(words), gray.shape[0], ocr
+
+def merge_pages(pages):
+    """Parse OCR'd pages [(words, text, height, ocr)] as one continuous receipt.
+
+    Page lines are concatenated in order, so split_sections carries its
+    header -> items -> totals state across page breaks; word boxes are
+    stacked by page height so rows never mix pages. Returns (result, raw OCR)
+    with the raw OCR as info["raw_ocr"] holds it.
+    """
+    words, texts, offset = [], [], 0
+    for index, (page_words, text, height, _) in enumerate(pages):
+        for w in page_words:
+            words.append(dict(w, top=w["top"] + offset, line=(index,) + tuple(w["line"])))
+        texts.append(text)
+        offset += height
+    text = "\n".join(t for t in texts if t)
+
+    candidates = []
+    if PARSE_MODE in ("auto", "geometry"):
+        candidates.append(("geometry",) + build_result_from_words(words))
+    if PARSE_MODE in ("auto", "text"):
+        candidates.append(("text", build_result(text), text))
+    best = None
+    for parser, result, parsed_text in candidates:
+        checks = check_result(result, parsed_text)
+        if best is None or sum(checks.values()) > sum(best[2].values()):
+            best = (parser, result, checks)
+    parser, result, checks = best
+    confidences = [ocr["confidence"] for _, _, _, ocr in pages if ocr is not None]
+    result["ocr"] = {"stage": "pages", "config": None, "parser": parser, "checks": checks,
+                     "confidence": round(sum(confidences) / len(confidences), 1) if confidences else 0.0,
+                     "reconciled": all(checks.values())}
+    return result, {"parser": parser, "text": text, "words": words}
+
+def scan_pages(pages, deadline=None, info=None, on_partial=None):
+    """Scan the pages of one receipt (see iter_pages) into one result.
+
+    Pages are pulled from the iterable only as one of PAGE_WORKERS page
+    workers frees up, so at most that many are in memory at once; a page
+    whose content hash was already seen is skipped. info["pages"] gets one
+    entry per page, and on_partial(result, stage) sees the merged result of
+    the leading pages whenever another page in order is done.
+    """
+    if info is None:
+        info = {}
+    page_infos = info["pages"] = []
+    # Concurrent pages share the memory budget
+    budget_mb = MEMORY_BUDGET_MB / PAGE_WORKERS if MEMORY_BUDGET_MB else 0
+    seen: Dict[str, int] = {}
+    order: List[int] = []  # Indexes of the pages being OCR'd, in page order
+    scanned: Dict[int, tuple] = {}
+    merged = {"pages": 0}
+
+    def collect(done):
+        for future in done:
+            index = futures.pop(future)
+            scanned[index] = future.result()
+        ready = merged["pages"]
+        while ready < len(order) and order[ready] in scanned:
+            ready += 1
+        if on_partial is not None and ready > merged["pages"]:
+            on_partial(merge_pages([scanned[i] for i in order[:ready]])[0], f"page {order[ready - 1] + 1}")
+        merged["pages"] = ready
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        for index, page in enumerate(pages):
+            page_info = {"page": index + 1}
+            page_infos.append(page_info)
+            digest = page_digest(page)
+            if digest in seen:
+                page_info["duplicate_of"] = seen[digest] + 1
+                continue
+            seen[digest] = index
+            if deadline is not None and time.monotonic() >= deadline:
+                page_info["skipped"] = "deadline"
+                continue
+            order.append(index)
+            futures[executor.submit(scan_page, page, deadline, page_info, budget_mb)] = index
+            del page
+            if len(futures) >= PAGE_WORKERS:
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(list(futures)).done)
+
+    if not order:
+        raise ValueError("No pages to scan")
+    result, info["raw_ocr"] = merge_pages([scanned[i] for i in order])
+    # Page stage timings add up like a single scan's, for metrics
+    timings = info.setdefault("timings", {})
+    for page_info in page_infos:
+        for stage, ms in page_info.get("timings", {}).items():
+            timings[stage] = round(timings.get(stage, 0.0) + ms, 3)
+    info["ocr_pixels"] = sum(p.get("ocr_pixels", 0) for p in page_infos)
+    info["pages_scanned"] = len(order)
+    return result
+
+def result_events(result, revision, stage=None):
+    """A parse of the receipt as stream events: header, one per item, then totals"""
+    base = {"revision": revision}
+    if stage is not None:
+        base["stage"] = stage
+    yield {"event": "header", **base, "shop_name": result["shop_name"], "shop_address": result["shop_address"]}
+    for index, item in enumerate(result["items"]):
+        yield {"event": "item", **base, "index": index, "item": item}
+    yield {"event": "totals", **base, "total": result["total"], "footer": result["footer"]}
+
+def _event_key(result):
+    return json.dumps([result["shop_name"], result["shop_address"], result["items"], result["total"],
+                       result["footer"]], sort_keys=True)
+
+def scan_receipt(source, timeout=None, use_cache=None, info=None, attach_timings=False, on_event=None):
+    """Run the full pipeline on an image path or encoded image bytes.
+
+    A PDF, or a list of paths/bytes (several photos of one long receipt), is
+    scanned page by page into one result (see scan_pages).
+
+    If info is a dict it is filled in with details about the run: which cache
+    tier answered ("memory", "disk", "miss" or "off"), per-stage timings in
+    milliseconds, the process's measured peak memory ("peak_rss_mb", OCR
+    processes counted as children) and, when the image was processed, the
+    image sizes and pixel counts. attach_timings also copies the timings into
+    the result.
+
+    on_event(event) streams the receipt while it is scanned: header, item and
+    totals events for every improved parse (numbered by "revision"; a later
+    revision replaces the earlier ones), then a "summary" event with the
+    final result.
+    """
+    if info is None:
+        info = {}
+    if use_cache is None:
+        use_cache = CACHE_ENABLED
+    deadline = time.monotonic() + timeout if timeout else None
+
+    on_partial = None
+    emitted = {"revision": 0, "key": None}
+    if on_event is not None:
+        def on_partial(partial, stage=None):
+            key = _event_key(partial)
+            if key == emitted["key"]:
+                return
+            emitted["revision"] += 1
+            emitted["key"] = key
+            for event in result_events(partial, emitted["revision"], stage):
+                on_event(event)
+
+    with timed(info, "total"):
+        result = _scan(source, deadline, use_cache, info, on_partial)
+    info["peak_rss_mb"] = peak_rss_mb()
+
+    if attach_timings:
+        result = dict(result, timings=info.get("timings", {}))
+    if on_event is not None:
+        # Cache hits, profile hits and catalog corrections only show up here
+        on_partial(result, (result.get("ocr") or {}).get("stage"))
+        on_event({"event": "summary", "revision": emitted["revision"], "result": result})
+    return result
+
+def document_bytes(sources):
+    """What identifies a multi-image receipt for caching and history: the images' digests in order"""
+    return b"".join(hashlib.sha256(read_image_bytes(source)).digest() for source in sources)
+
+def cache_config():
+    """Settings that change what a scan returns, for the result cache key"""
+    return {"cascade": cascade_stages() if CASCADE_ENABLED else None, "configs": OCR_CONFIGS,
+            "parse_mode": PARSE_MODE, "shop_profiles": SHOP_PROFILES_ENABLED,
+            "catalog": catalog_version(), "ocr_backend": get_ocr_backend().name,
+            # Preprocessing: the decode size, the text height OCR sees, and the
+            # memory budget that can shrink both
+            "decode_min_side": DECODE_MIN_SIDE, "text_height": TARGET_TEXT_HEIGHT,
+            "memory_budget_mb": MEMORY_BUDGET_MB, "low_memory": LOW_MEMORY}
+
+def _scan(source, deadline, use_cache, info, on_partial=None):
+    with timed(info, "read"):
+        if isinstance(source, (list, tuple)):
+            # Several photos of one receipt; they are read again page by page
+            sources = list(source)
+            image_bytes = document_bytes(sources)
+        else:
+            image_bytes = read_image_bytes(source)
+            sources = [image_bytes] if is_pdf(image_bytes) else None
+    key = None
+    info["cache"] = "off"
+    if use_cache:
+        with timed(info, "cache"):
+            key = cache_key(image_bytes, SCANNER_VERSION, cache_config())
+            result, info["cache"] = get_cache().get(key)
+        if result is not None:
+            return result
+
+    info["ocr_backend"] = get_ocr_backend().name
+    if sources is not None:
+        result = scan_pages(iter_pages(sources), deadline=deadline, info=info, on_partial=on_partial)
+    elif CASCADE_ENABLED:
+        result = scan_with_shop_profiles(prepare_gray(image_bytes, info), deadline=deadline, info=info,
+                                         on_partial=on_partial)
+    else:
+        img = preprocess_image(image_bytes, info=info)
+        text = extract_text(img, deadline=deadline, info=info)
+        info["raw_ocr"] = {"parser": "text", "text": text, "words": None}
+        with timed(info, "parse"):
+            result = build_result(text)
+
+    # Word boxes are bulky; they only go to the history store, not to callers
+    raw_ocr = info.pop("raw_ocr", None)
+    # Nothing was read (no OCR pass returned words, so no ocr.stage either):
+    # keep it out of the cache and history so a rescan can do better
+    read_text = raw_ocr is not None and bool(raw_ocr["text"].strip())
+    if CATALOG_PATH:
+        with timed(info, "catalog"):
+            correct_items(result["items"], get_catalog(), CATALOG_MIN_CONFIDENCE)
+
+    # A deadline-limited scan may be missing configs, so let a retry redo it
+    if key is not None and deadline is None and read_text:
+        get_cache().put(key, result)
+    if HISTORY_ENABLED and read_text:
+        with timed(info, "history"):
+            record_history(result, image_bytes, raw_ocr)
+    return result
+
+def scan_profiled(source, label, **kwargs):
+    """scan_receipt, with a profile dump if it is slower than PROFILE_SLOW_MS"""
+    if not PROFILE_DIR:
+        return scan_receipt(source, **kwargs)
+    safe_label = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(label))[-80:]
+    prefix = os.path.join(PROFILE_DIR, f"{safe_label}-{int(time.time() * 1000)}")
+    result, _, _ = run_profiled(scan_receipt, prefix, PROFILE_SLOW_MS, source, **kwargs)
+    return result
+
+# ---------------------------------------------------------------------------
+# Worker mode
+#
+# Keeps the interpreter, cv2 and the OCR backend loaded between receipts. Requests
+# are JSON lines: {"id": ..., "path": "..."} or {"id": ..., "image": "<base64>"}
+# (an image or a PDF), or "paths"/"images" lists for the pages of one receipt,
+# optionally with "timeout" seconds for the per-receipt OCR deadline,
+# "timings": true to get per-stage timings in the result and "stream": true to
+# get header/item/totals event lines (see scan_receipt) with the request's id
+# while it is scanned. Send
+# {"id": ..., "op": "stats"} for result-cache hit/miss counts and
+# {"id": ..., "op": "metrics"} for Prometheus-format metrics.
+# Each response is one JSON line carrying the same id, written as jobs finish.
+#
+# Scans run on a fixed set of worker processes behind a bounded queue (see
+# scan_scheduler.py). A scan that would overflow the queue is answered at once
+# with "status": "rejected"; one that runs past SCANNER_JOB_TIMEOUT (or the
+# request's "job_timeout") is killed along with its Tesseract processes.
+# Every scan is a job, named by the request's "job" or a generated id that is
+# echoed in the response. Jobs can also be run asynchronously:
+#   {"id": ..., "op": "submit", "path": ...}  -> {"status": "queued", "job": ...}
+#   {"id": ..., "op": "status", "job": ...}   -> state, and the response once finished
+#   {"id": ..., "op": "cancel", "job": ...}   -> "cancelled": true if it was still pending
+# ---------------------------------------------------------------------------
+
+def _run_job(request, emit=None):
+    job_id = request.get("id")
+    on_event = None
+    if request.get("stream") and emit is not None:
+        def on_event(event):
+            # The job's final response doubles as the summary
+            if event["event"] != "summary":
+                emit({"id": job_id, **event})
+    try:
+        if request.get("image") is not None:
+            source = base64.b64decode(request["image"])
+        elif request.get("path"):
+            source = request["path"]
+        elif request.get("images"):
+            source = [base64.b64decode(image) for image in request["images"]]
+        elif request.get("paths"):
+            source = list(request["paths"])
+        else:
+            raise ValueError("Request needs 'path', 'image', 'paths' or 'images'")
+        info = {}
+        result = scan_profiled(source, request.get("path") or (request.get("paths") or [job_id])[0],
+                               timeout=request.get("timeout"), info=info,
+                               attach_timings=bool(request.get("timings")), on_event=on_event)
+        return {"id": job_id, "status": "ok", "result": result, "info": info}
+    except Exception as e:
+        return {"id": job_id, "status": "error", "error": str(e), "type": type(e).__name__}
+
+# Cache hit/miss counts across all pool workers, tallied from job responses
+_serve_stats: Dict[str, int] = {"jobs": 0, "errors": 0, "memory": 0, "disk": 0, "miss": 0, "off": 0,
+                                "profile_hit": 0, "profile_fallback": 0, "profile_miss": 0}
+_serve_stats_lock = threading.Lock()
+
+# Where serve mode writes METRICS after each job, if anywhere
+_metrics_file = None
+
+# Serve mode's job scheduler, for its queue counts in serve_stats()
+_scheduler = None
+
+def observe_response(response):
+    """Feed a worker/batch response into METRICS"""
+    result = response.get("result") or {}
+    stage = (result.get("ocr") or {}).get("stage")
+    METRICS.observe_scan(response.get("info"), response.get("status", "error"), stage)
+
+def _count_response(response):
+    with _serve_stats_lock:
+        _serve_stats["jobs"] += 1
+        if response.get("status") != "ok":
+            _serve_stats["errors"] += 1
+        else:
+            if response["info"].get("cache") in _serve_stats:
+                _serve_stats[response["info"]["cache"]] += 1
+            if f"profile_{response['info'].get('shop_profile')}" in _serve_stats:
+                _serve_stats[f"profile_{response['info']['shop_profile']}"] += 1
+    observe_response(response)
+    if _metrics_file:
+        METRICS.write(_metrics_file)
+
+def serve_stats():
+    with _serve_stats_lock:
+        stats = dict(_serve_stats)
+    lookups = stats["memory"] + stats["disk"] + stats["miss"]
+    stats["cache_hit_rate"] = (stats["memory"] + stats["disk"]) / lookups if lookups else 0.0
+    matched = stats["profile_hit"] + stats["profile_fallback"]
+    profile_lookups = matched + stats["profile_miss"]
+    stats["profile_hit_rate"] = stats["profile_hit"] / profile_lookups if profile_lookups else 0.0
+    stats["profile_fallback_rate"] = stats["profile_fallback"] / matched if matched else 0.0
+    if _scheduler is not None:
+        stats["queue"] = _scheduler.snapshot()
+    return stats
+
+def _submit_line(scheduler, line, write):
+    """Handle one request line; returns the job id of a synchronous scan, if any"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object")
+    except ValueError as e:
+        write({"id": None, "status": "error", "error": str(e), "type": type(e).__name__})
+        return None
+    request_id = request.get("id")
+    op = request.get("op", "scan")
+    if op == "stats":
+        write({"id": request_id, "status": "ok", "stats": serve_stats()})
+        return None
+    if op == "metrics":
+        write({"id": request_id, "status": "ok", "metrics": METRICS.render()})
+        return None
+    if op == "status":
+        job = scheduler.status(request.get("job"))
+        if job is None:
+            write({"id": request_id, "status": "error", "error": f"Unknown job: {request.get('job')}",
+                   "type": "KeyError"})
+        else:
+            write({"id": request_id, "status": "ok", **job})
+        return None
+    if op == "cancel":
+        write({"id": request_id, "status": "ok", "job": request.get("job"),
+               "cancelled": scheduler.cancel(request.get("job"))})
+        return None
+    if op not in ("scan", "submit"):
+        write({"id": request_id, "status": "error", "error": f"Unknown op: {op}", "type": "ValueError"})
+        return None
+
+    def done(response):
+        _count_response(response)
+        if op == "scan":
+            write(response)
+    try:
+        job_id = scheduler.submit(request, job_id=request.get("job"), timeout=request.get("job_timeout"),
+                                  callback=done, on_event=write if op == "scan" else None)
+    except (QueueFull, ValueError) as e:
+        write({"id": request_id, "status": "rejected" if isinstance(e, QueueFull) else "error",
+               "error": str(e), "type": type(e).__name__, "job": request.get("job")})
+        return None
+    if op == "submit":
+        write({"id": request_id, "status": "queued", "job": job_id})
+        return None
+    return job_id
+
+def _line_writer(stream):
+    lock = threading.Lock()
+
+    def write(response):
+        data = json.dumps(response, ensure_ascii=False) + "\n"
+        with lock:
+            stream.write(data)
+            stream.flush()
+    return write
+
+def serve_stdin(scheduler):
+    write = _line_writer(sys.stdout)
+    for line in sys.stdin:
+        _submit_line(scheduler, line, write)
+    # Queued and running jobs are finished by scheduler.close() on EOF
+
+def serve_socket(scheduler, socket_path):
+    if not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("Unix sockets are not supported on this platform")
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            writer = self.wfile
+
+            class _Stream:
+                def write(self, data):
+                    writer.write(data.encode("utf-8"))
+
+                def flush(self):
+                    writer.flush()
+
+            write = _line_writer(_Stream())
+            pending = []
+            for raw in self.rfile:
+                job_id = _submit_line(scheduler, raw.decode("utf-8"), write)
+                if job_id is not None:
+                    pending.append(job_id)
+            # Answer this connection's scans before closing it
+            for job_id in pending:
+                scheduler.wait(job_id)
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    with Server(socket_path, Handler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+def serve_metrics_http(port):
+    """Expose METRICS at http://127.0.0.1:<port>/metrics from a daemon thread"""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # stdout carries the JSON-lines protocol
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def serve(workers, max_jobs, socket_path=None, metrics_file=None, metrics_port=None):
+    global _metrics_file, _scheduler
+    _metrics_file = metrics_file
+    if metrics_port:
+        serve_metrics_http(metrics_port)
+    # Workers are recycled after max_jobs receipts, and killed on timeout
+    _scheduler = ScanScheduler(_run_job, workers, queue_size=QUEUE_SIZE, job_timeout=JOB_TIMEOUT or None,
+                               max_jobs=max_jobs)
+    try:
+        if socket_path:
+            serve_socket(_scheduler, socket_path)
+        else:
+            serve_stdin(_scheduler)
+    finally:
+        _scheduler.close()
+
+# ---------------------------------------------------------------------------
+# Batch mode
+#
+# Scans a directory, glob or list of files on a process pool and writes one
+# compact JSON line per receipt, tagged with its path, as each one finishes.
+# ---------------------------------------------------------------------------
+
+# PDFs are scanned as one (multi-page) receipt each
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp", ".pdf"}
+
+def iter_batch_inputs(specs):
+    """Expand directories, globs, @listfiles and "-" (stdin list) lazily"""
+    for spec in specs:
+        if spec == "-":
+            for line in sys.stdin:
+                if line.strip():
+                    yield line.strip()
+        elif spec.startswith("@"):
+            with open(spec[1:], "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield line.strip()
+        elif os.path.isdir(spec):
+            for root, dirs, files in os.walk(spec):
+                dirs.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield os.path.join(root, name)
+        elif any(c in spec for c in "*?["):
+            yield from glob.iglob(spec, recursive=True)
+        else:
+            # Missing files are reported inline by the worker
+            yield spec
+
+def _scan_batch_file(path, timeout=None, attach_timings=False):
+    try:
+        info = {}
+        result = scan_profiled(path, path, timeout=timeout, info=info, attach_timings=attach_timings)
+        return {"path": path, "status": "ok", "result": result, "info": info}
+    except Exception as e:
+        return {"path": path, "status": "error", "error": str(e), "type": type(e).__name__}
+
+def scan_batch(specs, workers, timeout=None, out=None, attach_timings=False, metrics_file=None):
+    out = out or sys.stdout
+    # Keep only a couple of jobs per worker in flight so neither the input
+    # listing nor finished results pile up in memory
+    max_in_flight = workers * 2
+    counts = {"scanned": 0, "errors": 0}
+
+    def emit(done):
+        for future in done:
+            response = future.result()
+            counts["scanned"] += 1
+            if response["status"] != "ok":
+                counts["errors"] += 1
+            observe_response(response)
+            out.write(json.dumps(response, ensure_ascii=False, separators=(",", ":")) + "\n")
+        out.flush()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for path in iter_batch_inputs(specs):
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                emit(done)
+            pending.add(executor.submit(_scan_batch_file, path, timeout, attach_timings))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            emit(done)
+    if metrics_file:
+        METRICS.write(metrics_file)
+    return counts
+
+# ---------------------------------------------------------------------------
+# Bulk re-parse
+#
+# Re-runs only the parsing stage over the raw OCR stored in the history
+# database, so new parsing rules reach old receipts without their images.
+# ---------------------------------------------------------------------------
+
+# Receipts per worker task
+REPARSE_CHUNK = 2000
+
+def _reparse_chunk(rows):
+    """Re-parse history rows from ReceiptStore.iter_ocr(decode=False); returns [(receipt_id, result, text, changed)]"""
+    parses, finals, owners, olds = [], [], [], []
+    for index, (receipt_id, result_json, _, text, words_blob) in enumerate(rows):
+        old = json.loads(result_json)
+        old_ocr = old.get("ocr") or {}
+        # A currency the scan verified (say from a shop profile) outlives a re-parse
+        fallback = old["total"].get("currency") if (old_ocr.get("checks") or {}).get("currency") else None
+        candidates = []
+        if words_blob is not None and PARSE_MODE in ("auto", "geometry"):
+            candidates.append(("geometry",) + parse_words(unpack_words(words_blob), check_range=False))
+        if PARSE_MODE in ("auto", "text") or not candidates:
+            candidates.append(("text", parse_text(text, check_range=False), text))
+        for parser, sections, parsed_text in candidates:
+            _, items, totals, _ = sections
+            parses.append((items, totals, detect_currency(parsed_text) is not None, fallback))
+            finals.append((parser, sections))
+            owners.append(index)
+        olds.append((receipt_id, old, text))
+
+    checks = validate_batch(parses)
+    # Best parse per receipt: most checks passed, the first (geometry) on ties
+    owners = np.array(owners)
+    score = checks["items"].astype(np.int64) + checks["currency"] + checks["totals"]
+    order = np.lexsort((np.arange(len(owners)), -score, owners))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = owners[order][1:] != owners[order][:-1]
+
+    results = []
+    for candidate in order[first]:
+        receipt_id, old, text = olds[owners[candidate]]
+        parser, sections = finals[candidate]
+        result = finish_result(*sections)
+        # --no-cascade scans carry no OCR summary, so don't add one
+        if "ocr" in old:
+            ocr = result["ocr"] = dict(old["ocr"], parser=parser)
+            ocr["checks"] = {name: bool(values[candidate]) for name, values in checks.items()}
+            ocr["reconciled"] = all(ocr["checks"].values())
+        if CATALOG_PATH:
+            correct_items(result["items"], get_catalog(), CATALOG_MIN_CONFIDENCE)
+        results.append((receipt_id, result, text, result != old))
+    return results
+
+def reparse_history(workers, out=None):
+    """Re-parse every receipt in the history database that has raw OCR, in place"""
+    out = out or sys.stderr
+    store = get_history()
+    max_in_flight = workers * 2
+    counts = {"receipts": 0, "changed": 0}
+
+    def store_results(done):
+        for future in done:
+            results = future.result()
+            changed = [row[:3] for row in results if row[3]]
+            store.replace_results(changed)
+            counts["receipts"] += len(results)
+            counts["changed"] += len(changed)
+        print(json.dumps(counts), file=out, flush=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for rows in store.iter_ocr(REPARSE_CHUNK, decode=False):
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                store_results(done)
+            pending.add(executor.submit(_reparse_chunk, rows))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            store_results(done)
+    return counts
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Scan a receipt image and print the parsed JSON")
+    parser.add_argument("image", nargs="*",
+                        help="Path to the receipt image or PDF; several images are scanned as the pages "
+                             "of one receipt")
+    parser.add_argument("--timeout", type=float,
+                        help="Per-receipt deadline in seconds; return the best OCR result so far")
+    parser.add_argument("--ocr-workers", type=int,
+                        help="How many OCR configs to run in parallel (default: SCANNER_OCR_WORKERS)")
+    parser.add_argument("--ocr-backend", choices=["auto", "pytesseract", "tesserocr"],
+                        help="OCR engine: tesseract CLI per call, or in-process tesserocr "
+                             "(default: SCANNER_OCR_BACKEND, auto)")
+    parser.add_argument("--no-cascade", action="store_true",
+                        help="Run every OCR config instead of stopping once the parse reconciles")
+    parser.add_argument("--row-ocr", action="store_true",
+                        help="Start the cascade with per-row single-line OCR instead of whole-page OCR")
+    parser.add_argument("--parse-mode", choices=["auto", "geometry", "text"],
+                        help="Item parsing: word-box geometry, regexes over text, or both (default)")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="Keep binarized images only as OCR input files, to lower peak memory")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="Peak memory per scan; scans are downscaled or refused to stay under it "
+                             "(default: SCANNER_MEMORY_BUDGET_MB, 0 = none)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the result cache")
+    parser.add_argument("--no-shop-profiles", action="store_true",
+                        help="Always run the full OCR cascade instead of known shops' learned settings")
+    parser.add_argument("--shop-profile-stats", action="store_true",
+                        help="Print shop profile hit/fallback counts to stderr")
+    parser.add_argument("--catalog", metavar="FILE",
+                        help="Correct item names against this product list (one name per line)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="Don't record the scan in the receipt history database")
+    parser.add_argument("--output", help="Also write the result JSON to this file")
+    parser.add_argument("--stream", action="store_true",
+                        help="Print newline-delimited events (header, items, totals, summary) as the scan "
+                             "progresses instead of one JSON document")
+    parser.add_argument("--cache-stats", action="store_true",
+                        help="Print result cache hit/miss counts to stderr")
+    parser.add_argument("--scan-info", action="store_true",
+                        help="Print preprocessing details (sizes, pixels sent to OCR, peak memory) to stderr")
+    parser.add_argument("--timings", action="store_true",
+                        help="Attach per-stage timings (ms) to the result JSON")
+    parser.add_argument("--metrics-file",
+                        help="Write aggregate metrics in Prometheus text format to this file")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve mode: expose Prometheus metrics on 127.0.0.1:<port>/metrics")
+    parser.add_argument("--profile", metavar="PREFIX",
+                        help="Profile this scan; writes PREFIX.prof and PREFIX.txt (cProfile + tracemalloc)")
+    parser.add_argument("--batch", nargs="+", metavar="PATH",
+                        help="Scan directories, globs, @listfiles or - (paths on stdin) "
+                             "and stream JSON lines")
+    parser.add_argument("--reparse", action="store_true",
+                        help="Re-run parsing over the raw OCR stored in the history database and update "
+                             "the stored results (SCANNER_HISTORY_DB)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run as a long-lived worker reading JSON-lines requests")
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of stdin/stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes in serve, batch and reparse mode")
+    parser.add_argument("--max-jobs", type=int, default=100,
+                        help="Recycle a worker after this many jobs (0 = never)")
+    parser.add_argument("--queue-size", type=int,
+                        help="Serve mode: reject scans beyond this many waiting (default: SCANNER_QUEUE_SIZE)")
+    parser.add_argument("--job-timeout", type=float,
+                        help="Serve mode: kill a scan after this many seconds, 0 = never "
+                             "(default: SCANNER_JOB_TIMEOUT)")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args(sys.argv[1:])
+
+    global OCR_WORKERS, CACHE_ENABLED, CASCADE_ENABLED, PARSE_MODE, HISTORY_ENABLED, SHOP_PROFILES_ENABLED
+    global CATALOG_PATH, QUEUE_SIZE, JOB_TIMEOUT, ROW_OCR, LOW_MEMORY, MEMORY_BUDGET_MB, OCR_BACKEND
+    ocr_workers = args.ocr_workers
+    if args.batch and not ocr_workers:
+        # Batch mode already keeps every core busy with whole receipts
+        ocr_workers = 1
+    if ocr_workers:
+        # Also export it so spawned worker processes pick it up
+        OCR_WORKERS = ocr_workers
+        os.environ["SCANNER_OCR_WORKERS"] = str(ocr_workers)
+
+    if args.parse_mode:
+        PARSE_MODE = args.parse_mode
+        os.environ["SCANNER_PARSE_MODE"] = args.parse_mode
+
+    if args.ocr_backend:
+        OCR_BACKEND = args.ocr_backend
+        os.environ["SCANNER_OCR_BACKEND"] = args.ocr_backend
+
+    if args.row_ocr:
+        ROW_OCR = True
+        os.environ["SCANNER_ROW_OCR"] = "1"
+
+    if args.low_memory:
+        LOW_MEMORY = True
+        os.environ["SCANNER_LOW_MEMORY"] = "1"
+
+    if args.memory_budget is not None:
+        MEMORY_BUDGET_MB = args.memory_budget
+        os.environ["SCANNER_MEMORY_BUDGET_MB"] = str(args.memory_budget)
+
+    if args.no_cascade:
+        CASCADE_ENABLED = False
+        os.environ["SCANNER_CASCADE"] = "0"
+
+    if args.no_cache:
+        CACHE_ENABLED = False
+        os.environ["SCANNER_CACHE"] = "0"
+
+    if args.no_shop_profiles:
+        SHOP_PROFILES_ENABLED = False
+        os.environ["SCANNER_SHOP_PROFILES"] = "0"
+
+    if args.no_history:
+        HISTORY_ENABLED = False
+        os.environ["SCANNER_HISTORY"] = "0"
+
+    if args.catalog:
+        CATALOG_PATH = args.catalog
+        os.environ["SCANNER_CATALOG"] = args.catalog
+
+    if args.queue_size:
+        QUEUE_SIZE = args.queue_size
+    if args.job_timeout is not None:
+        JOB_TIMEOUT = args.job_timeout
+
+    if args.batch:
+        counts = scan_batch(args.batch, max(1, args.workers), timeout=args.timeout,
+                            attach_timings=args.timings, metrics_file=args.metrics_file)
+        print(json.dumps(counts), file=sys.stderr)
+        return
+
+    if args.reparse:
+        counts = reparse_history(max(1, args.workers))
+        print(json.dumps(counts))
+        return
+
+    if args.serve:
+        serve(max(1, args.workers), args.max_jobs, args.socket,
+              metrics_file=args.metrics_file, metrics_port=args.metrics_port)
+        return
+
+    if not args.image:
+        print("Usage: python receipt_scanner.py <image or PDF> [<more pages of the same receipt> ...]")
+        sys.exit(1)
+
+    try:
+        info = {}
+        kwargs = {"timeout": args.timeout, "info": info, "attach_timings": args.timings}
+        if args.stream:
+            kwargs["on_event"] = lambda event: print(json.dumps(event, ensure_ascii=False), flush=True)
+        source = args.image[0] if len(args.image) == 1 else args.image
+        if args.profile:
+            result, _, _ = run_profiled(scan_receipt, args.profile, 0, source, **kwargs)
+        else:
+            result = scan_receipt(source, **kwargs)
+        if args.metrics_file:
+            METRICS.observe_scan(info, "ok", (result.get("ocr") or {}).get("stage"))
+            METRICS.write(args.metrics_file)
+        if args.cache_stats:
+            stats = get_cache().snapshot()
+            stats["last"] = info["cache"]
+            print(json.dumps(stats), file=sys.stderr)
+        if args.shop_profile_stats:
+            stats = get_shop_profiles().snapshot()
+            stats["last"] = info.get("shop_profile")
+            print(json.dumps(stats), file=sys.stderr)
+        if args.scan_info:
+            print(json.dumps(info), file=sys.stderr)
 
         # Output JSON result with proper encoding
         json_output = json.dumps(result, indent=2, ensure_ascii=False)
-        print(json_output)
-        
-        # Also save to file for debugging
-        with open("receipt_output.json", "w", encoding="utf-8") as f:
-            f.write(json_output)
+        if not args.stream:
+            print(json_output)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(json_output)
 
     except Exception as e:
         error_result = {
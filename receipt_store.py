@@ -0,0 +1,350 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import zlib
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL UNIQUE,
+    scanned_at TEXT NOT NULL,
+    date TEXT NOT NULL,
+    shop_name TEXT COLLATE NOCASE,
+    currency TEXT,
+    subtotal REAL,
+    tax REAL,
+    service_charge REAL,
+    total REAL,
+    item_count INTEGER NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    receipt_id INTEGER NOT NULL REFERENCES receipts(id) ON DELETE CASCADE,
+    item TEXT NOT NULL COLLATE NOCASE,
+    quantity INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    currency TEXT
+);
+-- Raw OCR output of scanned receipts, so parsing can be re-run without the images
+CREATE TABLE IF NOT EXISTS ocr (
+    receipt_id INTEGER PRIMARY KEY REFERENCES receipts(id) ON DELETE CASCADE,
+    parser TEXT,
+    text TEXT NOT NULL,
+    words BLOB
+);
+CREATE INDEX IF NOT EXISTS receipts_shop ON receipts(shop_name, date);
+CREATE INDEX IF NOT EXISTS receipts_date ON receipts(date, currency, total);
+CREATE INDEX IF NOT EXISTS receipts_currency ON receipts(currency, date);
+CREATE INDEX IF NOT EXISTS items_item ON items(item, receipt_id);
+CREATE INDEX IF NOT EXISTS items_receipt ON items(receipt_id);
+"""
+
+# Dates printed on receipts: 2024-03-31, 31/03/2024, 31.03.24, ...
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+DMY_DATE_RE = re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})\b")
+# server.js names saved results randombill-<milliseconds since epoch>.json
+TIMESTAMP_NAME_RE = re.compile(r"(\d{12,})")
+
+# OCR word boxes are stored as zlib-compressed JSON rows of these fields
+WORD_FIELDS = ("text", "conf", "left", "top", "width", "height", "line")
+
+
+def pack_words(words):
+    rows = [[w[field] for field in WORD_FIELDS] for w in words]
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack_words(blob):
+    words = [dict(zip(WORD_FIELDS, row)) for row in json.loads(zlib.decompress(blob))]
+    for w in words:
+        w["line"] = tuple(w["line"])
+    return words
+
+
+def receipt_date(result, text=None):
+    """First date printed on the receipt as YYYY-MM-DD, or None.
+
+    text is the raw OCR text the result was parsed from. The parser drops
+    date lines ("Date: 12/03/2024" reads as an item line, then fails as
+    one), so the result alone only has dates that landed in the header or
+    footer; imports have nothing better.
+    """
+    lines = text.splitlines() if text else []
+    lines += [result.get("shop_name") or ""] + list(result.get("shop_address") or []) + list(result.get("footer") or [])
+    for line in lines:
+        match = ISO_DATE_RE.search(line)
+        if match:
+            year, month, day = (int(g) for g in match.groups())
+        else:
+            match = DMY_DATE_RE.search(line)
+            if not match:
+                continue
+            day, month, year = (int(g) for g in match.groups())
+            if month > 12 and day <= 12:
+                # Month first (US style)
+                day, month = month, day
+            if year < 100:
+                year += 2000
+        try:
+            return datetime(year, month, day).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+class ReceiptStore:
+    """SQLite history of scanned receipts, indexed by shop, date, currency and item.
+
+    Each receipt is stored once per source (an image hash for scans, a file
+    name for imports); storing a source again replaces its row, so a rescan
+    of the same image (say after an OCR fix) supersedes the earlier result.
+    The date column is the date printed on the receipt, or the scan date
+    when none could be read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Scanner worker threads share one connection; writes are serialized
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        # WAL lets readers run while another process is writing
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def _receipt_values(result):
+        """shop_name .. result column values for a receipts row"""
+        total = result.get("total") or {}
+        return (result.get("shop_name"), total.get("currency"), total.get("subtotal"), total.get("tax"),
+                total.get("service_charge"), total.get("total"), len(result.get("items") or []),
+                json.dumps(result, ensure_ascii=False))
+
+    def _insert_items(self, rows):
+        """Insert the items of (receipt_id, result) pairs"""
+        self._db.executemany(
+            "INSERT INTO items (receipt_id, item, quantity, cost, currency) VALUES (?, ?, ?, ?, ?)",
+            [(receipt_id, item.get("item", ""), item.get("quantity") or 1, item.get("cost") or 0.0,
+              item.get("currency") or (result.get("total") or {}).get("currency"))
+             for receipt_id, result in rows for item in result.get("items") or []])
+
+    def _upsert(self, result, source, scanned_at, ocr=None):
+        """Insert or replace the row for source; returns (receipt_id, whether it is new)"""
+        date = receipt_date(result, (ocr or {}).get("text")) or scanned_at[:10]
+        existing = self._db.execute("SELECT id FROM receipts WHERE source = ?", (source,)).fetchone()
+        receipt_id = self._db.execute(
+            "INSERT INTO receipts (source, scanned_at, date, shop_name, currency, subtotal, tax,"
+            " service_charge, total, item_count, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(source) DO UPDATE SET scanned_at = excluded.scanned_at, date = excluded.date,"
+            " shop_name = excluded.shop_name, currency = excluded.currency, subtotal = excluded.subtotal,"
+            " tax = excluded.tax, service_charge = excluded.service_charge, total = excluded.total,"
+            " item_count = excluded.item_count, result = excluded.result RETURNING id",
+            (source, scanned_at, date) + self._receipt_values(result)).fetchone()[0]
+        if existing is not None:
+            self._db.execute("DELETE FROM items WHERE receipt_id = ?", (receipt_id,))
+            self._db.execute("DELETE FROM ocr WHERE receipt_id = ?", (receipt_id,))
+        self._insert_items([(receipt_id, result)])
+        if ocr is not None:
+            self._db.execute(
+                "INSERT INTO ocr (receipt_id, parser, text, words) VALUES (?, ?, ?, ?)",
+                (receipt_id, ocr.get("parser"), ocr.get("text") or "",
+                 pack_words(ocr["words"]) if ocr.get("words") is not None else None))
+        return receipt_id, existing is None
+
+    def add(self, result, source, scanned_at=None, ocr=None):
+        """Store one result, replacing any earlier one for source; returns its row id.
+
+        ocr ({"parser", "text", "words"}) is the raw OCR output the result was
+        parsed from, kept so it can be re-parsed later (see iter_ocr).
+        """
+        scanned_at = scanned_at or datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self._lock, self._db:
+            return self._upsert(result, source, scanned_at, ocr)[0]
+
+    def add_many(self, records):
+        """Store (result, source, scanned_at) tuples in one transaction; returns how many were new"""
+        added = 0
+        with self._lock, self._db:
+            for result, source, scanned_at in records:
+                if self._upsert(result, source, scanned_at)[1]:
+                    added += 1
+        return added
+
+    def import_files(self, pattern):
+        """Bulk-import saved result JSON files (e.g. uploads/randombill-*.json)"""
+        records = []
+        for path in sorted(glob.glob(pattern)):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                continue
+            match = TIMESTAMP_NAME_RE.search(os.path.basename(path))
+            if match:
+                when = datetime.fromtimestamp(int(match.group(1)) / 1000, timezone.utc)
+            else:
+                when = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+            records.append((result, "file:" + os.path.basename(path), when.isoformat(timespec="seconds")))
+        return self.add_many(records)
+
+    def iter_ocr(self, batch_size=5000, decode=True):
+        """Stored receipts that have raw OCR, in id order, as lists of at most batch_size
+        (receipt_id, result, parser, text, words) tuples.
+
+        With decode=False result is left as JSON and words as packed bytes
+        (see unpack_words), for callers that decode them in worker processes.
+        """
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT r.id, r.result, o.parser, o.text, o.words FROM receipts r"
+                    " JOIN ocr o ON o.receipt_id = r.id WHERE r.id > ? ORDER BY r.id LIMIT ?",
+                    (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            if not decode:
+                yield [tuple(row) for row in rows]
+                continue
+            yield [(row[0], json.loads(row[1]), row[2], row[3],
+                    unpack_words(row[4]) if row[4] is not None else None) for row in rows]
+
+    def replace_results(self, rows):
+        """Overwrite the results of (receipt_id, result, OCR text) rows, items included, in one transaction"""
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE receipts SET date = COALESCE(?, date), shop_name = ?, currency = ?, subtotal = ?,"
+                " tax = ?, service_charge = ?, total = ?, item_count = ?, result = ? WHERE id = ?",
+                [(receipt_date(result, text),) + self._receipt_values(result) + (receipt_id,)
+                 for receipt_id, result, text in rows])
+            self._db.executemany("DELETE FROM items WHERE receipt_id = ?", [(row[0],) for row in rows])
+            self._insert_items([(receipt_id, result) for receipt_id, result, _ in rows])
+
+    @staticmethod
+    def _filters(shop=None, currency=None, since=None, until=None):
+        clauses, params = [], []
+        if shop is not None:
+            clauses.append("r.shop_name = ?")
+            params.append(shop)
+        if currency is not None:
+            clauses.append("r.currency = ?")
+            params.append(currency)
+        if since is not None:
+            clauses.append("r.date >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("r.date <= ?")
+            params.append(until)
+        return clauses, params
+
+    def _query(self, sql, params):
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def find(self, shop=None, item=None, currency=None, since=None, until=None, limit=100):
+        """Receipts matching every given filter, newest first (dates are YYYY-MM-DD, inclusive)"""
+        clauses, params = self._filters(shop, currency, since, until)
+        if item is not None:
+            clauses.append("r.id IN (SELECT receipt_id FROM items WHERE item = ?)")
+            params.append(item)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        rows = self._query(
+            "SELECT r.id, r.source, r.scanned_at, r.date, r.shop_name, r.currency, r.total, r.item_count, r.result"
+            f" FROM receipts r{where} ORDER BY r.date DESC, r.id DESC LIMIT ?", params + [limit])
+        for row in rows:
+            row["result"] = json.loads(row["result"])
+        return rows
+
+    def monthly_spend(self, shop=None, currency=None, since=None, until=None):
+        """Receipt count and summed totals per month and currency"""
+        clauses, params = self._filters(shop, currency, since, until)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return self._query(
+            "SELECT substr(r.date, 1, 7) AS month, r.currency, COUNT(*) AS receipts,"
+            f" ROUND(SUM(r.total), 2) AS total FROM receipts r{where}"
+            " GROUP BY month, r.currency ORDER BY month, r.currency", params)
+
+    def item_spend(self, item=None, shop=None, currency=None, since=None, until=None, by_month=True):
+        """Quantity and spend (quantity x cost) per item, optionally per month"""
+        clauses, params = self._filters(shop, currency, since, until)
+        if item is not None:
+            clauses.append("i.item = ?")
+            params.append(item)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        month = "substr(r.date, 1, 7)" if by_month else "NULL"
+        return self._query(
+            f"SELECT {month} AS month, i.item, i.currency, SUM(i.quantity) AS quantity,"
+            " ROUND(SUM(i.quantity * i.cost), 2) AS spend"
+            f" FROM items i JOIN receipts r ON r.id = i.receipt_id{where}"
+            " GROUP BY month, i.item, i.currency ORDER BY month, spend DESC", params)
+
+    def stats(self):
+        with self._lock:
+            receipts = self._db.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+            items = self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            ocr = self._db.execute("SELECT COUNT(*) FROM ocr").fetchone()[0]
+        return {"receipts": receipts, "items": items, "with_ocr": ocr}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Query the receipt history database")
+    parser.add_argument("--db", default=os.environ.get("SCANNER_HISTORY_DB", os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "receipts.db")), help="History database path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="Import saved result JSON files")
+    imp.add_argument("pattern", nargs="?", default=os.path.join("uploads", "randombill-*.json"))
+
+    for name, help_text in (("find", "List matching receipts"),
+                            ("monthly", "Spend per month and currency"),
+                            ("items", "Spend per item (and month)")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--shop")
+        p.add_argument("--currency")
+        p.add_argument("--since", help="YYYY-MM-DD")
+        p.add_argument("--until", help="YYYY-MM-DD")
+        if name != "monthly":
+            p.add_argument("--item")
+        if name == "find":
+            p.add_argument("--limit", type=int, default=100)
+        if name == "items":
+            p.add_argument("--all-time", action="store_true", help="Don't split by month")
+
+    sub.add_parser("stats", help="Row counts")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    store = ReceiptStore(args.db)
+    if args.command == "import":
+        output = {"imported": store.import_files(args.pattern)}
+    elif args.command == "find":
+        output = store.find(args.shop, args.item, args.currency, args.since, args.until, args.limit)
+    elif args.command == "monthly":
+        output = store.monthly_spend(args.shop, args.currency, args.since, args.until)
+    elif args.command == "items":
+        output = store.item_spend(args.item, args.shop, args.currency, args.since, args.until,
+                                  by_month=not args.all_time)
+    else:
+        output = store.stats()
+    print(json.dumps(output, indent=2, ensure_ascii=False))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def cache_key(image_bytes, version, config):
+    """Content address for a scan: image bytes + scanner version + OCR config"""
+    h = hashlib.sha256()
+    h.update(image_bytes)
+    h.update(b"\0")
+    h.update(str(version).encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of scan result dicts.
+
+    The memory tier is a per-process LRU; the disk tier is a directory of JSON
+    files shared between processes and trimmed to max_disk_bytes by evicting
+    the least recently used entries.
+    """
+
+    def __init__(self, directory=None, max_memory_entries=256, max_disk_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None
+        self.stats: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        """Return (result, tier) on a hit or (None, "miss")"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return json.loads(data), "memory"
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = f.read()
+                # Touch the file so disk eviction is LRU rather than FIFO
+                os.utime(path, None)
+                result = json.loads(data)
+            except (OSError, ValueError):
+                result = None
+            if result is not None:
+                with self._lock:
+                    self._remember(key, data)
+                    self.stats["disk_hits"] += 1
+                return result, "disk"
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, "miss"
+
+    def put(self, key, result):
+        data = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, data)
+
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A failed disk write only costs us a future miss
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(data.encode("utf-8"))
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_disk_bytes(self):
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _evict_disk(self):
+        # Drop least recently used files until we are 10% under the cap, so we
+        # don't walk the directory again on the very next write
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_disk_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            self.stats["evictions"] += 1
+        self._disk_bytes = total
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
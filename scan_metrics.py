@@ -0,0 +1,197 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# Histogram buckets in seconds for stage timings
+TIME_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+# Histogram buckets for pixels handed to OCR
+PIXEL_BUCKETS = [2.5e5, 5e5, 1e6, 2e6, 4e6, 8e6, 1.6e7]
+
+
+@contextmanager
+def timed(info, stage):
+    """Add the wall-clock milliseconds spent in the block to info["timings"]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        if info is not None:
+            timings = info.setdefault("timings", {})
+            # Stages that run more than once (e.g. a config retried on another
+            # binarization) accumulate
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed, 3)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class ScanMetrics:
+    """Aggregate counters and histograms over scans, rendered for Prometheus"""
+
+    def __init__(self, prefix="receipt_scanner"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._histograms: Dict[Tuple[str, tuple], _Histogram] = {}
+        self._help = {
+            "scans_total": ("counter", "Receipts scanned, by status"),
+            "cache_lookups_total": ("counter", "Result cache lookups, by tier"),
+            "ocr_stage_total": ("counter", "Receipts accepted by each OCR cascade stage"),
+            "shop_profile_total": ("counter", "Shop profile lookups, by outcome"),
+            "stage_seconds": ("histogram", "Time spent per pipeline stage"),
+            "ocr_pixels": ("histogram", "Pixels handed to OCR per receipt"),
+        }
+
+    def _inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, value, labels=(), buckets=TIME_BUCKETS):
+        key = (name, tuple(labels))
+        if key not in self._histograms:
+            self._histograms[key] = _Histogram(buckets)
+        self._histograms[key].observe(value)
+
+    def observe_scan(self, info, status="ok", ocr_stage=None):
+        """Record one scan from its info dict (as filled in by scan_receipt)"""
+        info = info or {}
+        with self._lock:
+            self._inc("scans_total", [("status", status)])
+            if info.get("cache"):
+                self._inc("cache_lookups_total", [("tier", info["cache"])])
+            if ocr_stage:
+                self._inc("ocr_stage_total", [("stage", ocr_stage)])
+            if info.get("shop_profile"):
+                self._inc("shop_profile_total", [("outcome", info["shop_profile"])])
+            for stage, ms in info.get("timings", {}).items():
+                self._observe("stage_seconds", ms / 1000.0, [("stage", stage)])
+            if info.get("ocr_pixels"):
+                self._observe("ocr_pixels", info["ocr_pixels"], buckets=PIXEL_BUCKETS)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            for name, (kind, help_text) in self._help.items():
+                full = f"{self.prefix}_{name}"
+                counters = sorted((labels, v) for (n, labels), v in self._counters.items() if n == name)
+                histograms = sorted((labels, h) for (n, labels), h in self._histograms.items() if n == name)
+                if not counters and not histograms:
+                    continue
+                lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                for labels, value in counters:
+                    lines.append(f"{full}{_labels(labels)} {value:g}")
+                for labels, h in histograms:
+                    for bound, count in zip(h.buckets, h.counts):
+                        lines.append(f"{full}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{full}_bucket{_labels(labels + (('le', '+Inf'),))} {h.total}")
+                    lines.append(f"{full}_sum{_labels(labels)} {h.sum:g}")
+                    lines.append(f"{full}_count{_labels(labels)} {h.total}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # Write-then-rename so a scraper never reads a half-written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+def _profile_new_threads(profilers):
+    """threading.setprofile hook giving each thread started from now on its own cProfile.Profile"""
+    def start(*_):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        profilers.append((threading.current_thread(), profiler))
+        profiler.enable()
+    return start
+
+
+def run_profiled(func, prefix, slow_ms=0, *args, **kwargs):
+    """Run func under cProfile and tracemalloc.
+
+    If it takes at least slow_ms, writes <prefix>.prof (load with pstats or
+    snakeviz) and <prefix>.txt (top functions and allocation sites).
+    Returns (func's result, elapsed ms, whether a profile was written).
+
+    cProfile only follows the thread that enables it, so threads func starts
+    (the OCR thread pools) are profiled separately and merged in once they
+    have finished; Python 3.12+ profiles every thread already. Threads that
+    outlive func (OCR passes abandoned at a deadline) are left out.
+    """
+    profiler = cProfile.Profile()
+    thread_profilers = []
+    profile_threads = sys.version_info < (3, 12)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        # Allocation sites are reported by line, so one frame is enough
+        tracemalloc.start(1)
+    start = time.perf_counter()
+    if profile_threads:
+        threading.setprofile(_profile_new_threads(thread_profilers))
+    profiler.enable()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        if profile_threads:
+            threading.setprofile(None)
+        elapsed = (time.perf_counter() - start) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        # Snapshots are slow on a large heap; only slow runs are reported
+        snapshot = tracemalloc.take_snapshot() if elapsed >= slow_ms else None
+        if started_tracing:
+            tracemalloc.stop()
+
+    if snapshot is None:
+        return result, elapsed, False
+
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    stats = pstats.Stats(profiler)
+    for thread, thread_profiler in thread_profilers:
+        if not thread.is_alive():
+            stats.add(thread_profiler)
+    stats.dump_stats(prefix + ".prof")
+    report = io.StringIO()
+    report.write(f"elapsed_ms {elapsed:.1f}\npeak_traced_bytes {peak}\n\n")
+    stats.stream = report
+    stats.sort_stats("cumulative").print_stats(30)
+    report.write("\nTop allocation sites:\n")
+    for stat in snapshot.statistics("lineno")[:20]:
+        report.write(f"{stat}\n")
+    with open(prefix + ".txt", "w", encoding="utf-8") as f:
+        f.write(report.getvalue())
+    return result, elapsed, True
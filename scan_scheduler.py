@@ -0,0 +1,306 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+# Job states, in order; the last four are final
+STATES = ("queued", "running", "done", "failed", "timeout", "cancelled")
+FINAL_STATES = ("done", "failed", "timeout", "cancelled")
+
+# How often a busy slot checks for cancellation while it waits on its worker
+POLL_INTERVAL = 0.1
+
+# Workers are (re)started from scheduler threads while the main thread may be
+# blocked reading stdin; a plain fork at that moment inherits the held stdin
+# lock and hangs in multiprocessing's child setup. The fork server forks from
+# a clean single-threaded process instead.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class QueueFull(Exception):
+    """The scheduler's queue is at capacity; the caller should retry later"""
+
+
+def _worker_main(target, conn):
+    # Own process group, so killing a stuck job also kills the Tesseract
+    # processes it spawned
+    if hasattr(os, "setsid"):
+        os.setsid()
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            return
+        if request is None:
+            return
+
+        def emit(event):
+            conn.send(("event", event))
+        conn.send(("done", target(request, emit)))
+
+
+class _Slot:
+    """One worker process and the thread feeding it jobs"""
+
+    def __init__(self, scheduler, index):
+        self.scheduler = scheduler
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.jobs_done = 0
+        self.thread = threading.Thread(target=self.run, name=f"scan-slot-{index}", daemon=True)
+
+    def start_process(self):
+        ctx = multiprocessing.get_context(START_METHOD)
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(self.scheduler.target, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+
+    def stop_process(self, kill=False):
+        if self.process is None:
+            return
+        if kill:
+            if hasattr(os, "killpg"):
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def run(self):
+        scheduler = self.scheduler
+        self.start_process()
+        while True:
+            job = scheduler._queue.get()
+            if job is None:
+                break
+            if not scheduler._start(job):
+                continue  # cancelled while queued
+            if self.process is None or not self.process.is_alive():
+                self.stop_process(kill=True)
+                self.start_process()
+            try:
+                self.conn.send(job["request"])
+            except Exception as e:
+                # The worker died after the liveness check (broken pipe) or the
+                # request can't be pickled; fail the job, not the slot thread
+                self.stop_process(kill=True)
+                scheduler._finish(job, {"status": "error", "error": f"Could not send job to scan worker: {e}",
+                                        "type": type(e).__name__}, "failed")
+                continue
+            deadline = job["started"] + job["timeout"] if job["timeout"] else None
+            response, state = None, None
+            while response is None:
+                wait = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - time.monotonic())
+                try:
+                    if self.conn.poll(max(0.0, wait)):
+                        kind, message = self.conn.recv()
+                        if kind == "done":
+                            response = message
+                            break
+                        scheduler._event(job, message)
+                        continue
+                except (EOFError, OSError):
+                    state = "failed"
+                    response = {"status": "error", "error": "Scan worker exited", "type": "WorkerExited"}
+                    break
+                if job["cancel"]:
+                    state = "cancelled"
+                    response = {"status": "error", "error": "Job cancelled", "type": "Cancelled"}
+                elif deadline is not None and time.monotonic() >= deadline:
+                    state = "timeout"
+                    response = {"status": "error", "error": f"Job timed out after {job['timeout']:g}s",
+                                "type": "TimeoutError"}
+            if state is not None:
+                # The worker is stuck (or gone); kill it with its OCR children
+                # and start a fresh one for the next job
+                self.stop_process(kill=True)
+            else:
+                self.jobs_done += 1
+                if scheduler.max_jobs and self.jobs_done >= scheduler.max_jobs:
+                    self.stop_process()
+            scheduler._finish(job, response, state)
+        self.stop_process()
+
+
+class ScanScheduler:
+    """Bounded job queue in front of a fixed set of worker processes.
+
+    target(request, emit) -> response dict runs in a worker process, and may
+    call emit(event) with progress events on the way. Jobs wait in a
+    queue of at most queue_size (submit raises QueueFull beyond that) and are
+    killed, worker and all, if they run longer than their timeout. A worker
+    is replaced after max_jobs jobs (0 = never). Finished jobs stay
+    pollable until keep_results newer ones have finished.
+    """
+
+    def __init__(self, target: Callable[[dict], dict], workers, queue_size=64, job_timeout=None,
+                 max_jobs=0, keep_results=1000):
+        self.target = target
+        self.job_timeout = job_timeout
+        self.max_jobs = max_jobs
+        self.keep_results = keep_results
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=queue_size)
+        self._jobs: Dict[str, dict] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self._cond = threading.Condition()
+        self.stats: Dict[str, int] = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0,
+                                      "timeout": 0, "cancelled": 0}
+        self._slots = [_Slot(self, i) for i in range(max(1, workers))]
+        for slot in self._slots:
+            slot.thread.start()
+
+    def submit(self, request, job_id=None, timeout=None, callback=None, on_event=None):
+        """Queue a job and return its id; raises QueueFull if the queue is at capacity.
+
+        callback(response) is called from a scheduler thread when the job
+        finishes, however it finishes; on_event(event) for each event the
+        job emits before that.
+        """
+        job_id = str(job_id) if job_id is not None else uuid.uuid4().hex
+        job = {"id": job_id, "request": request, "state": "queued", "cancel": False,
+               "timeout": timeout if timeout is not None else self.job_timeout,
+               "submitted": time.monotonic(), "started": None, "finished": None,
+               "response": None, "callback": callback, "on_event": on_event}
+        with self._cond:
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing["state"] not in FINAL_STATES:
+                raise ValueError(f"Job {job_id} is already queued or running")
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.stats["rejected"] += 1
+                raise QueueFull(f"Scan queue is full ({self._queue.maxsize} jobs waiting)")
+            self._finished.pop(job_id, None)
+            self._jobs[job_id] = job
+            self.stats["submitted"] += 1
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; False if it is unknown or already finished"""
+        with self._cond:
+            job = self._jobs.get(str(job_id))
+            if job is None or job["state"] in FINAL_STATES:
+                return False
+            job["cancel"] = True
+            # A running job is stopped by its slot; a queued one is finished
+            # here and taken out of the queue so its place is free again (a
+            # slot that has already dequeued it skips it)
+            was_queued = job["state"] == "queued"
+            if was_queued:
+                self._set_final(job, {"status": "error", "error": "Job cancelled", "type": "Cancelled"},
+                                "cancelled")
+                with self._queue.mutex:
+                    for i, queued in enumerate(self._queue.queue):
+                        if queued is job:
+                            del self._queue.queue[i]
+                            self._queue.not_full.notify()
+                            break
+        if was_queued:
+            self._notify(job)
+        return True
+
+    def status(self, job_id, with_result=True):
+        """Public view of a job (None if unknown): state, timings and, once finished, the response"""
+        with self._cond:
+            job = self._jobs.get(str(job_id))
+            if job is None:
+                return None
+            view = {"job": job["id"], "state": job["state"]}
+            now = time.monotonic()
+            if job["state"] == "queued":
+                with self._queue.mutex:
+                    view["position"] = sum(1 for j in self._queue.queue
+                                           if j is not None and j["state"] == "queued"
+                                           and j["submitted"] <= job["submitted"])
+            if job["started"] is not None:
+                view["queued_ms"] = round((job["started"] - job["submitted"]) * 1000, 1)
+                view["run_ms"] = round(((job["finished"] or now) - job["started"]) * 1000, 1)
+            if with_result and job["response"] is not None:
+                view["response"] = job["response"]
+            return view
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job is finished; returns its status view (None if unknown)"""
+        with self._cond:
+            job = self._jobs.get(str(job_id))
+            if job is None:
+                return None
+            self._cond.wait_for(lambda: job["state"] in FINAL_STATES, timeout)
+        return self.status(job_id)
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self.stats)
+            states = [job["state"] for job in self._jobs.values()]
+        stats["queued"] = states.count("queued")
+        stats["running"] = states.count("running")
+        stats["workers"] = len(self._slots)
+        stats["queue_size"] = self._queue.maxsize
+        return stats
+
+    def close(self):
+        """Finish the queued jobs, then stop the workers"""
+        for _ in self._slots:
+            self._queue.put(None)
+        for slot in self._slots:
+            slot.thread.join()
+
+    def _start(self, job):
+        with self._cond:
+            if job["state"] != "queued":
+                return False
+            job["state"] = "running"
+            job["started"] = time.monotonic()
+        return True
+
+    def _set_final(self, job, response, state):
+        # Caller holds self._cond
+        job["state"] = state
+        job["finished"] = time.monotonic()
+        job["response"] = dict(response, id=job["request"].get("id"), job=job["id"])
+        job["request"] = None  # may hold a whole base64 image
+        self.stats[state] += 1
+        self._finished[job["id"]] = None
+        while len(self._finished) > self.keep_results:
+            old_id, _ = self._finished.popitem(last=False)
+            self._jobs.pop(old_id, None)
+        self._cond.notify_all()
+
+    def _finish(self, job, response, state=None):
+        if state is None:
+            state = "done" if response.get("status") == "ok" else "failed"
+        with self._cond:
+            if job["state"] in FINAL_STATES:
+                return
+            self._set_final(job, response, state)
+        self._notify(job)
+
+    @staticmethod
+    def _event(job, event):
+        if job["on_event"] is not None and not job["cancel"]:
+            job["on_event"](event)
+
+    @staticmethod
+    def _notify(job):
+        if job["callback"] is not None:
+            job["callback"](job["response"])
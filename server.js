@@ -68,7 +68,10 @@ app.get('/', (req, res) => {
     status: 'Server is running', 
     timestamp: new Date().toISOString(),
     endpoints: {
-      processReceipt: 'POST /process-receipt',
+      processReceipt: 'POST /process-receipt (an image or PDF; ?async=1 to queue and poll, ?stream=1 for NDJSON events)',
+      processReceiptPages: 'POST /process-receipt-pages (several photos of one receipt, in order)',
+      scanJob: 'GET /scan-jobs/:job',
+      cancelScanJob: 'DELETE /scan-jobs/:job',
       generateReceipt: 'POST /generate-receipt'
     }
   });
@@ -79,7 +82,93 @@ app.get('/health', (req, res) => {
   res.json({ status: 'OK', timestamp: new Date().toISOString() });
 });
 
-app.post('/process-receipt', upload.single('image'), (req, res) => {
+// Long-lived Python workers speaking JSON lines over stdin/stdout: they keep
+// the interpreter and libraries (cv2, Tesseract bindings, fonts) loaded
+// between requests instead of paying startup per request. Each returns a
+// function that sends one request and resolves with the matching response;
+// event lines for the request (streamed scans) go to onEvent as they arrive.
+const createWorker = (name, args) => {
+  let child = null;
+  let buffer = '';
+  let nextJobId = 1;
+  const pending = new Map();
+
+  const start = () => {
+    child = spawn('python', args, {
+      env: { 
+        ...process.env, 
+        PYTHONIOENCODING: 'utf-8',
+        PYTHONLEGACYWINDOWSFSENCODING: '1'  // For Windows encoding issues
+      }
+    });
+
+    child.stdout.setEncoding('utf8');
+    child.stderr.setEncoding('utf8');
+
+    child.stdout.on('data', (data) => {
+      buffer += data;
+      let newline;
+      while ((newline = buffer.indexOf('\n')) !== -1) {
+        const line = buffer.slice(0, newline).trim();
+        buffer = buffer.slice(newline + 1);
+        if (!line) continue;
+        try {
+          const response = JSON.parse(line);
+          const request = pending.get(response.id);
+          if (!request) continue;
+          if (response.event) {
+            if (request.onEvent) request.onEvent(response);
+          } else {
+            pending.delete(response.id);
+            request.resolve(response);
+          }
+        } catch (e) {
+          console.error(`Unparseable ${name} output:`, line);
+        }
+      }
+    });
+
+    child.stderr.on('data', (data) => {
+      console.log(`${name} stderr:`, data.toString());
+    });
+
+    child.on('close', (code) => {
+      console.error(`${name} worker exited with code:`, code);
+      child = null;
+      buffer = '';
+      // Fail anything still in flight; the next request restarts the worker
+      for (const [id, request] of pending) {
+        request.resolve({ id, status: 'error', error: `${name} worker exited with code ${code}` });
+      }
+      pending.clear();
+    });
+  };
+
+  return (payload, onEvent) => new Promise((resolve) => {
+    if (!child) {
+      start();
+    }
+    const id = nextJobId++;
+    pending.set(id, { resolve, onEvent });
+    child.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+  });
+};
+
+const scannerRequest = createWorker('Scanner', ['receipt_scanner.py', '--serve',
+  '--workers', process.env.SCANNER_WORKERS || '2',
+  '--max-jobs', process.env.SCANNER_MAX_JOBS || '100']);
+const scanReceipt = (imagePath) => scannerRequest({ path: imagePath });
+
+// The scanner answers "rejected" when its job queue is full (SCANNER_QUEUE_SIZE)
+const rejectBusy = (res, response) => {
+  res.set('Retry-After', '5');
+  return res.status(503).json({ error: 'Scanner is busy, try again shortly', details: response.error });
+};
+
+// Receipt JSON goes over stdin, so big receipts don't hit argv length limits
+const renderReceipt = createWorker('Renderer', ['generate_receipt.py', '--batch', '-']);
+
+app.post('/process-receipt', upload.single('image'), async (req, res) => {
   console.log('Received request to process receipt');
   console.log('File info:', req.file);
   
@@ -90,81 +179,118 @@ app.post('/process-receipt', upload.single('image'), (req, res) => {
 
   const imagePath = req.file.path;
   console.log('Processing image:', imagePath);
-  
-  // Spawn Python process with proper environment for Unicode
-  const python = spawn('python', ['receipt_scanner.py', imagePath], {
-    env: { 
-      ...process.env, 
-      PYTHONIOENCODING: 'utf-8',
-      PYTHONLEGACYWINDOWSFSENCODING: '1'  // For Windows encoding issues
+
+  if (req.query.async) {
+    // Queue the scan and answer at once; the client polls /scan-jobs/:job.
+    // The image goes over inline so the upload can be removed right away.
+    const image = fs.readFileSync(imagePath).toString('base64');
+    fs.unlinkSync(imagePath);
+    const response = await scannerRequest({ op: 'submit', image });
+    if (response.status === 'rejected') {
+      return rejectBusy(res, response);
     }
-  });
+    if (response.status !== 'queued') {
+      return res.status(500).json({ error: 'Failed to queue scan', details: response.error });
+    }
+    return res.status(202).json({ job: response.job, status: `/scan-jobs/${response.job}` });
+  }
 
-  let output = '';
-  let error = '';
+  if (req.query.stream) {
+    // Newline-delimited events: header, item and totals lines for each
+    // improved parse ("revision"), then a summary line with the final result
+    res.type('application/x-ndjson');
+    let revision = 0;
+    const send = (event) => {
+      const { id, ...rest } = event;
+      revision = rest.revision || revision;
+      res.write(JSON.stringify(rest) + '\n');
+    };
+    const response = await scannerRequest({ path: imagePath, stream: true }, send);
+    fs.unlinkSync(imagePath);
+    if (response.status === 'ok') {
+      send({ event: 'summary', revision, result: response.result });
+    } else {
+      send({ event: 'error', status: response.status, error: response.error });
+    }
+    return res.end();
+  }
+  
+  const response = await scanReceipt(imagePath);
 
-  // Set encoding to handle Unicode characters properly
-  python.stdout.setEncoding('utf8');
-  python.stderr.setEncoding('utf8');
+  if (response.status === 'rejected') {
+    fs.unlinkSync(imagePath);
+    return rejectBusy(res, response);
+  }
 
-  python.stdout.on('data', (data) => {
-    output += data.toString();
-    console.log('Python stdout:', data.toString());
-  });
+  if (response.type === 'MemoryBudgetExceeded') {
+    // Too big to scan within SCANNER_MEMORY_BUDGET_MB; retrying won't help
+    fs.unlinkSync(imagePath);
+    return res.status(413).json({ error: 'Image too large to scan', details: response.error });
+  }
 
-  python.stderr.on('data', (data) => {
-    error += data.toString();
-    console.log('Python stderr:', data.toString());
-  });
+  if (response.status !== 'ok') {
+    console.error('Python script error:', response.error);
+    // Clean up uploaded file even on error
+    fs.unlinkSync(imagePath);
+    return res.status(500).json({ error: 'Python script failed', details: response.error });
+  }
 
-  python.on('close', (code) => {
-    console.log('Python process closed with code:', code);
-    
-    if (code !== 0) {
-      console.error('Python script error:', error);
-      // Clean up uploaded file even on error
-      fs.unlinkSync(imagePath);
-      return res.status(500).json({ error: 'Python script failed', details: error });
-    }
+  // The scanner records the result in its history database (receipt_store.py)
+  const result = response.result;
 
-    try {
-      // Find the JSON output in the Python script's output
-      const jsonStart = output.indexOf('{');
-      const jsonEnd = output.lastIndexOf('}') + 1;
-      
-      if (jsonStart === -1 || jsonEnd === -1) {
-        console.error('No JSON found in Python output:', output);
-        // Clean up uploaded file
-        fs.unlinkSync(imagePath);
-        return res.status(500).json({ error: 'No JSON found in Python output', details: output });
-      }
-      
-      const jsonOutput = output.substring(jsonStart, jsonEnd);
-      console.log('JSON output:', jsonOutput);
-      const result = JSON.parse(jsonOutput);
-      
-      // Save the result to a randombill.json file in the uploads directory
-      const randomBillFilename = `randombill-${Date.now()}.json`;
-      const randomBillPath = path.join('uploads', randomBillFilename);
-      fs.writeFileSync(randomBillPath, JSON.stringify(result, null, 2));
-      console.log('Saved receipt data to:', randomBillPath);
-      
-      // Clean up uploaded file
-      fs.unlinkSync(imagePath);
-      
-      res.json(result);
-    } catch (parseError) {
-      console.error('JSON parsing error:', parseError);
-      console.error('Output was:', output);
-      // Clean up uploaded file
-      fs.unlinkSync(imagePath);
-      res.status(500).json({ error: 'Failed to parse result', details: parseError.message, output: output });
+  // Clean up uploaded file
+  fs.unlinkSync(imagePath);
+  
+  res.json(result);
+});
+
+// Several photos of one long receipt, in order, scanned into one result
+app.post('/process-receipt-pages', upload.array('pages', 20), async (req, res) => {
+  if (!req.files || !req.files.length) {
+    return res.status(400).json({ error: 'No pages uploaded' });
+  }
+  const paths = req.files.map((file) => file.path);
+  const response = await scannerRequest({ paths });
+  paths.forEach((pagePath) => fs.unlinkSync(pagePath));
+
+  if (response.status === 'rejected') {
+    return rejectBusy(res, response);
+  }
+  if (response.type === 'MemoryBudgetExceeded') {
+    return res.status(413).json({ error: 'Image too large to scan', details: response.error });
+  }
+  if (response.status !== 'ok') {
+    console.error('Python script error:', response.error);
+    return res.status(500).json({ error: 'Python script failed', details: response.error });
+  }
+  res.json(response.result);
+});
+
+// Poll a queued scan: its state, then the result (or error) once it finishes
+app.get('/scan-jobs/:job', async (req, res) => {
+  const response = await scannerRequest({ op: 'status', job: req.params.job });
+  if (response.status !== 'ok') {
+    return res.status(404).json({ error: 'Unknown scan job', details: response.error });
+  }
+  const job = { job: response.job, state: response.state };
+  if (response.position !== undefined) job.position = response.position;
+  if (response.response) {
+    if (response.response.status === 'ok') {
+      job.result = response.response.result;
+    } else {
+      job.error = response.response.error;
     }
-  });
+  }
+  res.json(job);
+});
+
+app.delete('/scan-jobs/:job', async (req, res) => {
+  const response = await scannerRequest({ op: 'cancel', job: req.params.job });
+  res.json({ job: req.params.job, cancelled: Boolean(response.cancelled) });
 });
 
 // New endpoint to generate receipt image from accepted items
-app.post('/generate-receipt', (req, res) => {
+app.post('/generate-receipt', async (req, res) => {
   console.log('Received request to generate receipt');
   console.log('Receipt data:', req.body);
   
@@ -175,79 +301,24 @@ app.post('/generate-receipt', (req, res) => {
     return res.status(400).json({ error: 'Invalid receipt data' });
   }
 
-  try {
-    // Generate a unique filename for the receipt image
-    const timestamp = Date.now();
-    const receiptImageFilename = `receipt-${timestamp}.png`;
-    const receiptImagePath = path.join('uploads', receiptImageFilename);
-    
-    // Spawn Python process to generate the receipt image
-    const python = spawn('python', ['generate_receipt.py', JSON.stringify(receiptData), receiptImagePath], {
-      env: { 
-        ...process.env, 
-        PYTHONIOENCODING: 'utf-8',
-        PYTHONLEGACYWINDOWSFSENCODING: '1'  // For Windows encoding issues
-      }
-    });
-
-    let output = '';
-    let error = '';
-
-    // Set encoding to handle Unicode characters properly
-    python.stdout.setEncoding('utf8');
-    python.stderr.setEncoding('utf8');
-
-    python.stdout.on('data', (data) => {
-      output += data.toString();
-      console.log('Python stdout:', data.toString());
-    });
-
-    python.stderr.on('data', (data) => {
-      error += data.toString();
-      console.log('Python stderr:', data.toString());
-    });
+  // Generate a unique filename for the receipt image
+  const timestamp = Date.now();
+  const receiptImageFilename = `receipt-${timestamp}.png`;
+  const receiptImagePath = path.join('uploads', receiptImageFilename);
 
-    python.on('close', (code) => {
-      console.log('Python receipt generation process closed with code:', code);
-      
-      if (code !== 0) {
-        console.error('Python receipt generation error:', error);
-        return res.status(500).json({ error: 'Python receipt generation failed', details: error });
-      }
+  const response = await renderReceipt({ receipt: receiptData, output: receiptImagePath });
 
-      try {
-        // Parse the JSON output from the Python script
-        const jsonStart = output.indexOf('{');
-        const jsonEnd = output.lastIndexOf('}') + 1;
-        
-        if (jsonStart === -1 || jsonEnd === -1) {
-          console.error('No JSON found in Python output:', output);
-          return res.status(500).json({ error: 'No JSON found in Python output', details: output });
-        }
-        
-        const jsonOutput = output.substring(jsonStart, jsonEnd);
-        console.log('JSON output:', jsonOutput);
-        const result = JSON.parse(jsonOutput);
-        
-        if (result.status === 'success') {
-          res.json({
-            message: 'Receipt generated successfully',
-            filename: receiptImageFilename,
-            path: receiptImagePath
-          });
-        } else {
-          res.status(500).json({ error: 'Failed to generate receipt', details: result.message });
-        }
-      } catch (parseError) {
-        console.error('JSON parsing error:', parseError);
-        console.error('Output was:', output);
-        res.status(500).json({ error: 'Failed to parse result', details: parseError.message, output: output });
-      }
-    });
-  } catch (error) {
-    console.error('Error generating receipt:', error);
-    res.status(500).json({ error: 'Failed to generate receipt', details: error.message });
+  if (response.status !== 'success') {
+    const details = response.message || response.error;
+    console.error('Python receipt generation error:', details);
+    return res.status(500).json({ error: 'Failed to generate receipt', details });
   }
+
+  res.json({
+    message: 'Receipt generated successfully',
+    filename: receiptImageFilename,
+    path: receiptImagePath
+  });
 });
 
 // Create uploads directory if it doesn't exist
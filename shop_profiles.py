@@ -0,0 +1,151 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+# Header fingerprint: an average hash of the ink in the first text lines
+# (title, shop name), cropped tightly so it depends neither on the margins nor
+# on the item lines that follow. Hashing the binarized ink rather than gray
+# levels keeps it stable under photo noise, blur and slight rotation.
+HEADER_LINES = 2
+FINGERPRINT_WIDTH = 400
+HASH_SIZE = (64, 2)  # 128 bits
+# Fingerprints this many bits apart or fewer count as the same layout. Same-
+# shop photos measured up to 24 bits apart, different shops 30 or more; a
+# false match only costs a fallback, since the shop name is checked too.
+MAX_DISTANCE = 27
+
+
+def _text_lines(ink):
+    """(start, end) row spans of text lines in a 0/1 ink image"""
+    has_ink = ink.sum(axis=1) > max(2, ink.shape[1] // 100)
+    spans = []
+    start = None
+    for y, inked in enumerate(has_ink):
+        if inked and start is None:
+            start = y
+        elif not inked and start is not None:
+            if y - start >= 4:
+                spans.append((start, y))
+            start = None
+    if start is not None and len(has_ink) - start >= 4:
+        spans.append((start, len(has_ink)))
+    return spans
+
+
+def header_fingerprint(gray):
+    """128-bit hash of the receipt's first text lines as an int"""
+    h, w = gray.shape[:2]
+    scale = min(1.0, FINGERPRINT_WIDTH / w)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    spans = _text_lines(ink)[:HEADER_LINES]
+    if spans:
+        ink = ink[spans[0][0]:spans[-1][1]]
+        columns = np.flatnonzero(ink.any(axis=0))
+        ink = ink[:, columns[0]:columns[-1] + 1]
+    small = cv2.resize(ink.astype(np.float32), HASH_SIZE, interpolation=cv2.INTER_AREA)
+    bits = (small > np.median(small)).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def shop_key(name):
+    """Shop name reduced to lowercase letters and digits (OCR spacing varies)"""
+    return re.sub(r"[^a-z0-9]", "", (name or "").lower())
+
+
+class ShopProfiles:
+    """Learned per-shop OCR settings, persisted as one JSON file.
+
+    A profile is keyed on its header fingerprint and records the shop name,
+    the OCR binarization/config and parser that won, the text bounding box
+    (relative to the receipt) and the currency. The file is shared between
+    processes: it is re-read when another process has rewritten it, and
+    written with write-then-rename.
+    """
+
+    def __init__(self, path=None, max_profiles=500):
+        self.path = path
+        self.max_profiles = max_profiles
+        self._profiles: Dict[str, dict] = {}
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"hits": 0, "fallbacks": 0, "misses": 0, "learned": 0}
+
+    def _reload(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._profiles = json.load(f)
+            self._mtime = mtime
+        except (OSError, ValueError):
+            pass
+
+    def match(self, fingerprint):
+        """Closest profile within MAX_DISTANCE bits, or None"""
+        with self._lock:
+            self._reload()
+            best, best_distance = None, MAX_DISTANCE + 1
+            for key, profile in self._profiles.items():
+                distance = bin(int(key, 16) ^ fingerprint).count("1")
+                if distance < best_distance:
+                    best, best_distance = profile, distance
+            return best
+
+    def record(self, outcome):
+        """Count a lookup outcome: "hits", "fallbacks" or "misses" """
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def learn(self, fingerprint, profile):
+        with self._lock:
+            self._reload()
+            key = format(fingerprint, "x")
+            profile = dict(profile, updated=time.time())
+            self._profiles[key] = profile
+            if len(self._profiles) > self.max_profiles:
+                # Forget the profiles that have gone longest without a win
+                oldest = sorted(self._profiles, key=lambda k: self._profiles[k].get("updated", 0))
+                for old_key in oldest[:len(self._profiles) - self.max_profiles]:
+                    del self._profiles[old_key]
+            self.stats["learned"] += 1
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._profiles, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime
+        except OSError:
+            # Losing a profile only costs a slow scan next time
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["profiles"] = len(self._profiles)
+        matched = stats["hits"] + stats["fallbacks"]
+        lookups = matched + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["fallback_rate"] = stats["fallbacks"] / matched if matched else 0.0
+        return stats
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+# The scanner modules are flat scripts at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RECEIPT_LINES = [
+    "CORNER CAFE",
+    "Main Street",
+    "2 x Muffin $3.50",
+    "Coffee 2.25",
+    "Bagel 0.00",
+    "Subtotal 9.25",
+    "Tax 0.75",
+    "Total $10.00",
+    "Thank you",
+]
+
+
+@pytest.fixture
+def receipt_text():
+    return "\n".join(RECEIPT_LINES)
+
+
+@pytest.fixture
+def make_words():
+    """Word boxes like ocr_words returns for text lines: 30px rows, last word right-aligned at x=400"""
+    def make(lines, top=0, height=20):
+        words = []
+        for row, line in enumerate(lines):
+            tokens = line.split()
+            left = 10
+            for index, token in enumerate(tokens):
+                width = 10 * len(token)
+                if index == len(tokens) - 1 and len(tokens) > 1:
+                    left = 400 - width
+                words.append({"text": token, "conf": 90.0, "left": left, "top": top + 30 * row,
+                              "width": width, "height": height, "line": (1, 1, row + 1)})
+                left += width + 10
+        return words
+    return make
@@ -0,0 +1,43 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from generate_receipt import (LINE_HEIGHT, TILE_HEIGHT, WIDTH, draw_lines, generate_receipt_image, layout_receipt,
+                              write_png_tiles)
+
+
+def long_receipt(items=90):
+    return {"shop_name": "SUPER MART", "shop_address": ["1 Main Street"],
+            "items": [{"item": f"Item {n}", "quantity": 1 + n % 3, "cost": 1.25} for n in range(items)],
+            "total": {"total": 100.0}, "footer": ["Thank you"]}
+
+
+def test_tall_png_round_trips():
+    data = long_receipt()
+    lines, height = layout_receipt(data)
+    assert height > TILE_HEIGHT
+    image = Image.open(io.BytesIO(generate_receipt_image(data)))
+    image.load()
+    assert image.mode == "L"
+    assert image.size == (WIDTH, height)
+
+    expected = np.asarray(draw_lines(lines, 0, height))
+    pixels = np.asarray(image)
+    # Text rows either side of the first tile boundary, then the whole image
+    near = slice(TILE_HEIGHT - 2 * LINE_HEIGHT, TILE_HEIGHT + 2 * LINE_HEIGHT)
+    assert (pixels[near] < 128).any()
+    assert np.array_equal(pixels[near], expected[near])
+    assert np.array_equal(pixels, expected)
+
+
+@pytest.mark.parametrize("tile_height", [7, 100, 10000])
+def test_tiles_match_single_canvas(tile_height):
+    # Tile edges fall through the middle of text lines
+    lines, height = layout_receipt(long_receipt(8))
+    out = io.BytesIO()
+    write_png_tiles(lines, height, out, tile_height=tile_height)
+    image = Image.open(io.BytesIO(out.getvalue()))
+    assert image.size == (WIDTH, height)
+    assert np.array_equal(np.asarray(image), np.asarray(draw_lines(lines, 0, height)))
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import item_catalog
+from item_catalog import ItemCatalog, build_index, correct_items, index_path_for, normalize, open_catalog
+
+PRODUCTS = ["Whole Milk", "Olive Oil", "Chocolate Chip Cookies", "Bananas", "Avocado", "Toothpaste",
+            "Cheddar Cheese", "Whole Wheat Bread", "Orange Juice", "Greek Yogurt"]
+
+
+@pytest.fixture
+def catalog_path(tmp_path):
+    path = tmp_path / "catalog.txt"
+    path.write_text("\n".join(PRODUCTS + ["  Whole Milk  ", ""]) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_normalize():
+    assert normalize("2 x Whole-Milk  1L!") == "2 whole milk 1l"
+
+
+def test_build_index_dedupes(catalog_path, tmp_path):
+    with open(catalog_path, encoding="utf-8") as f:
+        assert build_index(f, str(tmp_path / "catalog.idx")) == len(PRODUCTS)
+    catalog = ItemCatalog(str(tmp_path / "catalog.idx"))
+    assert catalog.size == len(PRODUCTS)
+    assert [catalog.name(i) for i in range(catalog.size)] == PRODUCTS
+
+
+@pytest.mark.parametrize("query, match", [
+    ("Whole Milk", "Whole Milk"),
+    ("Wh0le Mllk", "Whole Milk"),
+    ("olive oii", "Olive Oil"),
+    ("Chocolate Chlp Cookles", "Chocolate Chip Cookies"),
+    ("Greek Yoghurt", "Greek Yogurt"),
+])
+def test_lookup(catalog_path, query, match):
+    name, confidence = open_catalog(catalog_path).lookup(query)
+    assert name == match
+    assert 0.75 <= confidence <= 1.0
+
+
+def test_lookup_without_match(catalog_path):
+    catalog = open_catalog(catalog_path)
+    assert catalog.lookup("") == (None, 0.0)
+    assert catalog.lookup("zzqx") == (None, 0.0)
+    assert catalog.lookup("Toothpaste")[1] == 1.0
+
+
+def test_index_rebuilt_when_stale_or_foreign(catalog_path):
+    open_catalog(catalog_path)
+    index_path = index_path_for(catalog_path)
+    with open(catalog_path, "a", encoding="utf-8") as f:
+        f.write("Peanut Butter\n")
+    stat = os.stat(index_path)
+    os.utime(catalog_path, (stat.st_atime, stat.st_mtime + 10))
+    assert open_catalog(catalog_path).lookup("peanut buter")[0] == "Peanut Butter"
+
+    with open(index_path, "r+b") as f:
+        f.write(b"NOTANIDX")
+    os.utime(index_path, (stat.st_atime, stat.st_mtime + 20))
+    with pytest.raises(ValueError):
+        ItemCatalog(index_path)
+    assert open_catalog(catalog_path).size == len(PRODUCTS) + 1
+
+
+def test_common_trigrams_do_not_block_matches(catalog_path, monkeypatch):
+    # Every trigram counts as common; the rarest MIN_LISTS are still used
+    monkeypatch.setattr(item_catalog, "MIN_COMMON_POSTINGS", 0)
+    monkeypatch.setattr(item_catalog, "COMMON_FRACTION", 0.0)
+    assert open_catalog(catalog_path).lookup("Bananas") == ("Bananas", 1.0)
+
+
+def test_correct_items(catalog_path):
+    items = [{"item": "Wh0le Mllk", "cost": 1.0}, {"item": "Bananas", "cost": 2.0}, {"item": "zzqx", "cost": 3.0}]
+    correct_items(items, open_catalog(catalog_path), 0.75)
+    assert items[0]["item"] == "Whole Milk"
+    assert items[0]["raw_item"] == "Wh0le Mllk"
+    assert items[1] == {"item": "Bananas", "cost": 2.0, "catalog_confidence": 1.0}
+    assert items[2] == {"item": "zzqx", "cost": 3.0, "catalog_confidence": 0.0}
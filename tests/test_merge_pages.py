@@ -0,0 +1,53 @@
+import receipt_scanner as rs
+
+
+def page(make_words, lines, height=600, confidence=80.0):
+    words = make_words(lines)
+    return words, rs.words_to_text(words), height, {"confidence": confidence}
+
+
+def test_pages_parse_as_one_receipt(make_words):
+    first = page(make_words, ["CORNER CAFE", "Main Street", "2 x Muffin $3.50"], confidence=80.0)
+    second = page(make_words, ["Coffee 2.25", "Subtotal 9.25", "Total $9.25", "Thank you"], confidence=90.0)
+    result, raw_ocr = rs.merge_pages([first, second])
+
+    assert result["shop_name"] == "CORNER CAFE"
+    assert [(i["item"], i["quantity"], i["cost"]) for i in result["items"]] == [("Muffin", 2, 3.5), ("Coffee", 1, 2.25)]
+    assert result["total"]["subtotal"] == 9.25
+    assert result["footer"] == ["Thank you"]
+    assert result["ocr"] == {"stage": "pages", "config": None, "parser": raw_ocr["parser"],
+                             "checks": {"items": True, "currency": True, "totals": True},
+                             "confidence": 85.0, "reconciled": True}
+    assert raw_ocr["text"] == first[1] + "\n" + second[1]
+
+
+def test_page_words_are_stacked(make_words):
+    first = page(make_words, ["SHOP", "Tea 1.50"], height=500)
+    second = page(make_words, ["Cake 2.50", "Total 4.00"], height=700)
+    _, raw_ocr = rs.merge_pages([first, second])
+    words = raw_ocr["words"]
+    assert [w["top"] for w in words if w["text"] == "Cake"] == [500]
+    # Line keys carry the page index, so page lines never merge
+    assert {w["line"][0] for w in words[:3]} == {0}
+    assert {w["line"][0] for w in words[3:]} == {1}
+    assert rs.words_to_text(words) == raw_ocr["text"]
+    # The input pages are left as they were
+    assert first[0][0]["line"] == (1, 1, 1)
+
+
+def test_blank_pages_are_skipped(make_words):
+    blank = ([], "", 400, None)
+    receipt = page(make_words, ["SHOP", "Tea 1.50", "Total $1.50"])
+    result, raw_ocr = rs.merge_pages([blank, receipt, blank])
+    assert [i["item"] for i in result["items"]] == ["Tea"]
+    assert result["ocr"]["confidence"] == 80.0
+    assert raw_ocr["text"] == receipt[1]
+    assert [w["top"] for w in raw_ocr["words"] if w["text"] == "SHOP"] == [400]
+
+
+def test_pages_without_text():
+    result, raw_ocr = rs.merge_pages([([], "", 400, None)])
+    assert result["items"] == []
+    assert result["ocr"]["confidence"] == 0.0
+    assert not result["ocr"]["reconciled"]
+    assert raw_ocr["text"] == ""
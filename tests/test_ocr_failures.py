@@ -0,0 +1,160 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import receipt_scanner as rs
+from scan_cache import ResultCache
+
+TSV_KEYS = ("text", "conf", "left", "top", "width", "height", "block_num", "par_num", "line_num")
+
+
+class FakeBackend:
+    """OCR backend answering every call with the same word boxes, or failing"""
+
+    name = "fake"
+    wants_file = False
+
+    def __init__(self, words=(), error=None, fail_after=None):
+        self.words = list(words)
+        self.error = error
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def data(self, img, config, timeout=0):
+        self.calls += 1
+        if self.error is not None and (self.fail_after is None or self.calls > self.fail_after):
+            raise self.error
+        data = {key: [] for key in TSV_KEYS}
+        for w in self.words:
+            for key in ("text", "conf", "left", "top", "width", "height"):
+                data[key].append(w[key])
+            for key, value in zip(("block_num", "par_num", "line_num"), w["line"]):
+                data[key].append(value)
+        return data
+
+    def text(self, img, config):
+        if self.error is not None:
+            raise self.error
+        return rs.words_to_text(self.words)
+
+
+@pytest.fixture
+def image_bytes():
+    img = np.full((600, 400), 255, np.uint8)
+    for row in range(8):
+        cv2.putText(img, "ITEM 1.00", (30, 60 + 60 * row), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+@pytest.fixture
+def scanner(monkeypatch, tmp_path):
+    """receipt_scanner with a fake OCR backend, an in-memory cache and a scratch history"""
+    monkeypatch.setattr(rs, "_cache", ResultCache(None))
+    monkeypatch.setattr(rs, "_history", None)
+    monkeypatch.setattr(rs, "HISTORY_DB", str(tmp_path / "receipts.db"))
+    monkeypatch.setattr(rs, "HISTORY_ENABLED", True)
+    monkeypatch.setattr(rs, "SHOP_PROFILES_ENABLED", False)
+    monkeypatch.setattr(rs, "CASCADE_ENABLED", True)
+    monkeypatch.setattr(rs, "ROW_OCR", False)
+    monkeypatch.setattr(rs, "CATALOG_PATH", "")
+    monkeypatch.setattr(rs, "MEMORY_BUDGET_MB", 0)
+
+    def use(backend):
+        monkeypatch.setattr(rs, "_ocr_backend", backend)
+        return backend
+    yield use
+    if rs._history is not None:
+        rs._history.close()
+
+
+def test_broken_ocr_raises(scanner, image_bytes):
+    scanner(FakeBackend(error=FileNotFoundError("tesseract is not installed")))
+    with pytest.raises(FileNotFoundError):
+        rs.scan_receipt(image_bytes, use_cache=True)
+    info = {}
+    with pytest.raises(FileNotFoundError):
+        rs.scan_receipt(image_bytes, use_cache=True, info=info)
+    # Nothing was cached or recorded for the failed scans
+    assert info["cache"] == "miss"
+    assert rs.get_history().stats()["receipts"] == 0
+
+
+def test_broken_ocr_raises_without_cascade(scanner, image_bytes, monkeypatch):
+    monkeypatch.setattr(rs, "CASCADE_ENABLED", False)
+    scanner(FakeBackend(error=FileNotFoundError("tesseract is not installed")))
+    with pytest.raises(FileNotFoundError):
+        rs.scan_receipt(image_bytes, use_cache=False)
+
+
+def test_empty_scan_is_not_cached_or_recorded(scanner, image_bytes):
+    scanner(FakeBackend())
+    result = rs.scan_receipt(image_bytes, use_cache=True)
+    assert result["ocr"]["stage"] is None
+    assert result["items"] == []
+    info = {}
+    rs.scan_receipt(image_bytes, use_cache=True, info=info)
+    assert info["cache"] == "miss"
+    assert rs.get_history().stats()["receipts"] == 0
+
+
+def test_scan_is_cached_and_recorded_with_raw_ocr(scanner, image_bytes, receipt_text, make_words):
+    scanner(FakeBackend(make_words(receipt_text.splitlines())))
+    result = rs.scan_receipt(image_bytes, use_cache=True)
+    assert result["ocr"]["reconciled"]
+    assert [i["item"] for i in result["items"]] == ["Muffin", "Coffee"]
+    info = {}
+    assert rs.scan_receipt(image_bytes, use_cache=True, info=info) == result
+    assert info["cache"] == "memory"
+    [[(_, stored, parser, text, words)]] = list(rs.get_history().iter_ocr())
+    assert stored == result
+    assert parser == result["ocr"]["parser"]
+    assert text == receipt_text
+    assert len(words) == len(receipt_text.split())
+
+
+@pytest.mark.parametrize("setting, value", [
+    ("MEMORY_BUDGET_MB", 4096.0),
+    ("LOW_MEMORY", True),
+    ("TARGET_TEXT_HEIGHT", 40),
+    ("DECODE_MIN_SIDE", 500),
+])
+def test_preprocessing_settings_are_part_of_the_cache_key(scanner, image_bytes, make_words, monkeypatch,
+                                                          setting, value):
+    scanner(FakeBackend(make_words(["SHOP", "Tea 1.50", "Total $1.50"])))
+    rs.scan_receipt(image_bytes, use_cache=True)
+    monkeypatch.setattr(rs, setting, value)
+    info = {}
+    rs.scan_receipt(image_bytes, use_cache=True, info=info)
+    assert info["cache"] == "miss"
+    rs.scan_receipt(image_bytes, use_cache=True, info=info)
+    assert info["cache"] == "memory"
+
+
+def test_later_stage_failure_keeps_earlier_result(scanner, image_bytes, make_words):
+    # The first stage reads a receipt that doesn't reconcile; every later call fails
+    backend = scanner(FakeBackend(make_words(["SHOP", "Tea 1.50", "Total 3.00"]),
+                                  error=RuntimeError("backend crashed"), fail_after=1))
+    result = rs.scan_receipt(image_bytes, use_cache=False)
+    assert backend.calls > 1
+    assert result["ocr"]["stage"] == rs.OCR_CASCADE[0][0]
+    assert [i["item"] for i in result["items"]] == ["Tea"]
+
+
+def test_deadline_timeout_is_not_an_ocr_failure(scanner):
+    class SlowBackend(FakeBackend):
+        def data(self, img, config, timeout=0):
+            time.sleep(timeout)
+            raise RuntimeError("Tesseract process timeout")
+
+    scanner(SlowBackend())
+    img = np.full((100, 100), 255, np.uint8)
+    assert rs.run_ocr_configs(img, rs.OCR_CONFIGS, deadline=time.monotonic() + 0.2) == []
+
+
+def test_run_ocr_configs_raises_when_every_config_fails(scanner):
+    scanner(FakeBackend(error=RuntimeError("backend crashed")))
+    img = np.full((100, 100), 255, np.uint8)
+    with pytest.raises(RuntimeError, match="backend crashed"):
+        rs.run_ocr_configs(img, rs.OCR_CONFIGS)
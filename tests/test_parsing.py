@@ -0,0 +1,63 @@
+import receipt_scanner as rs
+
+
+def test_parse_text_sections(receipt_text):
+    header, items, totals, footer = rs.parse_text(receipt_text)
+    assert header == ["CORNER CAFE", "Main Street"]
+    assert [(i["item"], i["quantity"], i["cost"]) for i in items] == [("Muffin", 2, 3.5), ("Coffee", 1, 2.25)]
+    assert totals == {"subtotal": 9.25, "tax": 0.75, "service_charge": None, "total": 10.0, "currency": "USD"}
+    assert footer == ["Thank you"]
+
+
+def test_parse_text_defers_price_range(receipt_text):
+    _, items, _, _ = rs.parse_text(receipt_text, check_range=False)
+    assert [i["item"] for i in items] == ["Muffin", "Coffee", "Bagel"]
+    assert items[-1]["cost"] == 0.0
+
+
+def test_build_result_finishes_parse_text(receipt_text):
+    result = rs.build_result(receipt_text)
+    assert result == rs.finish_result(*rs.parse_text(receipt_text))
+    assert result["shop_name"] == "CORNER CAFE"
+    assert result["shop_address"] == ["Main Street"]
+    assert all(item["currency"] == "USD" for item in result["items"])
+
+
+def test_parse_text_without_currency_defaults_to_usd():
+    result = rs.build_result("SHOP\nTea 1.50\nTotal 1.50")
+    assert result["total"]["currency"] == "USD"
+    assert result["items"][0]["currency"] == "USD"
+
+
+def test_parse_words_matches_text_parse(receipt_text, make_words):
+    sections, text = rs.parse_words(make_words(receipt_text.splitlines()))
+    assert text == receipt_text
+    assert sections == rs.parse_text(receipt_text)
+
+
+def test_parse_words_splits_by_geometry(make_words):
+    # Quantity in its own column between description and price
+    words = make_words(["SHOP", "Soup 2 4.00", "Bread 1.00", "Total 9.00"])
+    for w in words:
+        if w["text"] == "2":
+            w["left"] = 250
+    (_, items, totals, _), _ = rs.parse_words(words)
+    assert [(i["item"], i["quantity"], i["cost"]) for i in items] == [("Soup", 2, 4.0), ("Bread", 1, 1.0)]
+    assert totals["total"] == 9.0
+
+
+def test_parse_words_drops_off_column_prices(make_words):
+    words = make_words(["SHOP", "Soup 4.00", "Bread 1.00", "Note 12", "Total 5.00"])
+    for w in words:
+        if w["text"] == "12":
+            # Well left of the price column
+            w["left"] = 60
+    (_, items, _, _), _ = rs.parse_words(words)
+    assert [i["item"] for i in items] == ["Soup", "Bread"]
+
+
+def test_check_result(receipt_text):
+    checks = rs.check_result(rs.build_result(receipt_text), receipt_text)
+    assert checks == {"items": True, "currency": True, "totals": True}
+    checks = rs.check_result(rs.build_result("SHOP\nTea 1.50\nTotal 3.00"), "SHOP\nTea 1.50\nTotal 3.00")
+    assert checks == {"items": True, "currency": False, "totals": False}
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+import pytest
+
+import receipt_scanner as rs
+from generate_receipt import generate_receipt_image, layout_receipt
+
+
+@pytest.mark.parametrize("size, factor", [
+    ((4032, 3024), 2),
+    ((1724, 24547), 1),  # Long grocery receipt: the width holds the text
+    ((24547, 1724), 1),
+    ((8000, 6000), 4),
+    ((24000, 24000), 8),
+    (None, 1),
+])
+def test_decode_factor_follows_shorter_side(size, factor):
+    assert rs.decode_factor(size) == factor
+
+
+def test_tall_receipt_keeps_readable_text():
+    items = [{"item": f"Item {n}", "quantity": 1, "cost": 1.25} for n in range(120)]
+    data = {"shop_name": "SUPER MART", "shop_address": ["1 Main Street"], "items": items,
+            "total": {"total": 150.0}, "footer": ["Thank you"]}
+    rendered = cv2.imdecode(np.frombuffer(generate_receipt_image(data), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    # Photographed at several times the rendered size, like the benchmark corpus
+    photo = cv2.resize(rendered, None, fx=3, fy=3, interpolation=cv2.INTER_CUBIC)
+    assert photo.shape[0] > 10 * photo.shape[1]
+    ok, encoded = cv2.imencode(".png", photo)
+    assert ok
+
+    info = {}
+    gray = rs.prepare_gray(encoded.tobytes(), info, budget_mb=0)
+    assert info["decoded_size"] == [photo.shape[1], photo.shape[0]]
+    assert gray.shape[1] >= photo.shape[1] // 2
+    assert abs(rs.estimate_text_height(gray) - rs.TARGET_TEXT_HEIGHT) <= 4
+
+
+def noisy_photo(data, seed=0, sigma=12.0):
+    """A rendered receipt photographed at 3x with heavy sensor noise"""
+    rendered = cv2.imdecode(np.frombuffer(generate_receipt_image(data), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    photo = cv2.resize(rendered, None, fx=3, fy=3, interpolation=cv2.INTER_CUBIC).astype(np.float32)
+    photo += np.random.default_rng(seed).standard_normal(photo.shape, dtype=np.float32) * sigma
+    return np.clip(photo, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("sigma", [0.0, 12.0])
+def test_segment_rows_ignores_speckle(sigma):
+    items = [{"item": name, "quantity": 1, "cost": 2.5} for name in ("Latte", "Muffin", "Bagel", "Tea")]
+    data = {"shop_name": "CORNER CAFE", "shop_address": ["1 Main Street"], "items": items,
+            "total": {"total": 10.0}, "footer": ["Thank you"]}
+    lines, _ = layout_receipt(data)
+    binary = rs.binarize(noisy_photo(data, sigma=sigma))
+    if sigma:
+        # Speckle puts ink on nearly every scanline of the thresholded photo
+        assert ((binary < 128).sum(axis=1) > binary.shape[1] // 200).mean() > 0.9
+
+    rows = rs.segment_rows(binary)
+    assert len(rows) == len(lines)
+    heights = [bottom - top for top, bottom, _, _ in rows]
+    assert max(heights) < rs.ROW_MERGED_FACTOR * float(np.median(heights))
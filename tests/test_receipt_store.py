@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+from receipt_store import ReceiptStore, pack_words, receipt_date, unpack_words
+
+
+def make_result(shop="Corner Cafe", items=(("Muffin", 2, 3.5), ("Coffee", 1, 2.25)), total=9.25,
+                currency="EUR", footer=()):
+    return {
+        "shop_name": shop,
+        "shop_address": ["Main Street"],
+        "items": [{"item": name, "quantity": qty, "cost": cost, "currency": currency} for name, qty, cost in items],
+        "total": {"subtotal": None, "tax": None, "service_charge": None, "total": total, "currency": currency},
+        "footer": list(footer),
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = ReceiptStore(str(tmp_path / "receipts.db"))
+    yield s
+    s.close()
+
+
+@pytest.mark.parametrize("line, date", [
+    ("Date: 2024-03-31", "2024-03-31"),
+    ("31/03/2024 14:02", "2024-03-31"),
+    ("31.03.24", "2024-03-31"),
+    ("03/31/2024", "2024-03-31"),  # Month first
+    ("99/99/2024", None),
+    ("Total 12.50", None),
+])
+def test_receipt_date(line, date):
+    assert receipt_date(make_result(footer=[line])) == date
+
+
+def test_receipt_date_prefers_ocr_text():
+    # The parser drops the date line, so only the raw text still has it
+    result = make_result(footer=["Printed 01/01/2023"])
+    assert receipt_date(result, "Corner Cafe\nDate: 12/03/2024\nMuffin 3.50") == "2024-03-12"
+    assert receipt_date(result, "no date here") == "2023-01-01"
+
+
+def test_add_and_find(store):
+    first = store.add(make_result(), "sha256:a", scanned_at="2024-05-02T10:00:00+00:00",
+                      ocr={"parser": "text", "text": "Corner Cafe\nDate: 30/04/2024", "words": None})
+    store.add(make_result(shop="Deli", items=(("Bread", 1, 2.0),), total=2.0, currency="USD"), "sha256:b",
+              scanned_at="2024-06-01T09:00:00+00:00")
+    assert store.stats() == {"receipts": 2, "items": 3, "with_ocr": 1}
+
+    rows = store.find()
+    assert [row["source"] for row in rows] == ["sha256:b", "sha256:a"]
+    assert rows[1]["id"] == first
+    # The printed date, not the scan date
+    assert rows[1]["date"] == "2024-04-30"
+    assert rows[0]["date"] == "2024-06-01"
+    assert rows[1]["result"]["shop_name"] == "Corner Cafe"
+
+    assert [r["source"] for r in store.find(shop="corner cafe")] == ["sha256:a"]
+    assert [r["source"] for r in store.find(item="bread")] == ["sha256:b"]
+    assert [r["source"] for r in store.find(currency="EUR")] == ["sha256:a"]
+    assert [r["source"] for r in store.find(since="2024-05-01")] == ["sha256:b"]
+    assert [r["source"] for r in store.find(until="2024-04-30")] == ["sha256:a"]
+
+
+def test_rescan_replaces_earlier_result(store):
+    receipt_id = store.add(make_result(items=(), total=None), "sha256:a",
+                           ocr={"parser": "text", "text": "bad", "words": None})
+    again = store.add(make_result(), "sha256:a", ocr={"parser": "geometry", "text": "good", "words": []})
+    assert again == receipt_id
+    assert store.stats() == {"receipts": 1, "items": 2, "with_ocr": 1}
+    [row] = store.find()
+    assert row["item_count"] == 2
+    assert row["total"] == 9.25
+    [[(_, _, parser, text, words)]] = list(store.iter_ocr())
+    assert (parser, text, words) == ("geometry", "good", [])
+
+
+def test_add_many_counts_new_sources(store):
+    records = [(make_result(), "file:a.json", "2024-01-01T00:00:00+00:00"),
+               (make_result(shop="Deli"), "file:b.json", "2024-01-02T00:00:00+00:00")]
+    assert store.add_many(records) == 2
+    assert store.add_many(records[:1]) == 0
+    assert store.stats()["receipts"] == 2
+
+
+def test_import_files(store, tmp_path):
+    for name, shop in (("randombill-1714557600000.json", "Corner Cafe"), ("randombill-1717236000000.json", "Deli")):
+        (tmp_path / name).write_text(json.dumps(make_result(shop=shop)), encoding="utf-8")
+    (tmp_path / "randombill-broken.json").write_text("{", encoding="utf-8")
+    assert store.import_files(str(tmp_path / "randombill-*.json")) == 2
+    assert sorted(r["date"] for r in store.find()) == ["2024-05-01", "2024-06-01"]
+
+
+def test_rollups(store):
+    store.add(make_result(), "sha256:a", scanned_at="2024-05-02T10:00:00+00:00")
+    store.add(make_result(items=(("Muffin", 1, 3.5),), total=3.5), "sha256:b", scanned_at="2024-05-20T10:00:00+00:00")
+    store.add(make_result(), "sha256:c", scanned_at="2024-06-01T10:00:00+00:00")
+    assert store.monthly_spend() == [
+        {"month": "2024-05", "currency": "EUR", "receipts": 2, "total": 12.75},
+        {"month": "2024-06", "currency": "EUR", "receipts": 1, "total": 9.25},
+    ]
+    assert store.item_spend(item="muffin", by_month=False) == [
+        {"month": None, "item": "Muffin", "currency": "EUR", "quantity": 5, "spend": 17.5},
+    ]
+
+
+def test_words_round_trip():
+    words = [{"text": "Muffin", "conf": 91.5, "left": 10, "top": 20, "width": 60, "height": 18, "line": (0, 1, 1, 2)}]
+    assert unpack_words(pack_words(words)) == words
+
+
+def test_iter_ocr_and_replace_results(store):
+    words = [{"text": "Tea", "conf": 90.0, "left": 1, "top": 2, "width": 3, "height": 4, "line": (1, 1, 1)}]
+    ids = [store.add(make_result(shop=f"Shop {n}"), f"sha256:{n}",
+                     ocr={"parser": "geometry", "text": f"Shop {n}", "words": words}) for n in range(5)]
+    store.add(make_result(shop="No OCR"), "file:x.json")
+
+    batches = list(store.iter_ocr(batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [row[0] for batch in batches for row in batch] == ids
+    assert batches[0][0][4] == words
+    raw = next(store.iter_ocr(batch_size=1, decode=False))[0]
+    assert isinstance(raw[1], str) and unpack_words(raw[4]) == words
+
+    replacement = make_result(shop="Shop 0", items=(("Tea", 1, 1.0),), total=1.0)
+    store.replace_results([(ids[0], replacement, "Date: 02/02/2024")])
+    [row] = store.find(shop="Shop 0")
+    assert row["item_count"] == 1
+    assert row["total"] == 1.0
+    assert row["date"] == "2024-02-02"
+    assert store.item_spend(item="tea", by_month=False)[0]["quantity"] == 1
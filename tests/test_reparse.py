@@ -0,0 +1,123 @@
+import io
+
+import pytest
+
+import receipt_scanner as rs
+
+TEXTS = [
+    # Items add up to the subtotal
+    "CORNER CAFE\nMain Street\n2 x Muffin $3.50\nCoffee 2.25\nBagel 0.00\nSubtotal 9.25\nTax 0.75\nTotal $10.00",
+    # No currency anywhere, total off
+    "SHOP\nTea 1.50\nTotal 3.00",
+    # Total includes tax and service
+    "DINER\nSoup 6.00\nSteak 24.00\nTax 2.40\nService 3.00\nTotal EUR 35.40",
+    # Line totals rather than unit prices
+    "BAKERY\n3 x Bun 1.20\n2 x Cake 5.00\nTotal £6.20",
+    # Out-of-range prices only
+    "GARAGE\nEngine 25000.00\nWasher 0.00\nTotal $25000.00",
+    # Currency in the header, not in the totals
+    "INR STORE\nRice 40.00\nDal 60.00\nTotal 100.00",
+    # Nothing but a header
+    "JUST A HEADER",
+    "",
+]
+
+
+def reference(text):
+    result = rs.build_result(text)
+    return result, rs.check_result(result, text)
+
+
+def batched(parses, texts, fallbacks=None):
+    fallbacks = fallbacks or [None] * len(parses)
+    checks = rs.validate_batch([(items, totals, rs.detect_currency(text) is not None, fallback)
+                                for (_, items, totals, _), text, fallback in zip(parses, texts, fallbacks)])
+    results = [rs.finish_result(*sections) for sections in parses]
+    return results, [{name: bool(values[i]) for name, values in checks.items()} for i in range(len(parses))]
+
+
+def test_validate_batch_matches_check_result():
+    results, checks = batched([rs.parse_text(text, check_range=False) for text in TEXTS], TEXTS)
+    for text, result, check in zip(TEXTS, results, checks):
+        assert (result, check) == reference(text), text
+
+
+def test_validate_batch_matches_check_result_for_word_boxes(make_words):
+    texts = [text for text in TEXTS if text]
+    parses, parsed_texts = zip(*(rs.parse_words(make_words(text.splitlines()), check_range=False) for text in texts))
+    results, checks = batched(list(parses), parsed_texts)
+    for text, result, check in zip(texts, results, checks):
+        expected, parsed_text = rs.build_result_from_words(make_words(text.splitlines()))
+        assert (result, check) == (expected, rs.check_result(expected, parsed_text)), text
+
+
+def test_validate_batch_fallback_currency():
+    text = "SHOP\nTea 1.50\nTotal 1.50"
+    results, checks = batched([rs.parse_text(text, check_range=False)], [text], ["EUR"])
+    assert checks == [{"items": True, "currency": True, "totals": True}]
+    assert results[0]["total"]["currency"] == "EUR"
+    assert results[0]["items"][0]["currency"] == "EUR"
+
+
+def test_validate_batch_range_follows_constants(monkeypatch):
+    monkeypatch.setattr(rs, "MAX_ITEM_PRICE", 10)
+    text = "SHOP\nTea 1.50\nCake 12.00\nTotal $1.50"
+    results, checks = batched([rs.parse_text(text, check_range=False)], [text])
+    assert [i["item"] for i in results[0]["items"]] == ["Tea"]
+    assert checks[0]["totals"]
+
+
+def test_validate_batch_empty():
+    assert {name: len(values) for name, values in rs.validate_batch([]).items()} == \
+        {"items": 0, "currency": 0, "totals": 0}
+
+
+def scanned(text, words=None):
+    """A result as the scan cascade stores it, with its raw OCR"""
+    if words is not None:
+        result, parsed_text = rs.build_result_from_words(words)
+        parser = "geometry"
+    else:
+        result, parsed_text, parser = rs.build_result(text), text, "text"
+    checks = rs.check_result(result, parsed_text)
+    result["ocr"] = {"stage": "configs", "config": "--oem 3 --psm 6", "parser": parser, "checks": checks,
+                     "confidence": 80.0, "reconciled": all(checks.values())}
+    return result, {"parser": parser, "text": text, "words": words}
+
+
+@pytest.fixture
+def history(monkeypatch, tmp_path):
+    monkeypatch.setattr(rs, "_history", None)
+    monkeypatch.setattr(rs, "HISTORY_DB", str(tmp_path / "receipts.db"))
+    monkeypatch.setattr(rs, "PARSE_MODE", "auto")
+    monkeypatch.setattr(rs, "CATALOG_PATH", "")
+    yield rs.get_history()
+    rs._history.close()
+
+
+def test_reparse_reproduces_stored_results(history, make_words):
+    texts = [text for text in TEXTS if text]
+    for n, text in enumerate(texts):
+        words = make_words(text.splitlines()) if n % 2 else None
+        result, raw_ocr = scanned(text, words)
+        history.add(result, f"sha256:{n}", ocr=raw_ocr)
+    rows = next(history.iter_ocr(100, decode=False))
+    reparsed = rs._reparse_chunk(rows)
+    assert [changed for _, _, _, changed in reparsed] == [False] * len(texts)
+    assert [result for _, result, _, _ in reparsed] == [r for _, r, _, _, _ in next(history.iter_ocr(100))]
+
+
+def test_reparse_history_applies_new_rules(history, monkeypatch):
+    for source, text in (("sha256:a", "GARAGE\nTyres 800.00\nOil 40.00\nTotal $840.00"),
+                         ("sha256:b", "SHOP\nTea 1.50\nTotal $1.50")):
+        result, raw_ocr = scanned(text)
+        history.add(result, source, ocr=raw_ocr)
+    assert rs.reparse_history(1, out=io.StringIO()) == {"receipts": 2, "changed": 0}
+
+    monkeypatch.setattr(rs, "MAX_ITEM_PRICE", 500)
+    assert rs.reparse_history(1, out=io.StringIO()) == {"receipts": 2, "changed": 1}
+    [row] = history.find(shop="GARAGE")
+    assert [i["item"] for i in row["result"]["items"]] == ["Oil"]
+    assert row["result"]["ocr"]["checks"]["totals"] is False
+    assert row["item_count"] == 1
+    assert history.stats()["items"] == 2
@@ -0,0 +1,34 @@
+import pstats
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scan_metrics import run_profiled
+
+
+def ocr_pass():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def scan():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda _: ocr_pass(), range(2)))
+    return "result"
+
+
+def test_fast_run_writes_nothing(tmp_path):
+    result, elapsed, written = run_profiled(scan, str(tmp_path / "scan"), 60000)
+    assert (result, written) == ("result", False)
+    assert elapsed > 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_slow_run_profiles_worker_threads(tmp_path):
+    prefix = str(tmp_path / "profiles" / "scan")
+    assert run_profiled(scan, prefix, 0)[2]
+    functions = {name for _, _, name in pstats.Stats(prefix + ".prof").stats}
+    assert {"scan", "ocr_pass"} <= functions
+    report = open(prefix + ".txt", encoding="utf-8").read()
+    assert "ocr_pass" in report
+    assert "Top allocation sites:" in report
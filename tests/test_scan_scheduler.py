@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from scan_scheduler import QueueFull, ScanScheduler
+
+
+def sleeper(request, emit):
+    emit({"event": "started"})
+    time.sleep(request.get("sleep", 0))
+    return {"status": "ok", "slept": request.get("sleep", 0)}
+
+
+def wait_for_state(scheduler, job_id, state, timeout=30):
+    deadline = time.monotonic() + timeout
+    while scheduler.status(job_id)["state"] != state:
+        assert time.monotonic() < deadline, f"job never reached {state}"
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def scheduler():
+    schedulers = []
+
+    def make(**kwargs):
+        schedulers.append(ScanScheduler(sleeper, **kwargs))
+        return schedulers[-1]
+    yield make
+    for s in schedulers:
+        s.close()
+
+
+def test_job_runs_and_streams_events(scheduler):
+    s = scheduler(workers=1)
+    events, responses = [], []
+    job = s.submit({"sleep": 0}, callback=responses.append, on_event=events.append)
+    view = s.wait(job, 30)
+    assert view["state"] == "done"
+    assert view["response"]["slept"] == 0
+    assert events == [{"event": "started"}]
+    assert responses == [view["response"]]
+
+
+def test_queue_full_rejects(scheduler):
+    s = scheduler(workers=1, queue_size=1)
+    running = s.submit({"sleep": 2})
+    wait_for_state(s, running, "running")
+    queued = s.submit({"sleep": 0})
+    with pytest.raises(QueueFull):
+        s.submit({"sleep": 0})
+    assert s.status(queued) == {"job": queued, "state": "queued", "position": 1}
+    assert s.snapshot()["rejected"] == 1
+    assert s.cancel(running)
+    assert s.wait(queued, 30)["state"] == "done"
+
+
+def test_cancel_queued_job(scheduler):
+    s = scheduler(workers=1)
+    running = s.submit({"sleep": 2})
+    wait_for_state(s, running, "running")
+    queued = s.submit({"sleep": 0})
+    assert s.cancel(queued)
+    assert s.status(queued)["state"] == "cancelled"
+    assert not s.cancel(queued)
+    assert s.cancel(running)
+
+
+def test_cancelled_queued_jobs_free_their_places(scheduler):
+    s = scheduler(workers=1, queue_size=2)
+    running = s.submit({"sleep": 2})
+    wait_for_state(s, running, "running")
+    queued = [s.submit({"sleep": 0}) for _ in range(2)]
+    with pytest.raises(QueueFull):
+        s.submit({"sleep": 0})
+    assert all(s.cancel(job) for job in queued)
+    assert s.snapshot()["queued"] == 0
+    later = [s.submit({"sleep": 0}) for _ in range(2)]
+    assert s.status(later[1])["position"] == 2
+    assert s.cancel(running)
+    assert [s.wait(job, 30)["state"] for job in later] == ["done", "done"]
+    assert [s.status(job)["state"] for job in queued] == ["cancelled", "cancelled"]
+
+
+def test_cancel_running_job_replaces_worker(scheduler):
+    s = scheduler(workers=1)
+    job = s.submit({"sleep": 30})
+    wait_for_state(s, job, "running")
+    assert s.cancel(job)
+    view = s.wait(job, 30)
+    assert view["state"] == "cancelled"
+    assert view["response"]["type"] == "Cancelled"
+    # The slot carries on with a fresh worker
+    assert s.wait(s.submit({"sleep": 0}), 30)["state"] == "done"
+
+
+def test_timeout_kills_job(scheduler):
+    s = scheduler(workers=1, job_timeout=0.5)
+    job = s.submit({"sleep": 30})
+    view = s.wait(job, 30)
+    assert view["state"] == "timeout"
+    assert view["response"]["type"] == "TimeoutError"
+    assert s.wait(s.submit({"sleep": 0}, timeout=0), 30)["state"] == "done"
+
+
+def test_unsendable_job_fails_without_losing_the_slot(scheduler):
+    s = scheduler(workers=1)
+    job = s.submit({"sleep": 0, "callback": lambda: None})
+    view = s.wait(job, 30)
+    assert view["state"] == "failed"
+    assert "Could not send job" in view["response"]["error"]
+    assert s.wait(s.submit({"sleep": 0}), 30)["state"] == "done"
+
+
+def test_dead_worker_fails_job_and_restarts(scheduler):
+    s = scheduler(workers=1)
+    assert s.wait(s.submit({"sleep": 0}), 30)["state"] == "done"
+    slot = s._slots[0]
+    slot.process.kill()
+    slot.process.join()
+    # Died between the liveness check and the send
+    slot.process.is_alive = lambda: True
+    view = s.wait(s.submit({"sleep": 0}), 30)
+    assert view["state"] == "failed"
+    assert s.wait(s.submit({"sleep": 0}), 30)["state"] == "done"